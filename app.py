@@ -1,11 +1,22 @@
 import os
 import sys
 import subprocess
+import json
+import time
 import threading
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context
 from werkzeug.utils import secure_filename
 from utils.document_processor import DocumentProcessor
 from chatbot import RAGChatbot
+from utils.jobs import JobManager
+from utils.llm import GroqLLM
+from utils.embeddings import create_embedding_backend, shared_embedding_backends
+from utils.metadata_filter import FilterError, normalize_filters
+from utils.batch_qa import BatchAnswerer, parse_question
+from utils.collection_manager import (
+    Collection, CollectionManager, CollectionError, CollectionNotFound, CollectionNotReady, DEFAULT_COLLECTION
+)
+from utils import metrics
 
 # Create Flask app
 app = Flask(__name__)
@@ -13,23 +24,137 @@ app.secret_key = 'your_secret_key'  # For flash messages
 app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload size
 app.config['ALLOWED_EXTENSIONS'] = {'pdf', 'txt'}
+app.config['RETRIEVAL_BATCH_WINDOW_MS'] = 3  # Coalesce concurrent chat retrievals
+app.config['LLM_MAX_IN_FLIGHT'] = 8  # Concurrent Groq requests across all chat threads
+app.config['LLM_REQUESTS_PER_SECOND'] = None  # Client-side Groq rate limit, None for no limit
+app.config['COLLECTIONS_DIR'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'collections')
+app.config['COLLECTIONS_MAX_MEMORY_MB'] = 4096  # Loaded collections above this are evicted, None for no limit
+app.config['COLLECTIONS_MAX_LOADED'] = None  # Maximum loaded collections, None for no limit
+app.config['BATCH_MAX_QUESTIONS'] = 10000  # Questions accepted by one /api/chat/batch request
+app.config['BATCH_MAX_CONCURRENCY'] = app.config['LLM_MAX_IN_FLIGHT']  # LLM calls in flight per batch
 
 # Make sure upload folder exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-# Global chatbot instance
-chatbot_instance = None
+# Background index jobs; a single worker keeps index writes in order
+job_manager = JobManager(max_workers=1)
+
+# The LLM client and embedding model are shared by all collections
+shared_resources = {}
+shared_resources_lock = threading.Lock()
+
+def get_shared_resources():
+    """The shared GroqLLM and embedding backend, created on first use"""
+    with shared_resources_lock:
+        if not shared_resources:
+            shared_resources['llm'] = GroqLLM(
+                model_name="llama3-8b-8192",
+                max_in_flight=app.config['LLM_MAX_IN_FLIGHT'],
+                requests_per_second=app.config['LLM_REQUESTS_PER_SECOND']
+            )
+            shared_resources['embedding_backend'] = create_embedding_backend("sentence-transformers", "all-MiniLM-L6-v2")
+        return shared_resources['llm'], shared_resources['embedding_backend']
+
+def create_chatbot(collection):
+    """Open the chatbot of a collection; used by the collection manager"""
+    # Named collections are only indexed by their process route; the
+    # default collection keeps building its index on first use
+    if collection.name != DEFAULT_COLLECTION and not collection.index_exists():
+        raise CollectionNotReady(f"Collection '{collection.name}' has no index yet. Upload documents and process it first.")
+    llm, embedding_backend = get_shared_resources()
+    return RAGChatbot(
+        batch_window_ms=app.config['RETRIEVAL_BATCH_WINDOW_MS'],
+        llm=llm,
+        embedding_backend=embedding_backend,
+        name=collection.name,
+        **collection.processor_options()
+    )
+
+collection_manager = CollectionManager(
+    app.config['COLLECTIONS_DIR'],
+    create_chatbot,
+    max_memory_mb=app.config['COLLECTIONS_MAX_MEMORY_MB'],
+    max_loaded=app.config['COLLECTIONS_MAX_LOADED']
+)
+
+# The original single index is the "default" collection
+collection_manager.register(Collection(
+    DEFAULT_COLLECTION,
+    data_dir=app.config['UPLOAD_FOLDER'],
+    index_file='faiss_index.faiss',
+    data_file='documents_data',
+    manifest_file='index_manifest.json',
+    bm25_file='bm25_index'
+))
 
 def get_chatbot():
-    """Get or initialize the chatbot instance"""
-    global chatbot_instance
-    if chatbot_instance is None:
-        try:
-            chatbot_instance = RAGChatbot()
-        except Exception as e:
-            print(f"Error initializing chatbot: {e}")
-            return None
-    return chatbot_instance
+    """
+    Get or initialize the chatbot of the default collection
+    
+    The collection manager holds a per-collection load lock, so concurrent
+    first requests wait for one RAGChatbot instead of each building their own.
+    """
+    try:
+        return collection_manager.chatbot(DEFAULT_COLLECTION)
+    except Exception as e:
+        print(f"Error initializing chatbot: {e}")
+        return None
+
+# Warm-up state reported by /readyz
+readiness = {'ready': False, 'error': None, 'started_at': None, 'finished_at': None, 'index_loaded': False}
+readiness_lock = threading.Lock()
+
+def warm_up():
+    """
+    Load everything a first request would, so no user waits for it
+    
+    Loads the embedding model, the Groq client and its tokenizer, opens the default
+    collection's index if it has one, and runs a dummy encode and search.
+    wsgi.py calls this before gunicorn forks its workers, so the model weights
+    and the memory-mapped index are shared copy-on-write.
+    """
+    with readiness_lock:
+        if readiness['started_at'] is not None:
+            return
+        readiness['started_at'] = time.time()
+    try:
+        print("Warming up...")
+        llm, embedding_backend = get_shared_resources()
+        embedding_backend.encode(["warm-up"])
+        llm.context_packer.token_counter.load()
+        
+        default = collection_manager.get(DEFAULT_COLLECTION)
+        if default.index_exists():
+            chatbot = collection_manager.chatbot(DEFAULT_COLLECTION)
+            chatbot.retriever.retrieve_many(["warm-up"])
+            readiness['index_loaded'] = True
+        print(f"Warm-up finished in {time.time() - readiness['started_at']:.1f}s")
+        print(metrics.format_startup_report())
+    except Exception as e:
+        print(f"Warm-up failed: {e}")
+        readiness['error'] = str(e)
+    finally:
+        readiness['finished_at'] = time.time()
+        readiness['ready'] = readiness['error'] is None
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: the process is serving requests"""
+    return jsonify({'status': 'ok', 'pid': os.getpid()})
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: warm-up has finished, so requests will not wait for model or index loading"""
+    status = dict(
+        readiness,
+        pid=os.getpid(),
+        collections_loaded=collection_manager.stats()['loaded'],
+        embedding_models=[list(key) for key in shared_embedding_backends()],
+        startup=metrics.startup_report()
+    )
+    if readiness['finished_at'] is not None:
+        status['warm_up_seconds'] = round(readiness['finished_at'] - readiness['started_at'], 3)
+    return jsonify(status), 200 if readiness['ready'] else 503
 
 def allowed_file(filename):
     """Check if the file extension is allowed"""
@@ -47,15 +172,31 @@ def index():
             files.append(file)
     
     # Check if index exists
-    index_exists = os.path.exists('faiss_index.pkl') and os.path.exists('documents_data.pkl')
+    index_exists = collection_manager.get(DEFAULT_COLLECTION).index_exists()
     
-    return render_template('index.html', files=files, index_exists=index_exists)
+    return render_template('index.html', files=files, index_exists=index_exists, job_id=request.args.get('job'))
 
 @app.route('/chat')
 def chat_page():
     """Dedicated chat page"""
     return render_template('chat.html')
 
+def chat_response(chatbot, data):
+    """JSON body answering a chat request"""
+    # Get response from chatbot
+    with metrics.collect_timings() as timings:
+        result = chatbot.chat(data['message'].strip(), filters=normalize_filters(data.get('filters')))
+    
+    response = {
+        'response': result['response'],
+        'response_points': result['response_points'],
+        'success': True
+    }
+    # Per-stage latency breakdown on request ("timings": true or ?timings=1)
+    if data.get('timings') or request.args.get('timings') in ('1', 'true'):
+        response['timings'] = {stage: round(seconds * 1000, 3) for stage, seconds in timings.items()}
+    return response
+
 @app.route('/api/chat', methods=['POST'])
 def api_chat():
     """API endpoint for chat messages"""
@@ -71,18 +212,100 @@ def api_chat():
         if chatbot is None:
             return jsonify({'error': 'Chatbot not initialized. Please upload documents and build index first.'}), 500
         
-        # Get response from chatbot
-        result = chatbot.chat(message)
-        
-        return jsonify({
-            'response': result['response'],
-            'response_points': result['response_points'],
-            'success': True
-        })
+        return jsonify(chat_response(chatbot, data))
         
+    except FilterError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'Error processing message: {str(e)}'}), 500
 
+def batch_chat(chatbot, data):
+    """
+    JSON Lines response answering a batch of questions in completion order
+    
+    The body has "questions" (strings or {"id", "question", "filters"}
+    objects), an optional "concurrency" and optional "skip_ids" to resume a
+    batch whose stream was interrupted.
+    """
+    questions = data.get('questions')
+    if not isinstance(questions, list) or not questions:
+        return jsonify({'error': "'questions' must be a non-empty list"}), 400
+    if len(questions) > app.config['BATCH_MAX_QUESTIONS']:
+        return jsonify({'error': f"At most {app.config['BATCH_MAX_QUESTIONS']} questions per batch"}), 400
+    try:
+        questions = [parse_question(item, position) for position, item in enumerate(questions)]
+        concurrency = int(data.get('concurrency') or app.config['BATCH_MAX_CONCURRENCY'])
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    
+    answerer = BatchAnswerer(chatbot, concurrency=min(max(concurrency, 1), app.config['BATCH_MAX_CONCURRENCY']))
+    skip_ids = [str(question_id) for question_id in data.get('skip_ids') or []]
+    
+    def generate():
+        for record in answerer.answer(questions, skip_ids=skip_ids):
+            yield json.dumps(record) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/chat/batch', methods=['POST'])
+def api_chat_batch():
+    """Answer many questions in one request, streamed as JSON Lines"""
+    chatbot = get_chatbot()
+    if chatbot is None:
+        return jsonify({'error': 'Chatbot not initialized. Please upload documents and build index first.'}), 500
+    return batch_chat(chatbot, request.get_json(silent=True) or {})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics of this process"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/chat/stream', methods=['POST'])
+def api_chat_stream():
+    """Streaming chat endpoint: forwards response tokens as Server-Sent Events"""
+    data = request.get_json(silent=True) or {}
+    message = data.get('message', '').strip()
+    
+    if not message:
+        return jsonify({'error': 'Empty message'}), 400
+    
+    # Get chatbot instance
+    chatbot = get_chatbot()
+    if chatbot is None:
+        return jsonify({'error': 'Chatbot not initialized. Please upload documents and build index first.'}), 500
+    
+    return stream_chat(chatbot, message, data.get('filters'))
+
+def stream_chat(chatbot, message, filters=None):
+    """Server-Sent Events response streaming a chat answer"""
+    # Reject malformed filters before the stream starts
+    filters = normalize_filters(filters)
+    
+    def generate():
+        try:
+            for event in chatbot.chat_stream(message, filters):
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        except Exception as e:
+            error = {'type': 'error', 'text': f'Error processing message: {str(e)}'}
+            yield f"event: error\ndata: {json.dumps(error)}\n\n"
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # Stop nginx from buffering the stream
+        }
+    )
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss counters of the answer cache"""
+    chatbot = collection_manager.loaded_chatbot(DEFAULT_COLLECTION)
+    if chatbot is None or chatbot.cache is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(chatbot.cache.stats(), enabled=True))
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     """Handle file uploads"""
@@ -111,37 +334,94 @@ def upload_file():
     
     return redirect(url_for('index'))
 
-@app.route('/process', methods=['POST'])
-def process_documents():
-    """Process documents to build vector index"""
-    try:
+def wants_json():
+    """Whether the client asked for a JSON response instead of a page"""
+    return request.is_json or request.accept_mimetypes.best == 'application/json'
+
+def reload_chatbot_index(name=DEFAULT_COLLECTION):
+    """Hot-swap the freshly written index into the running chatbot"""
+    collection_manager.reload(name)
+
+def index_job(collection):
+    """Background job function that updates a collection's vector index"""
+    def run(job):
         # Initialize document processor
-        processor = DocumentProcessor(data_dir=app.config['UPLOAD_FOLDER'])
-        
-        # Process documents
-        index, data = processor.process_documents()
+        processor = DocumentProcessor(**collection.processor_options())
         
-        # Reset chatbot instance to reload new index
-        global chatbot_instance
-        chatbot_instance = None
+        # Process documents (only new or changed files are re-embedded)
+        index, data = processor.process_documents(progress=job.update)
         
-        # Count document chunks
-        num_chunks = len(data['texts'])
+        # Swap the new index in; chats keep running on the old one until then
+        job.update('swapping')
+        reload_chatbot_index(collection.name)
         
-        flash(f'Successfully processed documents. Created {num_chunks} chunks.')
-        return redirect(url_for('index'))
+        # Count document chunks and the duplicates that were stored only once
+        num_chunks = len(data)
+        stats = processor.build_stats
+        duplicates = stats.get('duplicates_exact', 0) + stats.get('duplicates_near', 0)
+        message = f'Successfully processed documents. Index has {num_chunks} chunks.'
+        if duplicates:
+            message += f' {duplicates} duplicate chunks ({stats["dedup_ratio"]:.1%} of new ones) were stored only once.'
+        job.update('done', num_chunks, num_chunks, message=message)
+        return {'num_chunks': num_chunks, 'duplicate_chunks': duplicates, 'dedup_ratio': stats.get('dedup_ratio', 0.0)}
+    return run
+
+def delete_job(collection, file_path):
+    """Background job function that drops a deleted file's chunks from a collection's index"""
+    def run(job):
+        job.update('removing')
+        processor = DocumentProcessor(**collection.processor_options())
+        removed = processor.remove_file(file_path)
+        stats = processor.build_stats
+        if removed or stats.get('dropped_references') or stats.get('reindexed_files'):
+            job.update('swapping')
+            reload_chatbot_index(collection.name)
+        return {
+            'removed_chunks': removed,
+            'dropped_references': stats.get('dropped_references', 0),
+            'repointed_references': stats.get('repointed_references', 0),
+            'reindexed_files': stats.get('reindexed_files', 0)
+        }
+    return run
+
+@app.route('/process', methods=['POST'])
+def process_documents():
+    """Start a background job that updates the vector index"""
+    job = job_manager.submit('index', index_job(collection_manager.get(DEFAULT_COLLECTION)))
     
-    except Exception as e:
-        flash(f'Error processing documents: {str(e)}')
-        return redirect(url_for('index'))
+    if wants_json():
+        return jsonify(job.to_dict()), 202
+    
+    flash(f'Indexing started (job {job.id})')
+    return redirect(url_for('index', job=job.id))
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status and stage progress of a background job"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    """Recent background jobs"""
+    return jsonify({'jobs': [job.to_dict() for job in job_manager.list()]})
 
 @app.route('/delete/<filename>', methods=['POST'])
 def delete_file(filename):
     """Delete a file from the data directory"""
     try:
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(filename))
+        collection = collection_manager.get(DEFAULT_COLLECTION)
+        file_path = os.path.join(collection.data_dir, secure_filename(filename))
         if os.path.exists(file_path):
             os.remove(file_path)
+            
+            # Drop the file's vectors from the index without a rebuild; queued
+            # behind any running index job so the two never write at once
+            if os.path.exists(collection.manifest_file):
+                job_manager.submit('delete', delete_job(collection, file_path))
+            
             flash(f'File {filename} deleted successfully')
         else:
             flash(f'File {filename} not found')
@@ -159,7 +439,7 @@ def get_status():
            file.split('.')[-1].lower() in app.config['ALLOWED_EXTENSIONS']:
             files.append(file)
     
-    index_exists = os.path.exists('faiss_index.pkl') and os.path.exists('documents_data.pkl')
+    index_exists = collection_manager.get(DEFAULT_COLLECTION).index_exists()
     
     status = {
         'files': files,
@@ -169,11 +449,99 @@ def get_status():
     
     return jsonify(status)
 
+def collection_status(collection):
+    files = collection.list_files(app.config['ALLOWED_EXTENSIONS'])
+    return {
+        'name': collection.name,
+        'files': files,
+        'file_count': len(files),
+        'index_exists': collection.index_exists(),
+        'loaded': collection_manager.loaded_chatbot(collection.name) is not None
+    }
+
+@app.errorhandler(CollectionError)
+def collection_error(error):
+    status = 400
+    if isinstance(error, CollectionNotFound):
+        status = 404
+    elif isinstance(error, CollectionNotReady):
+        status = 409
+    return jsonify({'error': str(error)}), status
+
+@app.errorhandler(FilterError)
+def filter_error(error):
+    return jsonify({'error': str(error)}), 400
+
+@app.route('/api/collections', methods=['GET'])
+def list_collections():
+    """All collections and the memory used by the loaded ones"""
+    return jsonify({
+        'collections': [collection_status(collection_manager.get(name)) for name in collection_manager.names()],
+        'memory': collection_manager.stats()
+    })
+
+@app.route('/api/collections', methods=['POST'])
+def create_collection():
+    """Create an empty collection"""
+    data = request.get_json(silent=True) or {}
+    collection = collection_manager.create(data.get('name', '').strip())
+    return jsonify(collection_status(collection)), 201
+
+@app.route('/api/collections/<name>', methods=['GET'])
+def get_collection(name):
+    return jsonify(collection_status(collection_manager.get(name)))
+
+@app.route('/api/collections/<name>/upload', methods=['POST'])
+def upload_collection_files(name):
+    """Upload documents into a collection"""
+    collection = collection_manager.get(name)
+    uploaded = []
+    for file in request.files.getlist('file'):
+        if file and allowed_file(file.filename):
+            filename = secure_filename(file.filename)
+            file.save(os.path.join(collection.data_dir, filename))
+            uploaded.append(filename)
+    if not uploaded:
+        return jsonify({'error': 'No valid files were uploaded'}), 400
+    return jsonify({'uploaded': uploaded, 'success': True})
+
+@app.route('/api/collections/<name>/process', methods=['POST'])
+def process_collection(name):
+    """Start a background job that updates a collection's index"""
+    collection = collection_manager.get(name)
+    job = job_manager.submit('index', index_job(collection))
+    return jsonify(job.to_dict()), 202
+
+@app.route('/api/collections/<name>/chat', methods=['POST'])
+def collection_chat(name):
+    """Chat against one collection; its index is loaded on first use"""
+    data = request.get_json(silent=True) or {}
+    if not data.get('message', '').strip():
+        return jsonify({'error': 'Empty message'}), 400
+    return jsonify(chat_response(collection_manager.chatbot(name), data))
+
+@app.route('/api/collections/<name>/chat/stream', methods=['POST'])
+def collection_chat_stream(name):
+    """Streaming chat against one collection"""
+    data = request.get_json(silent=True) or {}
+    message = data.get('message', '').strip()
+    if not message:
+        return jsonify({'error': 'Empty message'}), 400
+    return stream_chat(collection_manager.chatbot(name), message, data.get('filters'))
+
+@app.route('/api/collections/<name>/chat/batch', methods=['POST'])
+def collection_chat_batch(name):
+    """Batch question answering against one collection"""
+    return batch_chat(collection_manager.chatbot(name), request.get_json(silent=True) or {})
+
 @app.route('/run_chatbot', methods=['GET'])
 def run_chatbot():
     """Redirect to chat page instead of running terminal chatbot"""
     return redirect(url_for('chat_page'))
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    # Development server; use `gunicorn -c gunicorn.conf.py wsgi:app` in production.
+    # The debug reloader runs this script twice; warm up only in the serving process.
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
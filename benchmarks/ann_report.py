@@ -0,0 +1,138 @@
+"""
+Recall/latency report for the FAISS index types in utils/index_factory.py
+
+Every index type is built over the same vectors and compared against the
+exact flat index: recall@k is the fraction of the true top-k neighbours an
+index returns, latency is measured one query at a time like the chatbot does.
+
+Examples:
+    python benchmarks/ann_report.py --data-file documents_data
+    python benchmarks/ann_report.py --synthetic 200000 --dimension 384 --json ann.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import index_factory
+from utils.chunk_store import ChunkStore
+
+
+def load_vectors(args):
+    """Embeddings from a chunk store, or clustered synthetic vectors"""
+    if args.synthetic:
+        rng = np.random.default_rng(args.seed)
+        # Clustered data behaves more like real embeddings than uniform noise
+        centers = rng.normal(size=(max(1, args.synthetic // 500), args.dimension)).astype('float32')
+        assignment = rng.integers(0, len(centers), size=args.synthetic)
+        vectors = centers[assignment] + 0.3 * rng.normal(size=(args.synthetic, args.dimension)).astype('float32')
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors.astype('float32')
+
+    store = ChunkStore(args.data_file)
+    return np.asarray(store.embeddings, dtype='float32')
+
+
+def make_queries(vectors, num_queries, seed):
+    """Perturbed corpus vectors, so every query has close but inexact neighbours"""
+    rng = np.random.default_rng(seed + 1)
+    picks = rng.choice(len(vectors), size=min(num_queries, len(vectors)), replace=False)
+    queries = vectors[picks] + 0.05 * rng.normal(size=(len(picks), vectors.shape[1])).astype('float32')
+    return np.ascontiguousarray(queries, dtype='float32')
+
+
+def measure(index, queries, k, params, truth=None):
+    """Per-query latencies (ms) and recall@k against the ground truth ids"""
+    latencies = []
+    found = []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k, params=params)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append(ids[0])
+    found = np.array(found)
+
+    result = {
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "mean_ms": float(np.mean(latencies))
+    }
+    if truth is not None:
+        hits = sum(len(set(f[f != -1]) & set(t)) for f, t in zip(found, truth))
+        result["recall_at_k"] = hits / float(truth.size)
+    return result, found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-file", default="documents_data", help="Chunk store to read embeddings from")
+    parser.add_argument("--synthetic", type=int, default=0, help="Use N synthetic vectors instead of a chunk store")
+    parser.add_argument("--dimension", type=int, default=384, help="Dimension of synthetic vectors")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--types", nargs="+", default=list(index_factory.INDEX_TYPES), choices=index_factory.INDEX_TYPES)
+    parser.add_argument("--nlist", type=int, default=None, help="IVF clusters (default ~4*sqrt(N))")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 32, 64, 128])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    vectors = load_vectors(args)
+    queries = make_queries(vectors, args.queries, args.seed)
+    ids = np.arange(len(vectors), dtype='int64')
+    nlist = args.nlist or index_factory.default_nlist(len(vectors))
+    params = index_factory.index_params(nlist=nlist)
+    print(f"{len(vectors)} vectors, dimension {vectors.shape[1]}, {len(queries)} queries, k={args.k}, nlist={nlist}\n")
+
+    results = []
+    baseline, truth = None, None
+    for index_type in ["flat"] + [t for t in args.types if t != "flat"]:
+        start = time.perf_counter()
+        index = index_factory.build_index(vectors, ids, index_type, params)
+        build_s = time.perf_counter() - start
+        if index_factory.index_kind(index) != index_type:
+            print(f"{index_type}: not enough vectors to train, skipped")
+            continue
+
+        if index_type == "flat":
+            sweep = [("-", None)]
+        elif index_type == "hnsw":
+            sweep = [(f"efSearch={ef}", index_factory.search_parameters(index, ef_search=ef)) for ef in args.ef_search]
+        else:
+            sweep = [(f"nprobe={n}", index_factory.search_parameters(index, nprobe=n)) for n in args.nprobe if n <= nlist]
+
+        for setting, search_params in sweep:
+            stats, found = measure(index, queries, args.k, search_params, truth)
+            if index_type == "flat":
+                baseline, truth = stats, found
+                stats["recall_at_k"] = 1.0
+            if index_type in args.types:
+                results.append(dict(index_type=index_type, setting=setting, build_s=build_s, **stats))
+
+    print(f"{'index':<10} {'setting':<14} {'build s':>8} {'recall@k':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for row in results:
+        print(
+            f"{row['index_type']:<10} {row['setting']:<14} {row['build_s']:>8.2f} "
+            f"{row['recall_at_k']:>9.3f} {row['p50_ms']:>8.3f} {row['p99_ms']:>8.3f}"
+        )
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({
+                "vectors": len(vectors),
+                "dimension": int(vectors.shape[1]),
+                "queries": len(queries),
+                "k": args.k,
+                "nlist": nlist,
+                "results": results
+            }, f, indent=2)
+        print(f"\nSaved results to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
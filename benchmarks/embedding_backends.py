@@ -0,0 +1,122 @@
+"""
+Throughput, query latency and equivalence of the embedding backends
+
+Each backend embeds the same documents; docs/sec is measured over the whole
+set, query latency one short text at a time. Embeddings are compared with the
+PyTorch (sentence-transformers) backend by cosine similarity.
+
+Examples:
+    python benchmarks/embedding_backends.py --data-file documents_data --docs 2000
+    python benchmarks/embedding_backends.py --threads 4 --batch-size 32 --json embed.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.embeddings import create_embedding_backend
+from utils.chunk_store import ChunkStore, store_exists
+
+WORDS = (
+    "network routing packet protocol layer address subnet gateway datagram header "
+    "congestion window acknowledgement sequence checksum bandwidth latency switch "
+    "frame link transport session segment flow control error detection retransmission"
+).split()
+
+
+def load_texts(args):
+    """Chunk texts from a store, or synthetic texts of mixed length"""
+    if args.data_file and store_exists(args.data_file):
+        store = ChunkStore(args.data_file)
+        rows = range(min(args.docs, len(store)))
+        return [store.text(row) for row in rows]
+
+    rng = np.random.default_rng(args.seed)
+    lengths = rng.integers(20, 200, size=args.docs)
+    return [" ".join(rng.choice(WORDS, size=length)) for length in lengths]
+
+
+def benchmark(backend, texts, queries):
+    """Docs/sec over texts and per-query latency percentiles"""
+    backend.encode(texts[:8])  # warm-up
+
+    start = time.perf_counter()
+    embeddings = backend.encode(texts)
+    elapsed = time.perf_counter() - start
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        backend.encode([query])
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    return embeddings, {
+        "docs_per_sec": len(texts) / elapsed,
+        "query_p50_ms": float(np.percentile(latencies, 50)),
+        "query_p99_ms": float(np.percentile(latencies, 99))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-file", default="documents_data", help="Chunk store to take texts from")
+    parser.add_argument("--docs", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    texts = load_texts(args)
+    rng = np.random.default_rng(args.seed + 1)
+    queries = [" ".join(rng.choice(WORDS, size=8)) + "?" for _ in range(args.queries)]
+    print(f"{len(texts)} documents, {len(queries)} queries, batch size {args.batch_size}, threads {args.threads}\n")
+
+    configs = [
+        ("sentence-transformers", {}),
+        ("onnx", {"quantize": False}),
+        ("onnx", {"quantize": True})
+    ]
+    results = []
+    reference = None
+    for backend_name, options in configs:
+        label = backend_name + (" int8" if options.get("quantize") else "")
+        try:
+            backend = create_embedding_backend(
+                backend_name, args.model, batch_size=args.batch_size, num_threads=args.threads, **options
+            )
+        except ImportError as e:
+            print(f"{label}: skipped ({e})")
+            continue
+
+        embeddings, stats = benchmark(backend, texts, queries)
+        if reference is None:
+            reference = embeddings
+        cosine = np.sum(embeddings * reference, axis=1) / (
+            np.linalg.norm(embeddings, axis=1) * np.linalg.norm(reference, axis=1)
+        )
+        stats.update(backend=label, min_cosine=float(cosine.min()), mean_cosine=float(cosine.mean()))
+        results.append(stats)
+
+    print(f"{'backend':<24} {'docs/s':>9} {'q p50 ms':>9} {'q p99 ms':>9} {'min cos':>8} {'mean cos':>9}")
+    for row in results:
+        print(
+            f"{row['backend']:<24} {row['docs_per_sec']:>9.1f} {row['query_p50_ms']:>9.2f} "
+            f"{row['query_p99_ms']:>9.2f} {row['min_cosine']:>8.4f} {row['mean_cosine']:>9.4f}"
+        )
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"docs": len(texts), "queries": len(queries), "batch_size": args.batch_size,
+                       "threads": args.threads, "results": results}, f, indent=2)
+        print(f"\nSaved results to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+"""
+End-to-end benchmark: ingestion, retrieval and chat latency
+
+Generates (or reuses) a synthetic corpus, then measures:
+    ingest     DocumentProcessor.process_documents wall time, throughput,
+               time per pipeline stage and peak RSS (main process and workers)
+    update     incremental process_documents after adding one file, and
+               remove_file of that file, against the full index
+    stages     load/split, embedding and index-build throughput measured alone
+    retrieval  RAGRetriever.retrieve p50/p95/p99 and recall@k of the planted
+               facts (plus ANN recall@k against exact search for non-flat indexes)
+    chat       RAGChatbot.chat p50/p95/p99 with a deterministic stub LLM
+
+Runs offline on CPU: the default hashing embedder and the stub LLM need no
+model downloads or network. Results are written as JSON for comparing commits.
+
+Examples:
+    python benchmarks/end_to_end.py --chunks 10000 --json bench.json
+    python benchmarks/end_to_end.py --chunks 100000 --index-type ivf_flat --llm-delay-ms 300
+    python benchmarks/end_to_end.py --corpus bench_corpus --embedder sentence-transformers
+"""
+import os
+import io
+import sys
+import json
+import time
+import glob
+import shutil
+import resource
+import platform
+import argparse
+import subprocess
+import contextlib
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep every library offline; the tokenizer falls back to an estimate
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+
+from utils import index_factory
+from utils.document_processor import DocumentProcessor
+from utils.retriever import RAGRetriever
+from utils.embeddings import create_embedding_backend
+from chatbot import RAGChatbot
+from benchmarks.synthetic_corpus import generate_corpus
+from benchmarks.offline import HashingEmbeddingBackend, StubLLM
+
+
+def latency_stats(latencies_ms):
+    return {
+        "count": len(latencies_ms),
+        "mean_ms": float(np.mean(latencies_ms)),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "max_ms": float(np.max(latencies_ms))
+    }
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its largest child (Linux reports KiB)"""
+    return {
+        "main": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        "workers": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0
+    }
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the pipeline's progress prints inside timed loops"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def make_backend(args):
+    if args.embedder == "hashing":
+        return HashingEmbeddingBackend(dimension=args.dimension)
+    return create_embedding_backend(args.embedder, args.model)
+
+
+def corpus_files(corpus_dir):
+    return sorted(glob.glob(os.path.join(corpus_dir, "*.txt")) + glob.glob(os.path.join(corpus_dir, "*.pdf")))
+
+
+def bench_ingest(args, corpus_dir, backend):
+    """Full process_documents run from scratch"""
+    processor = DocumentProcessor(
+        data_dir=corpus_dir,
+        index_type=args.index_type,
+        workers=args.workers,
+        embedding_backend=backend
+    )
+    stage_started = {}
+
+    def progress(stage, current=None, total=None):
+        stage_started.setdefault(stage, time.perf_counter())
+
+    files = corpus_files(corpus_dir)
+    corpus_bytes = sum(os.path.getsize(path) for path in files)
+    start = time.perf_counter()
+    with quiet():
+        index, store = processor.process_documents(incremental=False, progress=progress)
+    elapsed = time.perf_counter() - start
+
+    stages = sorted(stage_started.items(), key=lambda item: item[1])
+    stage_seconds = {
+        stage: (stages[i + 1][1] if i + 1 < len(stages) else start + elapsed) - started
+        for i, (stage, started) in enumerate(stages)
+    }
+    return processor, store, {
+        "files": len(files),
+        "corpus_mb": corpus_bytes / 1e6,
+        "chunks": len(store),
+        "seconds": elapsed,
+        "chunks_per_sec": len(store) / elapsed,
+        "mb_per_sec": corpus_bytes / 1e6 / elapsed,
+        "stage_seconds": stage_seconds,
+        "index": index_factory.describe_index(index),
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+def bench_incremental(args, processor, corpus_dir):
+    """
+    One-file updates of the full index
+
+    Every update writes a new build: surviving rows, BM25 postings and dedup
+    tables are copied in bulk, so these grow with the corpus size, but
+    only the changed file is parsed and embedded.
+    """
+    source = next(path for path in corpus_files(corpus_dir) if path.endswith(".txt"))
+    with open(source, 'r', encoding='utf-8') as f:
+        words = f.read().split()
+    # New content, so the file's chunks are embedded rather than deduplicated
+    np.random.default_rng(args.seed).shuffle(words)
+    added = os.path.join(corpus_dir, "incremental_update.txt")
+    with open(added, 'w', encoding='utf-8') as f:
+        f.write(" ".join(words))
+
+    try:
+        start = time.perf_counter()
+        with quiet():
+            _, store = processor.process_documents()
+        add_seconds = time.perf_counter() - start
+        chunks, added_chunks = len(store), processor.build_stats["chunks_embedded"]
+        store.close()
+    finally:
+        os.remove(added)
+    start = time.perf_counter()
+    with quiet():
+        removed = processor.remove_file(added)
+    remove_seconds = time.perf_counter() - start
+
+    return {
+        "chunks": chunks,
+        "add_file": {"chunks": added_chunks, "seconds": add_seconds},
+        "remove_file": {"chunks": removed, "seconds": remove_seconds},
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+def bench_stages(args, processor, store, corpus_dir):
+    """Each ingestion stage on its own"""
+    files = corpus_files(corpus_dir)[:args.stage_files]
+    start = time.perf_counter()
+    texts = []
+    for _, chunks in processor.iter_parsed_files(files):
+        texts.extend(text for text, _ in chunks)
+    parse_seconds = time.perf_counter() - start
+
+    sample = texts[:args.embed_sample]
+    start = time.perf_counter()
+    processor.embed_texts(sample)
+    embed_seconds = time.perf_counter() - start
+
+    embeddings = np.asarray(store.embeddings, dtype='float32')
+    ids = np.asarray(store.ids, dtype='int64')
+    start = time.perf_counter()
+    with quiet():
+        index_factory.build_index(embeddings, ids, args.index_type, processor.index_params)
+    index_seconds = time.perf_counter() - start
+
+    return {
+        "load_split": {"files": len(files), "chunks": len(texts), "seconds": parse_seconds,
+                       "files_per_sec": len(files) / parse_seconds, "chunks_per_sec": len(texts) / parse_seconds},
+        "embed": {"chunks": len(sample), "seconds": embed_seconds, "chunks_per_sec": len(sample) / embed_seconds},
+        "index_build": {"vectors": len(ids), "seconds": index_seconds, "vectors_per_sec": len(ids) / index_seconds}
+    }
+
+
+def planted_recall(results, queries):
+    """Fraction of queries whose answer appears in a retrieved chunk"""
+    hits = sum(any(query["answer"] in text for text in result["texts"]) for result, query in zip(results, queries))
+    return hits / float(len(queries))
+
+
+def bench_retrieval(args, backend, queries):
+    retriever = RAGRetriever(top_k=args.top_k, embedding_backend=backend, hybrid=not args.no_hybrid)
+    retriever.retrieve(queries[0]["query"])  # warm-up
+
+    latencies, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(retriever.retrieve(query["query"]))
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    report = latency_stats(latencies)
+    report.update({"top_k": args.top_k, "hybrid": retriever.bm25 is not None,
+                   f"recall@{args.top_k}": planted_recall(results, queries)})
+
+    if args.index_type != "flat":
+        # ANN recall: overlap of the index's dense top-k with exact search over the stored embeddings
+        import faiss
+        store = retriever.store
+        exact = faiss.IndexFlatL2(store.dimension)
+        exact.add(np.asarray(store.embeddings, dtype='float32'))
+        query_embeddings = backend.encode([query["query"] for query in queries])
+        _, truth_rows = exact.search(query_embeddings, args.top_k)
+        _, found = retriever.index.search(query_embeddings, args.top_k)
+        truth = np.asarray(store.ids)[truth_rows]
+        report[f"ann_recall@{args.top_k}"] = float(np.mean([
+            len(set(t) & set(f)) / float(len(t)) for t, f in zip(truth, found)
+        ]))
+    return report
+
+
+def bench_chat(args, corpus_dir, backend, queries):
+    with quiet():
+        chatbot = RAGChatbot(
+            data_dir=corpus_dir,
+            embedding_backend=backend,
+            top_k=args.top_k,
+            index_type=args.index_type,
+            cache_backend=None,
+            hybrid_search=not args.no_hybrid
+        )
+    chatbot.llm = StubLLM(delay_ms=args.llm_delay_ms)
+
+    latencies = []
+    with quiet():
+        chatbot.chat(queries[0]["query"])  # warm-up
+        for query in queries:
+            start = time.perf_counter()
+            chatbot.chat(query["query"])
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    report = latency_stats(latencies)
+    report["llm_delay_ms"] = args.llm_delay_ms
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=10000, help="Approximate corpus size in chunks")
+    parser.add_argument("--corpus", help="Reuse a corpus from benchmarks/synthetic_corpus.py instead of generating one")
+    parser.add_argument("--pdf-fraction", type=float, default=0.2)
+    parser.add_argument("--work-dir", default="bench_work", help="Scratch directory for the corpus and index files")
+    parser.add_argument("--embedder", default="hashing", choices=["hashing", "sentence-transformers", "onnx"])
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--dimension", type=int, default=384, help="Dimension of the hashing embedder")
+    parser.add_argument("--index-type", default="flat", choices=index_factory.INDEX_TYPES)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--no-hybrid", action="store_true", help="Dense retrieval only")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--llm-delay-ms", type=float, default=0.0, help="Stub LLM response time")
+    parser.add_argument("--stage-files", type=int, default=50, help="Files parsed in the load/split stage benchmark")
+    parser.add_argument("--embed-sample", type=int, default=2000, help="Chunks embedded in the embedding stage benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    work_dir = os.path.abspath(args.work_dir)
+    if args.corpus:
+        corpus_dir = os.path.abspath(args.corpus)
+        with open(os.path.join(corpus_dir, "queries.json"), 'r', encoding='utf-8') as f:
+            queries = json.load(f)
+    else:
+        corpus_dir = os.path.join(work_dir, "corpus")
+        shutil.rmtree(corpus_dir, ignore_errors=True)
+        print(f"Generating ~{args.chunks} chunks in {corpus_dir}...")
+        queries = generate_corpus(corpus_dir, args.chunks, pdf_fraction=args.pdf_fraction, seed=args.seed)
+
+    # Index files are written with their default relative names inside the work directory
+    os.makedirs(work_dir, exist_ok=True)
+    os.chdir(work_dir)
+    rng = np.random.default_rng(args.seed)
+    queries = [queries[i] for i in rng.permutation(len(queries))[:args.queries]]
+    backend = make_backend(args)
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args)
+        }
+    }
+
+    print("Ingesting...")
+    processor, store, results["ingest"] = bench_ingest(args, corpus_dir, backend)
+    print(f"  {results['ingest']['chunks']} chunks in {results['ingest']['seconds']:.1f} s "
+          f"({results['ingest']['chunks_per_sec']:.0f} chunks/s), peak RSS {results['ingest']['peak_rss_mb']}")
+
+    print("Measuring stages...")
+    results["stages"] = bench_stages(args, processor, store, corpus_dir)
+    for stage, report in results["stages"].items():
+        rate = {key: value for key, value in report.items() if key.endswith("_per_sec")}
+        print(f"  {stage}: {', '.join(f'{value:.0f} {key}' for key, value in rate.items())}")
+
+    print("Measuring retrieval...")
+    results["retrieval"] = bench_retrieval(args, backend, queries)
+    print(f"  {results['retrieval']}")
+
+    print("Measuring chat...")
+    results["chat"] = bench_chat(args, corpus_dir, backend, queries)
+    print(f"  {results['chat']}")
+
+    print("Measuring incremental updates...")
+    results["update"] = bench_incremental(args, processor, corpus_dir)
+    print(f"  add one file: {results['update']['add_file']['seconds']:.2f} s, "
+          f"remove_file: {results['update']['remove_file']['seconds']:.2f} s "
+          f"({results['update']['chunks']} chunks)")
+
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved results to {json_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+Local stand-in for Groq's OpenAI-compatible chat completions API
+
+Answers POST /openai/v1/chat/completions with a canned multi-point answer
+after a configurable latency, and can inject 429s (with Retry-After) and
+5xx errors. "stream": true requests get server-sent event chunks, so both
+the async client and ChatGroq streaming can be pointed at it:
+
+    python benchmarks/fake_groq_server.py --port 8765 --latency-ms 300 --rate-limit 0.1
+    GROQ_BASE_URL=http://127.0.0.1:8765 GROQ_API_KEY=test python app.py
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHAT_COMPLETIONS_PATH = "/openai/v1/chat/completions"
+
+DEFAULT_ANSWER = (
+    "1. This answer comes from the local fake Groq server.\n"
+    "2. It stands in for the real model so latency can be measured without the network.\n"
+    "3. Configure latency, rate limiting and errors with command-line options."
+)
+
+
+class FakeGroqHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self.path.rstrip("/") != CHAT_COMPLETIONS_PATH:
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        server = self.server
+        with server.lock:
+            server.stats["requests"] += 1
+        roll = random.random()
+        if roll < server.rate_limit:
+            with server.lock:
+                server.stats["rate_limited"] += 1
+            self.send_json(
+                429,
+                {"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}},
+                {"Retry-After": str(server.retry_after)}
+            )
+            return
+        if roll < server.rate_limit + server.error_rate:
+            with server.lock:
+                server.stats["errors"] += 1
+            self.send_json(503, {"error": {"message": "Service unavailable"}})
+            return
+
+        latency = max(0.0, random.gauss(server.latency, server.jitter)) if server.jitter else server.latency
+        time.sleep(latency)
+
+        prompt = " ".join(str(message.get("content", "")) for message in request.get("messages", []))
+        usage = {
+            "prompt_tokens": len(prompt.split()),
+            "completion_tokens": len(server.answer.split()),
+            "total_tokens": len(prompt.split()) + len(server.answer.split())
+        }
+        model = request.get("model", "fake-model")
+        created = int(time.time())
+
+        if request.get("stream"):
+            self.stream_answer(model, created)
+            return
+
+        self.send_json(200, {
+            "id": f"chatcmpl-fake-{created}",
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": server.answer},
+                "finish_reason": "stop"
+            }],
+            "usage": usage
+        })
+
+    def stream_answer(self, model, created):
+        """Send the answer word by word as chat.completion.chunk events"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def chunk(delta, finish_reason=None):
+            payload = {
+                "id": f"chatcmpl-fake-{created}",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        chunk({"role": "assistant", "content": ""})
+        words = self.server.answer.split(" ")
+        for i, word in enumerate(words):
+            chunk({"content": word if i == 0 else " " + word})
+            if self.server.token_delay:
+                time.sleep(self.server.token_delay)
+        chunk({}, "stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start_server(
+    host="127.0.0.1",
+    port=8765,
+    latency_ms=200.0,
+    jitter_ms=0.0,
+    rate_limit=0.0,
+    retry_after=1,
+    error_rate=0.0,
+    token_delay_ms=5.0,
+    answer=DEFAULT_ANSWER,
+    verbose=False
+):
+    """
+    Start the fake server on a background thread
+
+    Args:
+        host: Interface to bind
+        port: Port to bind (0 picks a free port)
+        latency_ms: Mean time before a completion is returned
+        jitter_ms: Standard deviation of the latency
+        rate_limit: Fraction of requests answered with 429
+        retry_after: Retry-After seconds sent with 429s
+        error_rate: Fraction of requests answered with 503
+        token_delay_ms: Delay between streamed words
+        answer: Completion text returned for every request
+        verbose: Log every request
+
+    Returns:
+        The running server; its base URL is http://host:server.server_port
+    """
+    server = ThreadingHTTPServer((host, port), FakeGroqHandler)
+    server.daemon_threads = True
+    server.latency = latency_ms / 1000.0
+    server.jitter = jitter_ms / 1000.0
+    server.rate_limit = rate_limit
+    server.retry_after = retry_after
+    server.error_rate = error_rate
+    server.token_delay = token_delay_ms / 1000.0
+    server.answer = answer
+    server.verbose = verbose
+    server.lock = threading.Lock()
+    server.stats = {"requests": 0, "rate_limited": 0, "errors": 0}
+    threading.Thread(target=server.serve_forever, name="fake-groq", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--token-delay-ms", type=float, default=5.0, help="Delay between streamed words")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server = start_server(
+        host=args.host,
+        port=args.port,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        rate_limit=args.rate_limit,
+        retry_after=args.retry_after,
+        error_rate=args.error_rate,
+        token_delay_ms=args.token_delay_ms,
+        verbose=args.verbose
+    )
+    print(f"Fake Groq server listening on http://{args.host}:{server.server_port}")
+    print(f"Point the app at it with GROQ_BASE_URL=http://{args.host}:{server.server_port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(f"\n{server.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Tail latency of the async Groq client under concurrent load
+
+Starts the fake Groq server in-process (or uses --base-url), fires --requests
+completions with --concurrency callers and reports latency percentiles,
+retries, 429s and failures. No network access or API key is needed.
+
+Examples:
+    python benchmarks/groq_client_load.py --requests 500 --concurrency 50 --max-in-flight 8
+    python benchmarks/groq_client_load.py --rate-limit 0.2 --retry-after 0 --rps 40 --json load.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.groq_client import AsyncGroqClient, GroqAPIError
+from benchmarks.fake_groq_server import start_server
+
+
+async def run_load(client, args):
+    latencies = []
+    failures = {}
+    pending = iter(range(args.requests))
+
+    async def caller():
+        for i in pending:
+            start = time.perf_counter()
+            try:
+                await client.complete(f"Question {i}: what is a subnet?", args.model, timeout=args.timeout)
+                latencies.append((time.perf_counter() - start) * 1000)
+            except GroqAPIError as e:
+                name = type(e).__name__
+                failures[name] = failures.get(name, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(caller() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    await client.aclose()
+    return latencies, failures, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", help="Use a running server instead of starting the fake one")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--max-in-flight", type=int, default=8)
+    parser.add_argument("--rps", type=float, default=None, help="Client-side token-bucket rate limit")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-request deadline in seconds")
+    parser.add_argument("--model", default="llama3-8b-8192")
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="Fake server latency")
+    parser.add_argument("--jitter-ms", type=float, default=50.0, help="Fake server latency jitter")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Fake server 429 fraction")
+    parser.add_argument("--retry-after", type=int, default=1, help="Fake server Retry-After seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fake server 503 fraction")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        server = start_server(
+            port=0,
+            latency_ms=args.latency_ms,
+            jitter_ms=args.jitter_ms,
+            rate_limit=args.rate_limit,
+            retry_after=args.retry_after,
+            error_rate=args.error_rate
+        )
+        base_url = f"http://127.0.0.1:{server.server_port}"
+
+    client = AsyncGroqClient(
+        api_key=os.getenv("GROQ_API_KEY", "test"),
+        base_url=base_url,
+        timeout=args.timeout,
+        max_in_flight=args.max_in_flight,
+        requests_per_second=args.rps
+    )
+    print(f"{args.requests} requests, {args.concurrency} callers, {args.max_in_flight} in flight against {base_url}\n")
+    latencies, failures, elapsed = asyncio.run(run_load(client, args))
+
+    results = {
+        "requests": args.requests,
+        "succeeded": len(latencies),
+        "failed": failures,
+        "throughput_rps": len(latencies) / elapsed,
+        "client_stats": client.stats
+    }
+    if latencies:
+        for p in (50, 95, 99):
+            results[f"p{p}_ms"] = float(np.percentile(latencies, p))
+        results["max_ms"] = float(max(latencies))
+    if server is not None:
+        results["server_stats"] = server.stats
+        server.shutdown()
+
+    print(f"succeeded {results['succeeded']}/{args.requests}, failed {failures or 0}")
+    print(f"throughput {results['throughput_rps']:.1f} req/s")
+    if latencies:
+        print(f"latency p50 {results['p50_ms']:.1f} ms, p95 {results['p95_ms']:.1f} ms, "
+              f"p99 {results['p99_ms']:.1f} ms, max {results['max_ms']:.1f} ms")
+    print(f"client {client.stats}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved results to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
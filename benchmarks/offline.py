@@ -0,0 +1,85 @@
+"""
+Offline stand-ins for the benchmarks: a hashing embedder and a stub LLM
+
+Neither downloads anything or needs network access, and both are
+deterministic, so benchmark runs are comparable across commits.
+"""
+import os
+import sys
+import time
+import zlib
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.bm25 import tokenize
+from utils.embeddings import EmbeddingBackend
+from utils import metrics
+from utils.llm import GroqLLM
+from utils.context_packer import ContextPacker, TokenCounter
+
+
+class HashingEmbeddingBackend(EmbeddingBackend):
+    """
+    Feature-hashing bag-of-words embeddings
+
+    Each term is hashed to a dimension and a sign; the counts are
+    L2-normalized. Texts sharing words get similar vectors, which is enough to
+    exercise the pipeline end to end without a transformer model.
+    """
+
+    name = "hashing"
+
+    def __init__(self, model_name="hashing", batch_size=256, num_threads=None, dimension=384):
+        super().__init__(model_name, batch_size, num_threads)
+        self._dimension = dimension
+
+    def _encode_batch(self, texts):
+        embeddings = np.zeros((len(texts), self._dimension), dtype='float32')
+        for row, text in enumerate(texts):
+            for term in tokenize(text):
+                digest = zlib.crc32(term.encode('utf-8'))
+                embeddings[row, digest % self._dimension] += 1.0 if digest & 0x80000000 else -1.0
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.clip(norms, 1e-12, None)
+
+    @property
+    def dimension(self):
+        return self._dimension
+
+
+class StubLLM(GroqLLM):
+    """
+    Deterministic replacement for GroqLLM
+
+    Builds the real prompt (context packing included) and parses the answer
+    into points like GroqLLM, but instead of calling Groq it sleeps for
+    `delay_ms` and answers with a summary of the retrieved sources.
+    """
+
+    def __init__(self, delay_ms=0.0, context_token_budget=3000):
+        self.model_name = "stub"
+        self.delay = delay_ms / 1000.0
+        self.context_packer = ContextPacker(TokenCounter(None), token_budget=context_token_budget)
+
+    def complete(self, prompt, retrieved_documents):
+        if self.delay:
+            time.sleep(self.delay)
+        sources = sorted({meta.get("source", "Unknown source") for meta in retrieved_documents["metadata"]})
+        lines = [f"{i}. The context includes material from {source}." for i, source in enumerate(sources, 1)]
+        text = "\n".join(lines) or "I could not find this in the documents."
+        usage = {"prompt_tokens": self.context_packer.token_counter.count(prompt), "completion_tokens": len(text.split())}
+        return text, usage
+
+    def generate_response(self, query, retrieved_documents):
+        prompt, context_stats = self.prepare_prompt(query, retrieved_documents)
+        with metrics.stage("chat", "llm_call"):
+            text, usage = self.complete(prompt, retrieved_documents)
+        return self.completed_response(text, usage, context_stats)
+
+    def stream_response(self, query, retrieved_documents):
+        response = self.generate_response(query, retrieved_documents)
+        yield {"type": "token", "text": response['text']}
+        for point in response['points']:
+            yield {"type": "point", "text": point}
+        yield {"type": "done", "text": response['text'], "points": response['points'], "context": response['context']}
@@ -0,0 +1,167 @@
+"""
+Synthetic TXT/PDF corpus generator for the benchmarks
+
+Writes files of Zipf-distributed filler text sized so that the document
+processor's splitter (1000-character chunks, 200 overlap) produces roughly
+--chunks chunks. Every file contains one planted fact ("The access code of
+<key> is <value>.") whose query and expected answer are listed in
+queries.json, so retrieval recall can be measured without labelled data.
+PDFs are written with a minimal built-in PDF writer: no extra dependencies.
+
+Examples:
+    python benchmarks/synthetic_corpus.py --out bench_corpus --chunks 10000
+    python benchmarks/synthetic_corpus.py --out bench_corpus --chunks 1000000 --pdf-fraction 0
+"""
+import os
+import json
+import argparse
+import numpy as np
+
+# New characters per chunk for chunk_size=1000 and chunk_overlap=200
+CHARS_PER_CHUNK = 800
+
+TOPICS = (
+    "network routing packet protocol layer address subnet gateway datagram header congestion window "
+    "acknowledgement sequence checksum bandwidth latency switch frame link transport session segment "
+    "flow control error detection retransmission topology bridge hub repeater ethernet wireless "
+    "signal channel encoding modulation multiplexing collision carrier sense access token ring "
+    "fiber copper cable router table metric hop distance vector state flooding broadcast unicast "
+    "multicast anycast tunnel firewall proxy cache domain name resolution server client socket port"
+).split()
+
+
+def make_vocabulary(size, rng):
+    """Topic words plus pseudo-words, most frequent first"""
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    words = list(TOPICS)
+    while len(words) < size:
+        words.append("".join(rng.choice(letters, size=int(rng.integers(3, 10)))))
+    return np.array(words[:size])
+
+
+def filler_text(n_chars, vocabulary, rng):
+    """Sentences of Zipf-distributed words, about n_chars long"""
+    ranks = np.minimum(rng.zipf(1.2, size=max(16, n_chars // 5)), len(vocabulary)) - 1
+    words = vocabulary[ranks]
+    sentences, length, start = [], 0, 0
+    while length < n_chars and start < len(words):
+        size = int(rng.integers(8, 20))
+        sentence = " ".join(words[start:start + size]).capitalize() + "."
+        sentences.append(sentence)
+        length += len(sentence) + 1
+        start += size
+    return " ".join(sentences)[:n_chars]
+
+
+def pdf_escape(line):
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path, text, line_chars=90, lines_per_page=60):
+    """Write text to a simple Helvetica PDF that standard PDF loaders can extract"""
+    words, lines, line = text.split(), [], ""
+    for word in words:
+        if line and len(line) + 1 + len(word) > line_chars:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    if line:
+        lines.append(line)
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the page object numbers are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+    ]
+    page_refs = []
+    for page_lines in pages:
+        stream = "BT /F1 10 Tf 12 TL 40 760 Td\n" + "".join(f"({pdf_escape(l)}) Tj T*\n" for l in page_lines) + "ET"
+        stream = stream.encode("latin-1", errors="replace")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_ref = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_ref
+        )
+        page_refs.append(len(objects))
+    kids = " ".join(f"{ref} 0 R" for ref in page_refs).encode()
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_refs))
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, 1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b"%010d 00000 n \n" % offset)
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+
+
+def generate_corpus(out_dir, chunks=10000, chunks_per_file=100, pdf_fraction=0.2, vocabulary_size=20000, seed=0):
+    """
+    Generate a corpus
+
+    Args:
+        out_dir: Directory to write the files and queries.json to
+        chunks: Approximate number of chunks the corpus splits into
+        chunks_per_file: Approximate chunks per file
+        pdf_fraction: Fraction of files written as PDF
+        vocabulary_size: Number of distinct filler words
+        seed: Random seed; the same arguments always give the same corpus
+
+    Returns:
+        The list of planted queries ({"query", "answer", "file"})
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = make_vocabulary(vocabulary_size, rng)
+    os.makedirs(out_dir, exist_ok=True)
+
+    n_files = max(1, int(round(chunks / chunks_per_file)))
+    n_chars = chunks_per_file * CHARS_PER_CHUNK
+    queries = []
+    for i in range(n_files):
+        key = f"unit{i:06d}"
+        value = f"KX-{int(rng.integers(100000, 999999))}"
+        fact = f"The access code of {key} is {value}."
+        text = filler_text(n_chars, vocabulary, rng)
+        # Plant the fact at a random sentence boundary
+        position = text.find(". ", int(rng.integers(0, max(1, len(text) - 1))))
+        position = len(text) if position == -1 else position + 2
+        text = f"{text[:position]}{fact} {text[position:]}"
+
+        is_pdf = rng.random() < pdf_fraction
+        file_name = f"doc_{i:06d}.{'pdf' if is_pdf else 'txt'}"
+        file_path = os.path.join(out_dir, file_name)
+        if is_pdf:
+            write_pdf(file_path, text)
+        else:
+            with open(file_path, "w", encoding="utf-8") as f:
+                f.write(text)
+        queries.append({"query": f"What is the access code of {key}?", "answer": value, "file": file_name})
+
+    with open(os.path.join(out_dir, "queries.json"), "w", encoding="utf-8") as f:
+        json.dump(queries, f, indent=1)
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="bench_corpus", help="Output directory")
+    parser.add_argument("--chunks", type=int, default=10000, help="Approximate number of chunks")
+    parser.add_argument("--chunks-per-file", type=int, default=100)
+    parser.add_argument("--pdf-fraction", type=float, default=0.2)
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    queries = generate_corpus(args.out, args.chunks, args.chunks_per_file, args.pdf_fraction, args.vocabulary, args.seed)
+    print(f"Wrote {len(queries)} files (~{args.chunks} chunks) and queries.json to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
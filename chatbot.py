@@ -1,6 +1,13 @@
 from utils.document_processor import DocumentProcessor
 from utils.retriever import RAGRetriever
 from utils.llm import GroqLLM
+from utils.chunk_store import migrate_legacy_pickles, index_exists
+from utils.answer_cache import AnswerCache, MemoryCacheBackend, SQLiteCacheBackend
+from utils.metadata_filter import normalize_filters
+from utils.dedup import unique_sources
+from utils.reranker import CrossEncoderReranker
+from utils.sharding import ShardedDocumentProcessor, ShardedRetriever, sharded_index_exists
+from utils import metrics
 import os
 import sys
 
@@ -8,11 +15,41 @@ class RAGChatbot:
     def __init__(
         self,
         data_dir="./data",
-        index_file="faiss_index.pkl", 
-        data_file="documents_data.pkl",
+        index_file="faiss_index.faiss", 
+        data_file="documents_data",
+        manifest_file="index_manifest.json",
+        bm25_file="bm25_index",
         embedding_model="all-MiniLM-L6-v2",
         groq_model="llama3-8b-8192",  # Using a smaller model by default
-        top_k=5
+        top_k=5,
+        index_type="flat",
+        nprobe=None,
+        ef_search=None,
+        cache_backend="memory",
+        cache_file="answer_cache.sqlite3",
+        cache_size=1024,
+        cache_ttl=24 * 3600,
+        cache_threshold=0.95,
+        embedding_backend="sentence-transformers",
+        embedding_options=None,
+        batch_window_ms=None,
+        hybrid_search=True,
+        rerank=False,
+        rerank_model="cross-encoder/ms-marco-MiniLM-L-6-v2",
+        rerank_candidates=50,
+        rerank_budget_ms=250,
+        mmr=True,
+        mmr_lambda=0.7,
+        llm_timeout=30.0,
+        llm_max_in_flight=8,
+        llm_requests_per_second=None,
+        context_token_budget=3000,
+        llm=None,
+        name="default",
+        shards=None,
+        shards_dir="index_shards",
+        shard_mode="threads",
+        shard_addresses=None
     ):
         """
         Initialize the RAG chatbot
@@ -20,59 +57,297 @@ class RAGChatbot:
         Args:
             data_dir: Directory containing documents
             index_file: Path to the FAISS index file
-            data_file: Path to the document data file
+            data_file: Path to the chunk store directory
+            manifest_file: Path of the file manifest used for incremental index updates
+            bm25_file: Path to the BM25 keyword index directory
             embedding_model: Name of the SentenceTransformer model
             groq_model: Name of the Groq LLM model
             top_k: Number of documents to retrieve
+            index_type: FAISS index type used when building ("flat", "ivf_flat", "ivf_pq", "hnsw")
+            nprobe: IVF clusters visited per query
+            ef_search: HNSW candidate list size per query
+            cache_backend: Answer cache storage: "memory", "sqlite" or None to disable
+            cache_file: SQLite file used by the "sqlite" cache backend
+            cache_size: Maximum number of cached answers
+            cache_ttl: Seconds a cached answer stays valid
+            cache_threshold: Cosine similarity above which a paraphrased query reuses an answer
+            embedding_backend: "sentence-transformers" or "onnx" (int8-quantized by default)
+            embedding_options: Backend options such as batch_size, num_threads or quantize
+            batch_window_ms: Micro-batch concurrent retrievals arriving within this window
+            hybrid_search: Fuse BM25 keyword and dense results with reciprocal-rank fusion
+            rerank: Rerank over-fetched candidates with a cross-encoder
+            rerank_model: sentence-transformers CrossEncoder model used for reranking
+            rerank_candidates: Candidates fetched per query for the reranker
+            rerank_budget_ms: Reranking time per query before falling back to retrieval order
+            mmr: Diversify the top_k with maximal marginal relevance (ignored with rerank)
+            mmr_lambda: MMR relevance/diversity trade-off (1 keeps the retrieval order)
+            llm_timeout: Deadline in seconds for one Groq answer, including retries
+            llm_max_in_flight: Groq requests allowed in flight at once
+            llm_requests_per_second: Client-side Groq rate limit (None for no limit)
+            context_token_budget: Maximum tokens of retrieved context in a prompt (None for no limit)
+            llm: GroqLLM to share with other chatbots (the llm_* options then do not apply)
+            name: Collection name used to label metrics
+            shards: Split the index into this many shards searched in parallel (None for one index)
+            shards_dir: Directory of the sharded index
+            shard_mode: Search local shards with "threads" or "processes"
+            shard_addresses: (host, port) of shard servers to search instead of local shards
         """
         self.data_dir = data_dir
         self.index_file = index_file
         self.data_file = data_file
+        self.manifest_file = manifest_file
+        self.bm25_file = bm25_file
+        self.index_type = index_type
+        self.embedding_model = embedding_model
+        self.embedding_backend = embedding_backend
+        self.embedding_options = embedding_options
+        self.shards = shards
+        self.shards_dir = shards_dir
+        sharded = bool(shards or shard_addresses)
         
         print("Initializing RAG Chatbot...")
         
-        # Check if the index and data files exist
-        if not (os.path.exists(index_file) and os.path.exists(data_file)):
-            print("FAISS index or data file not found. Building index...")
-            self.build_index()
+        if sharded:
+            # Shard servers manage their own files
+            if not shard_addresses and not sharded_index_exists(shards_dir):
+                print("Sharded index not found. Building index...")
+                self.build_index()
         else:
-            print(f"Using existing index ({index_file}) and data ({data_file})")
+            # Convert indexes saved by older versions as pickles
+            if not index_exists(index_file, data_file) and \
+               os.path.exists("faiss_index.pkl") and os.path.exists("documents_data.pkl"):
+                print("Migrating pickled index to the native on-disk format...")
+                migrate_legacy_pickles(data_file=data_file)
+            
+            # Check if the index and data files exist
+            if not index_exists(index_file, data_file):
+                print("FAISS index or data file not found. Building index...")
+                self.build_index()
+            else:
+                print(f"Using existing index ({index_file}) and data ({data_file})")
+        
+        # Initialize the optional reranker
+        reranker = None
+        if rerank:
+            print(f"Loading reranker {rerank_model}...")
+            reranker = CrossEncoderReranker(model_name=rerank_model, time_budget_ms=rerank_budget_ms)
         
         # Initialize the retriever
         print("Initializing retriever...")
-        self.retriever = RAGRetriever(
-            index_file=index_file,
-            data_file=data_file,
+        retriever_options = dict(
             model_name=embedding_model,
-            top_k=top_k
+            top_k=top_k,
+            nprobe=nprobe,
+            ef_search=ef_search,
+            embedding_backend=embedding_backend,
+            embedding_options=embedding_options,
+            batch_window_ms=batch_window_ms,
+            hybrid=hybrid_search,
+            reranker=reranker,
+            rerank_candidates=rerank_candidates,
+            mmr=mmr,
+            mmr_lambda=mmr_lambda,
+            name=name
         )
+        if sharded:
+            self.retriever = ShardedRetriever(
+                shards_dir=shards_dir,
+                mode=shard_mode,
+                addresses=shard_addresses,
+                **retriever_options
+            )
+        else:
+            self.retriever = RAGRetriever(
+                index_file=index_file,
+                data_file=data_file,
+                bm25_file=bm25_file,
+                **retriever_options
+            )
         
         # Initialize the LLM
-        print("Initializing LLM...")
-        self.llm = GroqLLM(model_name=groq_model)
+        self.llm = llm
+        if self.llm is None:
+            print("Initializing LLM...")
+            self.llm = GroqLLM(
+                model_name=groq_model,
+                timeout=llm_timeout,
+                max_in_flight=llm_max_in_flight,
+                requests_per_second=llm_requests_per_second,
+                context_token_budget=context_token_budget
+            )
+        
+        # Initialize the answer cache
+        self.cache = None
+        if cache_backend is not None:
+            backend = SQLiteCacheBackend(cache_file) if cache_backend == "sqlite" else MemoryCacheBackend()
+            self.cache = AnswerCache(
+                backend=backend,
+                max_size=cache_size,
+                ttl=cache_ttl,
+                similarity_threshold=cache_threshold
+            )
     
     def build_index(self):
         """Build the document index"""
+        if self.shards:
+            ShardedDocumentProcessor(
+                data_dir=self.data_dir,
+                shards_dir=self.shards_dir,
+                n_shards=self.shards,
+                model_name=self.embedding_model,
+                index_type=self.index_type,
+                embedding_backend=self.embedding_backend,
+                embedding_options=self.embedding_options
+            ).process_documents()
+            return
         processor = DocumentProcessor(
-            data_dir=self.data_dir
+            data_dir=self.data_dir,
+            index_file=self.index_file,
+            data_file=self.data_file,
+            manifest_file=self.manifest_file,
+            bm25_file=self.bm25_file,
+            model_name=self.embedding_model,
+            index_type=self.index_type,
+            embedding_backend=self.embedding_backend,
+            embedding_options=self.embedding_options
         )
         processor.process_documents()
     
-    def chat(self, query):
-        """Process a query and return a response"""
-        # Retrieve relevant documents
-        retrieved_docs = self.retriever.retrieve(query)
+    def reload_index(self):
+        """Swap in the index on disk without interrupting in-flight chats"""
+        self.retriever.reload()
+        if self.cache is not None:
+            self.cache.check_version(self.retriever.index_version)
+    
+    def close(self):
+        """Release background resources; in-flight chats still complete"""
+        self.retriever.close()
+    
+    def _cached_result(self, query, cached, cache_level):
+        """Build a chat result from a cached answer"""
+        return dict(cached, query=query, cached=cache_level)
+    
+    def _lookup_cache(self, query, filters=None):
+        """
+        Check the answer cache for a query
+        
+        Filtered queries bypass the cache: a cached answer may come from
+        documents outside the filter.
+        
+        Returns:
+            (cached result or None, query embedding, retrieved documents); the
+            embedding and documents are None when the exact-match level hit
+        """
+        filters = normalize_filters(filters)
+        if self.cache is None or filters is not None:
+            with metrics.stage("chat", "retrieve"):
+                return None, None, self.retriever.retrieve(query, filters=filters)
+        
+        # Answers cached against a previous index build are stale
+        self.cache.check_version(self.retriever.index_version)
+        
+        with metrics.stage("chat", "cache_lookup"):
+            cached = self.cache.lookup_exact(query)
+        if cached is not None:
+            metrics.CACHE_LOOKUPS.labels("exact_hit").inc()
+            return self._cached_result(query, cached, "exact"), None, None
+        
+        # Retrieve relevant documents, keeping the embedding for the semantic lookup
+        with metrics.stage("chat", "retrieve"):
+            query_embedding, retrieved_docs = self.retriever.embed_and_retrieve(query)
+        
+        with metrics.stage("chat", "cache_lookup"):
+            cached = self.cache.lookup_semantic(query_embedding, retrieved_docs["ids"])
+        if cached is not None:
+            metrics.CACHE_LOOKUPS.labels("semantic_hit").inc()
+            return self._cached_result(query, cached, "semantic"), query_embedding, retrieved_docs
+        metrics.CACHE_LOOKUPS.labels("miss").inc()
+        return None, query_embedding, retrieved_docs
+    
+    def _store_in_cache(self, query, query_embedding, retrieved_docs, text, points):
+        """Cache a freshly generated answer"""
+        if self.cache is None or query_embedding is None:
+            return
+        self.cache.store(query, query_embedding, retrieved_docs["ids"], {
+            "response": text,
+            "response_points": points,
+            "retrieved_documents": retrieved_docs
+        })
+    
+    def chat(self, query, filters=None):
+        """
+        Process a query and return a response
+        
+        Args:
+            query: The user's question
+            filters: Optional metadata filters restricting the searched chunks
+                (see utils.metadata_filter.normalize_filters)
+        
+        Stage timings are recorded in utils.metrics; wrap the call in
+        metrics.collect_timings() to get them for this query.
+        """
+        with metrics.stage("chat", "total"):
+            result = self._chat(query, filters)
+        metrics.CHAT_REQUESTS.labels(result.pop("outcome")).inc()
+        return result
+    
+    def _chat(self, query, filters=None):
+        # Reuse a cached answer for repeated or paraphrased queries
+        cached, query_embedding, retrieved_docs = self._lookup_cache(query, filters)
+        if cached is not None:
+            return dict(cached, outcome=f"cached_{cached['cached']}")
         
         # Generate response using the LLM
-        response_data = self.llm.generate_response(query, retrieved_docs)
+        with metrics.stage("chat", "generate"):
+            response_data = self.llm.generate_response(query, retrieved_docs)
+        
+        if not response_data.get('error'):
+            self._store_in_cache(query, query_embedding, retrieved_docs, response_data['text'], response_data['points'])
         
         return {
             "query": query,
             "response": response_data['text'],
             "response_points": response_data['points'],
-            "retrieved_documents": retrieved_docs
+            "retrieved_documents": retrieved_docs,
+            "context_stats": response_data.get('context'),
+            "outcome": "error" if response_data.get('error') else "answered"
         }
     
+    def chat_stream(self, query, filters=None):
+        """
+        Process a query and stream the response, optionally within metadata filters
+        
+        Yields:
+            A {"type": "sources"} event with the retrieved documents' sources,
+            then the token/point/done events of GroqLLM.stream_response
+        """
+        cached, query_embedding, retrieved_docs = self._lookup_cache(query, filters)
+        if cached is not None:
+            retrieved_docs = cached["retrieved_documents"]
+        
+        yield {
+            "type": "sources",
+            "sources": unique_sources(retrieved_docs["metadata"])
+        }
+        
+        # A cached answer is sent as a single token
+        if cached is not None:
+            yield {"type": "token", "text": cached["response"]}
+            for point in cached["response_points"]:
+                yield {"type": "point", "text": point}
+            yield {"type": "done", "text": cached["response"], "points": cached["response_points"], "cached": cached["cached"]}
+            metrics.CHAT_REQUESTS.labels(f"cached_{cached['cached']}").inc()
+            return
+        
+        # Stream the response from the LLM
+        for event in self.llm.stream_response(query, retrieved_docs):
+            if event["type"] == "done":
+                self._store_in_cache(query, query_embedding, retrieved_docs, event["text"], event["points"])
+                metrics.CHAT_REQUESTS.labels("answered").inc()
+            elif event["type"] == "error":
+                metrics.CHAT_REQUESTS.labels("error").inc()
+            yield event
+    
     def interactive_chat(self):
         """Run an interactive chat session"""
         print("RAG Chatbot initialized. Type 'exit' to quit.\n")
@@ -102,5 +377,20 @@ class RAGChatbot:
 
 
 if __name__ == "__main__":
+    import argparse
+    from utils.batch_qa import run_batch
+    
+    parser = argparse.ArgumentParser(description="Chat with your documents")
+    parser.add_argument("--batch", help="JSONL file of questions to answer instead of chatting")
+    parser.add_argument("--output", help="JSONL file for batch answers (default: <batch file>.answers.jsonl)")
+    parser.add_argument("--concurrency", type=int, default=8, help="LLM calls in flight during a batch")
+    parser.add_argument("--no-resume", action="store_true", help="Overwrite the output instead of skipping answered questions")
+    args = parser.parse_args()
+    
     chatbot = RAGChatbot()
-    chatbot.interactive_chat()
\ No newline at end of file
+    if args.batch:
+        output = args.output or os.path.splitext(args.batch)[0] + ".answers.jsonl"
+        summary = run_batch(chatbot, args.batch, output, concurrency=args.concurrency, resume=not args.no_resume)
+        print(f"Wrote {output}: {summary['answered']} answered, {summary['failed']} failed, {summary['skipped']} skipped")
+    else:
+        chatbot.interactive_chat()
\ No newline at end of file
@@ -0,0 +1,35 @@
+"""
+Gunicorn settings for wsgi.py
+
+Environment overrides: PORT, WEB_CONCURRENCY (workers), GUNICORN_THREADS
+(threads per worker) and TORCH_THREADS (torch threads per worker).
+
+Keep one worker while the app builds indexes: background jobs, index
+hot-swaps and answer-cache invalidation live in the worker that ran the
+job, so with several workers /jobs/<id> polls miss, other workers keep
+serving the old index, and concurrent jobs write the same index at once.
+Several workers are only safe for a read-only deployment whose indexes are
+built elsewhere.
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+worker_class = "gthread"
+timeout = 120  # Streaming answers and index jobs can run long
+preload_app = True
+
+# Thread pools do not survive fork. Keep torch and the tokenizers
+# single-threaded while the master warms up, so no pool threads exist when
+# workers are forked, then give each worker its share of the cores.
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+
+def post_fork(server, worker):
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(int(os.getenv("TORCH_THREADS", max(1, (os.cpu_count() or 1) // workers))))
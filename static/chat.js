@@ -28,8 +28,28 @@ function sendMessage() {
     // Show typing indicator
     showTypingIndicator();
 
-    // Send message to backend
-    fetch('/api/chat', {
+    // Stream the response when the browser supports reading response bodies
+    const request = window.ReadableStream && window.TextDecoder
+        ? streamMessage(message)
+        : fetchMessage(message);
+
+    request
+    .catch(error => {
+        removeTypingIndicator();
+        addMessage('Sorry, there was a connection error. Please try again.', 'bot', true);
+        console.error('Error:', error);
+    })
+    .finally(() => {
+        // Re-enable send button
+        sendButton.disabled = false;
+        sendButton.textContent = 'Send';
+        messageInput.focus();
+    });
+}
+
+function fetchMessage(message) {
+    // Send message to backend and render the complete response
+    return fetch('/api/chat', {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json',
@@ -47,20 +67,96 @@ function sendMessage() {
         } else {
             addMessage(data.error || 'Sorry, there was an error processing your message.', 'bot', true);
         }
-    })
-    .catch(error => {
-        removeTypingIndicator();
-        addMessage('Sorry, there was a connection error. Please try again.', 'bot', true);
-        console.error('Error:', error);
-    })
-    .finally(() => {
-        // Re-enable send button
-        sendButton.disabled = false;
-        sendButton.textContent = 'Send';
-        messageInput.focus();
     });
 }
 
+async function streamMessage(message) {
+    // Send message to the SSE endpoint and render tokens as they arrive
+    const response = await fetch('/api/chat/stream', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream',
+        },
+        body: JSON.stringify({ message: message })
+    });
+
+    if (!response.ok || !response.body) {
+        const data = await response.json().catch(() => ({}));
+        removeTypingIndicator();
+        addMessage(data.error || 'Sorry, there was an error processing your message.', 'bot', true);
+        return;
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let messageContent = null;
+    let text = '';
+
+    function handleEvent(event) {
+        if (event.type === 'token') {
+            if (!messageContent) {
+                // First token: swap the typing indicator for the message
+                removeTypingIndicator();
+                messageContent = createStreamingMessage('bot');
+            }
+            text += event.text;
+            messageContent.innerHTML = '';
+            messageContent.appendChild(document.createTextNode(text));
+            messageContent.insertAdjacentHTML('beforeend', '<span class="typewriter-cursor">|</span>');
+            chatMessages.scrollTop = chatMessages.scrollHeight;
+        } else if (event.type === 'done') {
+            removeTypingIndicator();
+            if (!messageContent) {
+                messageContent = createStreamingMessage('bot');
+            }
+            messageContent.textContent = event.text;
+        } else if (event.type === 'error') {
+            removeTypingIndicator();
+            addMessage(event.text, 'bot', true);
+        }
+    }
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Events are separated by a blank line; keep any partial event buffered
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        for (const rawEvent of events) {
+            const dataLine = rawEvent.split('\n').find(line => line.startsWith('data: '));
+            if (dataLine) {
+                handleEvent(JSON.parse(dataLine.slice(6)));
+            }
+        }
+    }
+
+    removeTypingIndicator();
+    if (messageContent) {
+        // Remove the cursor if the stream ended without a done event
+        const cursor = messageContent.querySelector('.typewriter-cursor');
+        if (cursor) cursor.remove();
+    }
+}
+
+function createStreamingMessage(sender) {
+    const messageDiv = document.createElement('div');
+    messageDiv.className = `message ${sender}-message`;
+    
+    const messageContent = document.createElement('div');
+    messageContent.className = 'message-content typewriter-container';
+    
+    messageDiv.appendChild(messageContent);
+    chatMessages.appendChild(messageDiv);
+    
+    // Scroll to bottom
+    chatMessages.scrollTop = chatMessages.scrollHeight;
+    return messageContent;
+}
+
 function addMessage(text, sender, isError = false) {
     const messageDiv = document.createElement('div');
     messageDiv.className = `message ${sender}-message`;
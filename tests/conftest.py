@@ -0,0 +1,80 @@
+"""
+Shared fixtures: an offline DocumentProcessor and RAGRetriever over a temporary directory
+
+Files are split into one chunk per paragraph instead of going through
+LangChain, and chunks are embedded with the hashing backend of the
+benchmarks, so the tests need only faiss, numpy and pytest.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from benchmarks.offline import HashingEmbeddingBackend
+from utils import document_processor
+from utils.document_processor import DocumentProcessor
+from utils.retriever import RAGRetriever
+
+
+@pytest.fixture
+def parsed(monkeypatch):
+    """Split files on blank lines, and record which files were parsed"""
+    calls = []
+
+    def parse_file(file_path, chunk_size, chunk_overlap, pdf_extractor="pypdf", text_cache_dir=None, file_hash=None):
+        calls.append(os.path.basename(file_path))
+        with open(file_path, 'r', encoding='utf-8') as f:
+            texts = [text.strip() for text in f.read().split("\n\n") if text.strip()]
+        return [(text, {"source": file_path}) for text in texts], None
+
+    monkeypatch.setattr(document_processor, "parse_file", parse_file)
+    return calls
+
+
+@pytest.fixture
+def make_processor(tmp_path, parsed):
+    """Factory of DocumentProcessors sharing one data directory and index"""
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+
+    def make(**options):
+        return DocumentProcessor(
+            data_dir=str(data_dir),
+            index_file=str(tmp_path / "faiss_index.faiss"),
+            data_file=str(tmp_path / "documents_data"),
+            manifest_file=str(tmp_path / "index_manifest.json"),
+            bm25_file=str(tmp_path / "bm25_index"),
+            text_cache_dir=None,
+            workers=1,
+            embed_batch_size=16,
+            embedding_backend=HashingEmbeddingBackend(dimension=32),
+            **options
+        )
+
+    make.data_dir = str(data_dir)
+    return make
+
+
+@pytest.fixture
+def make_retriever(tmp_path):
+    """Factory of RAGRetrievers over the index written by make_processor"""
+    retrievers = []
+
+    def make(**options):
+        options.setdefault("mmr", False)
+        retriever = RAGRetriever(
+            index_file=str(tmp_path / "faiss_index.faiss"),
+            data_file=str(tmp_path / "documents_data"),
+            bm25_file=str(tmp_path / "bm25_index"),
+            embedding_backend=HashingEmbeddingBackend(dimension=32),
+            **options
+        )
+        retrievers.append(retriever)
+        return retriever
+
+    yield make
+    for retriever in retrievers:
+        retriever.close()
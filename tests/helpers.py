@@ -0,0 +1,28 @@
+"""Corpus helpers shared by the tests"""
+import os
+import random
+
+
+def paragraph(seed, words=40):
+    """Text that shares no shingles with other seeds, so only copies are duplicates"""
+    rng = random.Random(seed)
+    return " ".join(f"w{rng.randrange(100000)}" for _ in range(words))
+
+
+def write_file(path, paragraphs, mtime=None):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("\n\n".join(paragraphs))
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def stored_chunks(store):
+    """{text: (chunk ID, source, duplicate sources)} of every stored chunk"""
+    duplicates = store.duplicate_sources()
+    chunks = {}
+    for batch in store.iter_batches():
+        for chunk_id, text, meta in zip(batch["ids"], batch["texts"], batch["metadata"]):
+            chunk_id = int(chunk_id)
+            sources = sorted(entry["source"] for entry in duplicates.get(chunk_id, ()))
+            chunks[text] = (chunk_id, meta["source"], sources)
+    return chunks
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+from utils import answer_cache
+from utils.answer_cache import AnswerCache, MemoryCacheBackend, SQLiteCacheBackend
+
+RESPONSE = {"text": "Answer", "points": ["Answer"]}
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_backend(request, tmp_path):
+    def make():
+        if request.param == "memory":
+            return MemoryCacheBackend()
+        return SQLiteCacheBackend(str(tmp_path / "answers.sqlite3"))
+    return make
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controls time.time() as seen by the cache"""
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache.time, "time", lambda: now[0])
+    return now
+
+
+def embedding(*values):
+    return np.array(values, dtype='float32')
+
+
+def test_exact_hit_ignores_case_whitespace_and_punctuation(make_backend):
+    cache = AnswerCache(make_backend())
+    cache.store("What is  FAISS?", embedding(1, 0), [1, 2], RESPONSE)
+
+    assert cache.lookup_exact("what is faiss") == RESPONSE
+    assert cache.lookup_exact("What is HNSW?") is None
+    assert cache.stats()["exact_hits"] == 1
+
+
+def test_semantic_hit_needs_a_close_embedding_and_the_same_chunks(make_backend):
+    cache = AnswerCache(make_backend(), similarity_threshold=0.95)
+    cache.store("What is FAISS?", embedding(1, 0, 0), [1, 2], RESPONSE)
+
+    assert cache.lookup_semantic(embedding(0.99, 0.1, 0), [1, 2]) == RESPONSE
+    assert cache.lookup_semantic(embedding(0.99, 0.1, 0), [2, 1]) is None
+    assert cache.lookup_semantic(embedding(0.5, 0.5, 0), [1, 2]) is None
+    stats = cache.stats()
+    assert (stats["semantic_hits"], stats["misses"]) == (1, 2)
+
+
+def test_entries_expire_after_the_ttl(make_backend, clock):
+    cache = AnswerCache(make_backend(), ttl=60)
+    cache.store("What is FAISS?", embedding(1, 0), [1], RESPONSE)
+
+    clock[0] += 59
+    assert cache.lookup_exact("What is FAISS?") == RESPONSE
+    assert cache.lookup_semantic(embedding(1, 0), [1]) == RESPONSE
+
+    clock[0] += 2
+    assert cache.lookup_semantic(embedding(1, 0), [1]) is None
+    assert cache.lookup_exact("What is FAISS?") is None
+    assert len(cache.backend) == 0
+
+
+def test_new_index_version_drops_every_entry(make_backend):
+    cache = AnswerCache(make_backend())
+    cache.check_version("build-1")
+    cache.store("What is FAISS?", embedding(1, 0), [1], RESPONSE)
+
+    cache.check_version("build-1")
+    assert cache.lookup_exact("What is FAISS?") == RESPONSE
+
+    cache.check_version("build-2")
+    assert cache.lookup_exact("What is FAISS?") is None
+    assert cache.lookup_semantic(embedding(1, 0), [1]) is None
+    assert cache.stats()["invalidations"] == 1
+    assert cache.backend.get_version() == "build-2"
+
+
+def test_least_recently_used_entry_is_evicted(make_backend, clock):
+    cache = AnswerCache(make_backend(), max_size=2)
+    for i, query in enumerate(["first", "second"]):
+        clock[0] += 1
+        cache.store(query, embedding(1, i), [i], RESPONSE)
+    clock[0] += 1
+    assert cache.lookup_exact("first") == RESPONSE  # "second" is now the oldest
+
+    clock[0] += 1
+    cache.store("third", embedding(0, 1), [3], RESPONSE)
+
+    assert len(cache.backend) == 2
+    assert cache.lookup_exact("second") is None
+    assert cache.lookup_exact("first") == RESPONSE
+    assert cache.lookup_exact("third") == RESPONSE
+    assert cache.stats()["evictions"] == 1
+
+
+def test_semantic_lookups_see_entries_from_other_processes(tmp_path):
+    # Each worker process has its own connection to the shared file
+    path = str(tmp_path / "answers.sqlite3")
+    first, second = AnswerCache(SQLiteCacheBackend(path)), AnswerCache(SQLiteCacheBackend(path))
+    assert first.lookup_semantic(embedding(1, 0), [1]) is None
+
+    second.store("What is FAISS?", embedding(1, 0), [1], RESPONSE)
+    assert first.lookup_semantic(embedding(1, 0), [1]) == RESPONSE
+
+    second.invalidate()
+    second.store("What is HNSW?", embedding(0, 1), [2], RESPONSE)
+    assert first.lookup_semantic(embedding(1, 0), [1]) is None
+    assert first.lookup_semantic(embedding(0, 1), [2]) == RESPONSE
@@ -0,0 +1,174 @@
+import os
+import time
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from helpers import paragraph, write_file
+from utils.batching import MicroBatcher, BatcherClosed
+
+
+def doubled(items):
+    return [item * 2 for item in items]
+
+
+class BlockingBatch:
+    """process_batch that holds the first batch until released"""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.batches = []
+
+    def __call__(self, items):
+        self.batches.append(list(items))
+        self.started.set()
+        assert self.release.wait(5)
+        return doubled(items)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.005)
+
+
+def test_concurrent_submits_are_batched():
+    batcher = MicroBatcher(doubled, window_ms=50, max_batch_size=8)
+    with ThreadPoolExecutor(32) as pool:
+        results = list(pool.map(lambda i: batcher.submit(i, timeout=5), range(32)))
+    batcher.close()
+
+    assert results == [i * 2 for i in range(32)]
+    assert batcher.stats["items"] == 32
+    assert batcher.stats["batches"] < 32
+    assert batcher.stats["max_batch"] <= 8
+
+
+def test_batch_errors_reach_every_caller():
+    def fail(items):
+        raise ValueError("model unavailable")
+
+    batcher = MicroBatcher(fail, window_ms=20)
+    with ThreadPoolExecutor(4) as pool:
+        futures = [pool.submit(batcher.submit, i, 5) for i in range(4)]
+        for future in futures:
+            with pytest.raises(ValueError, match="model unavailable"):
+                future.result()
+    batcher.close()
+
+
+def test_items_queued_before_close_are_processed():
+    process = BlockingBatch()
+    batcher = MicroBatcher(process, window_ms=0, max_batch_size=2)
+    with ThreadPoolExecutor(8) as pool:
+        first = pool.submit(batcher.submit, 0, 5)
+        assert process.started.wait(5)
+        # Queued while the first batch is still being processed
+        queued = [pool.submit(batcher.submit, i, 5) for i in range(1, 6)]
+        wait_for(lambda: batcher.queue.qsize() == 5)
+
+        closing = pool.submit(batcher.close)
+        wait_for(lambda: batcher.closed)
+        with pytest.raises(BatcherClosed):
+            batcher.submit(99)
+
+        process.release.set()
+        closing.result(5)
+        assert first.result() == 0
+        assert [future.result() for future in queued] == [2, 4, 6, 8, 10]
+    assert not batcher._thread.is_alive()
+    # Leftovers are still processed in batches of at most max_batch_size
+    assert max(len(batch) for batch in process.batches) <= 2
+
+
+def test_submit_racing_close_never_hangs():
+    for _ in range(20):
+        batcher = MicroBatcher(doubled, window_ms=1)
+        start = threading.Barrier(9)
+
+        def submit(i):
+            start.wait()
+            try:
+                return batcher.submit(i, timeout=5)
+            except BatcherClosed:
+                return None
+
+        def close():
+            start.wait()
+            batcher.close()
+
+        with ThreadPoolExecutor(9) as pool:
+            futures = [pool.submit(submit, i) for i in range(8)]
+            pool.submit(close).result(5)
+            results = [future.result(5) for future in futures]
+
+        # Every caller got its result or BatcherClosed; none timed out
+        assert all(result in (None, i * 2) for i, result in enumerate(results))
+
+
+def test_close_is_idempotent():
+    batcher = MicroBatcher(doubled)
+    assert batcher.submit(1, timeout=5) == 2
+    batcher.close()
+    batcher.close()
+    with pytest.raises(BatcherClosed):
+        batcher.submit(1)
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_forked_child_starts_its_own_thread():
+    batcher = MicroBatcher(doubled)
+    assert batcher.submit(1, timeout=5) == 2
+
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # Child: the parent's batching thread was not inherited
+        status = 1
+        try:
+            signal.alarm(10)
+            result = batcher.submit(21, timeout=5)
+            restarted = batcher._thread.is_alive() and batcher._pid == os.getpid()
+            batcher.close()
+            os.write(write_end, f"{result} {restarted}".encode())
+            status = 0
+        finally:
+            os._exit(status)
+
+    os.close(write_end)
+    _, status = os.waitpid(pid, 0)
+    with os.fdopen(read_end) as f:
+        output = f.read()
+    assert os.WEXITSTATUS(status) == 0
+    assert output == "42 True"
+
+    # The parent's thread is unaffected
+    assert batcher.submit(2, timeout=5) == 4
+    batcher.close()
+
+
+def test_retriever_falls_back_when_its_batcher_is_closed(make_processor, make_retriever):
+    write_file(os.path.join(make_processor.data_dir, "a.txt"), [paragraph(seed) for seed in range(20)])
+    make_processor().process_documents()
+    direct = make_retriever(top_k=3)
+    retriever = make_retriever(top_k=3, batch_window_ms=5)
+    query = paragraph(4)
+
+    assert retriever.retrieve(query)["ids"] == direct.retrieve(query)["ids"]
+    assert retriever.batcher.stats["items"] == 1
+
+    # close() (e.g. on collection eviction) can run after retrieve() has read self.batcher
+    retriever.batcher.close()
+    assert retriever.retrieve(query)["ids"] == direct.retrieve(query)["ids"]
+    embedding, result = retriever.embed_and_retrieve(query)
+    assert result["ids"] == direct.retrieve(query)["ids"]
+    assert embedding.shape == (1, 32)
+    assert retriever.batcher.stats["items"] == 1
+
+    retriever.close()
+    assert retriever.batcher is None
+    assert retriever.retrieve(query)["ids"] == direct.retrieve(query)["ids"]
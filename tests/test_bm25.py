@@ -0,0 +1,129 @@
+import math
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from helpers import paragraph, write_file
+from utils.bm25 import tokenize, BM25Builder, BM25Index
+from utils.retriever import reciprocal_rank_fusion
+
+
+def test_tokenize_keeps_compound_identifiers_and_their_parts():
+    terms = tokenize("The CS-301 lab covers IPv4, TCP/IP and 802.11 in lecture_notes.pdf.")
+
+    assert Counter(terms) == Counter([
+        "cs-301", "lab", "covers", "ipv4", "tcp/ip", "802.11", "lecture_notes.pdf",
+        "cs", "301", "tcp", "ip", "802", "11", "lecture", "notes", "pdf"
+    ])
+
+
+def test_tokenize_drops_stopwords_inside_identifiers():
+    assert tokenize("state-of-the-art") == ["state-of-the-art", "state", "art"]
+
+
+def reference_scores(documents, query, k1=1.5, b=0.75):
+    """Textbook BM25 of every document against a query"""
+    tokenized = [tokenize(text) for text in documents]
+    avgdl = sum(len(terms) for terms in tokenized) / len(tokenized)
+    scores = []
+    for terms in tokenized:
+        counts, score = Counter(terms), 0.0
+        for term in tokenize(query):
+            df = sum(term in other for other in tokenized)
+            if not counts[term]:
+                continue
+            idf = math.log(1 + (len(tokenized) - df + 0.5) / (df + 0.5))
+            tf = counts[term]
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(terms) / avgdl))
+        scores.append(score)
+    return scores
+
+
+@pytest.fixture
+def corpus():
+    documents = [f"{paragraph(seed, words=20 + seed)} module cs-{300 + seed % 3}" for seed in range(30)]
+    documents[4] += " router ipv4 ipv4"
+    documents[11] += " ipv4 routing table"
+    documents[23] += " router"
+    return documents
+
+
+@pytest.fixture
+def index(corpus, tmp_path):
+    ids = np.arange(len(corpus)) * 10 + 7  # chunk IDs differ from rows
+    builder = BM25Builder()
+    builder.add(ids[:12], corpus[:12])
+    builder.add(ids[12:], corpus[12:])
+    builder.save(str(tmp_path / "bm25"), build_id="build-1")
+    return BM25Index(str(tmp_path / "bm25"))
+
+
+@pytest.mark.parametrize("query", ["ipv4 router", "cs-301", "301 module", "router router"])
+def test_search_matches_textbook_bm25(corpus, index, query):
+    expected = np.array(reference_scores(corpus, query), dtype='float32')
+
+    ids, scores = index.search(query, k=len(corpus))
+
+    matched = np.flatnonzero(expected)
+    assert sorted(ids.tolist()) == sorted((matched * 10 + 7).tolist())
+    np.testing.assert_allclose(scores, expected[(ids - 7) // 10], rtol=1e-5)
+    assert np.all(np.diff(scores) <= 0)
+
+
+def test_search_returns_the_best_k(corpus, index):
+    all_ids, all_scores = index.search("cs-301 ipv4", k=len(corpus))
+    ids, scores = index.search("cs-301 ipv4", k=3)
+
+    assert ids.tolist() == all_ids[:3].tolist()
+    np.testing.assert_array_equal(scores, all_scores[:3])
+
+
+def test_row_mask_excludes_rows_without_changing_scores(corpus, index):
+    all_ids, all_scores = index.search("ipv4 router", k=len(corpus))
+    row_mask = np.ones(len(corpus), dtype=bool)
+    row_mask[4] = False
+
+    ids, scores = index.search("ipv4 router", k=len(corpus), row_mask=row_mask)
+
+    assert 4 * 10 + 7 not in ids.tolist()
+    assert ids.tolist() == [i for i in all_ids.tolist() if i != 47]
+    np.testing.assert_array_equal(scores, all_scores[all_ids != 47])
+
+
+def test_search_without_known_terms_is_empty(index):
+    ids, scores = index.search("and the of", k=5)
+    assert len(ids) == len(scores) == 0
+    assert len(index.search("unknownterm", k=5)[0]) == 0
+    assert index.build_id == "build-1"
+
+
+def test_reciprocal_rank_fusion_ordering():
+    # 3: 1/63 + 1/61, 1: 1/61, 2 and 4: 1/62 each (ties keep first-seen order), 5: 1/63
+    assert reciprocal_rank_fusion([[1, 2, 3], [3, 4, 5]], k=60) == [3, 1, 2, 4, 5]
+    # An ID ranked second by both retrievers beats IDs ranked first by one
+    assert reciprocal_rank_fusion([[1, 9], [2, 9]], k=60)[0] == 9
+    assert reciprocal_rank_fusion([[], [4, 5]]) == [4, 5]
+
+
+def test_hybrid_retrieval_fuses_dense_and_keyword_rankings(make_processor, make_retriever):
+    paragraphs = [paragraph(seed) for seed in range(40)]
+    paragraphs[17] += " firmware-x42"
+    write_file(f"{make_processor.data_dir}/a.txt", paragraphs[:20])
+    write_file(f"{make_processor.data_dir}/b.txt", paragraphs[20:])
+    make_processor().process_documents()
+    query = "firmware-x42 update"
+
+    retriever = make_retriever(top_k=4, hybrid=True)
+    result = retriever.retrieve(query)
+
+    index, store, bm25 = retriever.snapshot
+    k = retriever.fusion_candidates
+    _, dense = index.search(retriever.model.encode([query]).astype('float32'), k)
+    keyword, _ = bm25.search(query, k)
+    expected = reciprocal_rank_fusion([[i for i in dense[0] if i != -1], keyword.tolist()], retriever.rrf_k)
+    assert result["ids"] == expected[:4]
+    assert paragraphs[17] in result["texts"]
+
+    dense_only = make_retriever(top_k=4, hybrid=False).retrieve(query)
+    assert dense_only["ids"] == [int(i) for i in dense[0][:4]]
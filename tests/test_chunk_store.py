@@ -0,0 +1,40 @@
+import os
+
+from utils.chunk_store import publish_build, current_build, CURRENT_FILE, BUILD_PREFIX, LEGACY_STORE_FILES
+
+
+def make_build(data_file, name):
+    path = os.path.join(data_file, f"{BUILD_PREFIX}{name}")
+    os.makedirs(path)
+    return path
+
+
+def test_publish_build_deletes_only_the_old_layout(tmp_path):
+    data_file = str(tmp_path / "documents_data")
+    os.makedirs(data_file)
+    for name in LEGACY_STORE_FILES + ("notes.txt", "manifest-backup.json"):
+        (tmp_path / "documents_data" / name).write_text("x")
+    legacy_index = tmp_path / "faiss_index.faiss"
+    legacy_index.write_text("x")
+    assert current_build(data_file) == data_file
+
+    # Readers may still be opening the old layout until a build replaces it
+    first = make_build(data_file, "a")
+    publish_build(data_file, first, legacy_files=[str(legacy_index)])
+    assert current_build(data_file) == first
+    assert os.path.exists(os.path.join(data_file, "store.json"))
+    assert legacy_index.exists()
+
+    second = make_build(data_file, "b")
+    publish_build(data_file, second, legacy_files=[str(legacy_index)])
+    assert current_build(data_file) == second
+    assert sorted(os.listdir(data_file)) == sorted(
+        [CURRENT_FILE, "notes.txt", "manifest-backup.json", os.path.basename(first), os.path.basename(second)]
+    )
+    assert not legacy_index.exists()
+
+    third = make_build(data_file, "c")
+    publish_build(data_file, third)
+    assert not os.path.exists(first)
+    assert os.path.exists(second) and os.path.exists(third)
+    assert os.path.exists(os.path.join(data_file, "notes.txt"))
@@ -0,0 +1,176 @@
+import sys
+import types
+
+import pytest
+
+from helpers import paragraph
+from utils.context_packer import ContextPacker, TokenCounter
+
+
+class WordTokenizer:
+    """Stand-in for a tokenizers.Tokenizer: one token per whitespace-separated word"""
+
+    class Encoding:
+        def __init__(self, text):
+            self.offsets = []
+            position = 0
+            for word in text.split():
+                start = text.index(word, position)
+                position = start + len(word)
+                self.offsets.append((start, position))
+            self.ids = list(range(len(self.offsets)))
+
+    def encode(self, text, add_special_tokens=True):
+        return self.Encoding(text)
+
+
+class WordCounter(TokenCounter):
+    def __init__(self):
+        super().__init__()
+        self._tokenizer = WordTokenizer()
+
+
+def chunks(text, size, overlap, source="a.txt", page=0, positions=True):
+    """Split text like the splitter does, with size-character chunks repeating overlap characters"""
+    texts, metadata = [], []
+    for start in range(0, len(text), size - overlap):
+        texts.append(text[start:start + size])
+        meta = {"source": source, "page": page}
+        if positions:
+            meta["start_index"] = start
+        metadata.append(meta)
+        if start + size >= len(text):
+            break
+    return texts, metadata
+
+
+def documents(texts, metadata):
+    return {"texts": texts, "metadata": metadata}
+
+
+@pytest.mark.parametrize("positions", [True, False])
+def test_overlapping_chunks_are_sent_once(positions):
+    text = paragraph(1, words=120)
+    texts, metadata = chunks(text, 200, 40, positions=positions)
+    # Retrieval order is not document order
+    order = [2, 0, 3, 1] + list(range(4, len(texts)))
+    texts, metadata = [texts[i] for i in order], [metadata[i] for i in order]
+
+    spans = ContextPacker(WordCounter()).merge_chunks(texts, metadata)
+
+    assert len(spans) == 1
+    assert spans[0]["text"] == text
+    assert spans[0]["chunks"] == len(texts)
+    assert spans[0]["rank"] == 0
+
+
+def test_only_same_page_touching_chunks_merge():
+    first, second, far = paragraph(1, words=30), paragraph(2, words=30), paragraph(3, words=30)
+    texts = [first, second, far, first]
+    metadata = [
+        {"source": "a.txt", "page": 0, "start_index": 0},
+        {"source": "a.txt", "page": 0, "start_index": len(first)},  # touches the first chunk
+        {"source": "a.txt", "page": 0, "start_index": 10 * len(first)},  # gap
+        {"source": "a.txt", "page": 1, "start_index": 0}  # same text, other page
+    ]
+
+    spans = ContextPacker(WordCounter()).merge_chunks(texts, metadata)
+
+    assert [span["text"] for span in spans] == [first + second, far, first]
+    assert [span["rank"] for span in spans] == [0, 2, 3]
+
+
+def test_pack_reports_merged_chunks_and_saved_tokens():
+    text = paragraph(1, words=120)
+    texts, metadata = chunks(text, 200, 40)
+    packer = ContextPacker(WordCounter(), token_budget=None)
+
+    context, stats = packer.pack(documents(texts, metadata))
+
+    assert context == packer.format_document(1, "a.txt", text)
+    assert stats["chunks"] == len(texts)
+    assert stats["chunks_merged"] == len(texts) - 1
+    assert stats["spans"] == 1 and stats["spans_dropped"] == 0
+    assert stats["tokens"] == WordCounter().count(context)
+    assert stats["tokens_saved"] == stats["tokens_original"] - stats["tokens"] > 0
+
+
+def test_budget_trims_the_lowest_ranked_spans():
+    counter = WordCounter()
+    texts = [paragraph(seed, words=50) for seed in range(5)]
+    metadata = [{"source": f"{seed}.txt"} for seed in range(5)]
+    span_tokens = counter.count(ContextPacker.format_document(1, "0.txt", texts[0]))
+    budget = 2 * span_tokens + 1 + 40  # two spans, their separator and part of a third
+
+    context, stats = ContextPacker(counter, token_budget=budget).pack(documents(texts, metadata))
+
+    assert stats["tokens"] <= budget
+    assert stats["tokens"] == counter.count(context) + stats["spans"] - 1
+    assert stats["spans"] == 3 and stats["spans_dropped"] == 2
+    assert stats["truncated"]
+    assert texts[0] in context and texts[1] in context
+    assert texts[2] not in context and " ".join(texts[2].split()[:20]) in context
+    assert "3.txt" not in context and "4.txt" not in context
+
+
+def test_budget_drops_a_span_too_short_to_be_useful():
+    counter = WordCounter()
+    texts = [paragraph(seed, words=50) for seed in range(3)]
+    metadata = [{"source": f"{seed}.txt"} for seed in range(3)]
+    span_tokens = counter.count(ContextPacker.format_document(1, "0.txt", texts[0]))
+    budget = span_tokens + 1 + 10
+
+    context, stats = ContextPacker(counter, token_budget=budget, min_span_tokens=32).pack(documents(texts, metadata))
+
+    assert stats["spans"] == 1 and stats["spans_dropped"] == 2
+    assert not stats["truncated"]
+    assert context == ContextPacker.format_document(1, "0.txt", texts[0])
+
+
+@pytest.fixture
+def fake_tokenizers(monkeypatch):
+    """Fake tokenizers and huggingface_hub modules that record what was loaded"""
+    loaded = []
+
+    class Tokenizer:
+        @staticmethod
+        def from_file(path):
+            loaded.append(("file", path))
+            return WordTokenizer()
+
+        @staticmethod
+        def from_pretrained(name):
+            loaded.append(("download", name))
+            return WordTokenizer()
+
+    cache = {}
+    monkeypatch.setitem(sys.modules, "tokenizers", types.SimpleNamespace(Tokenizer=Tokenizer))
+    monkeypatch.setitem(sys.modules, "huggingface_hub", types.SimpleNamespace(
+        try_to_load_from_cache=lambda repo_id, filename: cache.get((repo_id, filename))
+    ))
+    return loaded, cache
+
+
+def test_tokenizer_is_not_downloaded(fake_tokenizers):
+    loaded, cache = fake_tokenizers
+
+    counter = TokenCounter("llama3-8b-8192")
+    assert loaded == []  # nothing is loaded until the first count
+
+    assert counter.count("x" * 40) == 10  # estimated
+    assert counter.tokenizer is None
+    assert loaded == []
+
+    downloading = TokenCounter("llama3-8b-8192", allow_download=True)
+    assert downloading.count("three short words") == 3
+    assert loaded == [("download", "NousResearch/Meta-Llama-3-8B")]
+
+
+def test_tokenizer_is_read_from_a_local_path_or_the_cache(fake_tokenizers, tmp_path):
+    loaded, cache = fake_tokenizers
+    (tmp_path / "tokenizer.json").write_text("{}")
+    cache[("NousResearch/Meta-Llama-3-8B", "tokenizer.json")] = "/cache/tokenizer.json"
+
+    assert TokenCounter(tokenizer_name=str(tmp_path)).count("three short words") == 3
+    assert TokenCounter("llama3-8b-8192").count("three short words") == 3
+    assert loaded == [("file", str(tmp_path / "tokenizer.json")), ("file", "/cache/tokenizer.json")]
@@ -0,0 +1,129 @@
+import numpy as np
+import pytest
+
+from helpers import paragraph
+from utils.dedup import MinHasher, DuplicateIndex, text_hash, lookup_tables, NUM_PERM
+
+
+def shingles(text, size=3):
+    words = text.lower().split()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def jaccard(first, second):
+    a, b = shingles(first), shingles(second)
+    return len(a & b) / len(a | b)
+
+
+def with_changes(text, changes):
+    """The text with `changes` evenly spaced words replaced"""
+    words = text.split()
+    step = len(words) // (changes + 1)
+    for i in range(1, changes + 1):
+        words[i * step] = f"changed{i}"
+    return " ".join(words)
+
+
+def similarity(first, second):
+    return np.count_nonzero(first == second) / len(first)
+
+
+def test_signature_agreement_estimates_jaccard_similarity():
+    hasher = MinHasher(num_perm=256)
+    base = paragraph(1, words=200)
+    for changes in (1, 5, 15, 40):
+        variant = with_changes(base, changes)
+        estimate = similarity(hasher.signature(base), hasher.signature(variant))
+        # Standard error of a 256-permutation estimate is at most 1/32
+        assert abs(estimate - jaccard(base, variant)) < 0.1
+
+
+def test_exact_hash_ignores_case_and_whitespace():
+    text = paragraph(1)
+    assert text_hash(text) == text_hash("  " + text.upper().replace(" ", "\n "))
+    assert text_hash(text) != text_hash(paragraph(2))
+
+
+def near_signature(signature, equal):
+    """A signature agreeing with signature in its first `equal` positions (so band 0 matches)"""
+    other = signature.copy()
+    other[equal:] += np.uint32(1)
+    return other
+
+
+@pytest.mark.parametrize("stored", [False, True])
+def test_near_duplicates_are_found_from_the_threshold(stored):
+    signature = np.arange(NUM_PERM, dtype=np.uint32) * np.uint32(7919)
+    index = DuplicateIndex(threshold=0.85)
+    if stored:
+        index.add_stored(np.array([10]), np.array([111], dtype=np.uint64), signature[np.newaxis])
+    else:
+        index.add(10, 111, signature)
+
+    # 55 of 64 positions agree: 0.859 >= 0.85
+    assert index.find(222, near_signature(signature, 55)) == (10, "near")
+    # 54 of 64: 0.844
+    assert index.find(222, near_signature(signature, 54)) == (None, None)
+    assert index.find(111, near_signature(signature, 0)) == (10, "exact")
+
+
+@pytest.mark.parametrize("stored", [False, True])
+def test_most_similar_candidate_wins(stored):
+    base = np.arange(NUM_PERM, dtype=np.uint32)
+    close, closer = near_signature(base, 58), near_signature(base, 62)
+    index = DuplicateIndex(threshold=0.85)
+    if stored:
+        index.add_stored(np.array([3, 8]), np.array([1, 2], dtype=np.uint64), np.stack([close, closer]))
+    else:
+        index.add_many([3, 8], [1, 2], [close, closer])
+
+    assert index.find(5, base) == (8, "near")
+
+
+def test_candidates_must_share_a_band():
+    # Only one position in each of the 16 bands differs: 48 of 64 agree
+    base = np.arange(NUM_PERM, dtype=np.uint32)
+    other = base.copy()
+    other[::4] += np.uint32(1)
+    index = DuplicateIndex(threshold=0.7)
+    index.add(1, 1, base)
+
+    assert similarity(base, other) == 0.75
+    assert index.find(2, other) == (None, None)
+
+
+def test_stored_chunks_match_like_added_chunks_and_win_ties():
+    hasher = MinHasher()
+    texts = [paragraph(seed, words=120) for seed in range(6)]
+    hashes, signatures = hasher.fingerprints(texts)
+    ids = np.arange(6) * 3
+    queries = [texts[2], with_changes(texts[4], 1), paragraph(99, words=120)]
+    query_hashes, query_signatures = hasher.fingerprints(queries)
+
+    added = DuplicateIndex()
+    added.add_many(ids, hashes, signatures)
+    stored = DuplicateIndex()
+    stored.add_stored(ids, hashes, signatures, tables=lookup_tables(hashes, signatures, stored.bands))
+
+    expected = [(6, "exact"), (12, "near"), (None, None)]
+    assert [added.find(h, s) for h, s in zip(query_hashes, query_signatures)] == expected
+    assert [stored.find(h, s) for h, s in zip(query_hashes, query_signatures)] == expected
+
+    # A chunk added after the stored ones with the same text is not canonical
+    stored.add(100, hashes[2], signatures[2])
+    assert stored.find(query_hashes[0], query_signatures[0]) == (6, "exact")
+    assert len(stored) == 7
+
+
+def test_excluded_stored_chunks_are_not_matched():
+    hasher = MinHasher()
+    texts = [paragraph(seed, words=120) for seed in range(3)]
+    hashes, signatures = hasher.fingerprints(texts)
+    index = DuplicateIndex()
+    index.add_stored(np.array([1, 2, 3]), hashes, signatures, exclude_ids=np.array([2]))
+
+    assert len(index) == 2
+    assert index.find(hashes[1], signatures[1]) == (None, None)
+    variant_hashes, variant_signatures = hasher.fingerprints([with_changes(texts[1], 1)])
+    assert index.find(variant_hashes[0], variant_signatures[0]) == (None, None)
+    assert index.find(hashes[2], signatures[2]) == (3, "exact")
@@ -0,0 +1,375 @@
+"""Incremental indexing bookkeeping of DocumentProcessor"""
+import os
+import json
+
+import numpy as np
+
+from helpers import paragraph, write_file, stored_chunks
+from benchmarks.offline import HashingEmbeddingBackend
+from utils import index_factory
+from utils.bm25 import BM25Index
+from utils.chunk_store import ChunkStore, CURRENT_FILE, BUILD_PREFIX
+from utils.dedup import lookup_tables, BANDS
+from utils.document_processor import DocumentProcessor
+
+
+def test_diff_files(make_processor, parsed):
+    processor = make_processor()
+    paths = [os.path.join(processor.data_dir, f"{name}.txt") for name in "abc"]
+    for seed, path in enumerate(paths):
+        write_file(path, [paragraph(seed)], mtime=1000000000)
+    processor.process_documents()
+    manifest = processor.load_manifest()
+
+    a, b, c = paths
+    # a: touched, same content; b: new content; c: deleted; d: new file
+    write_file(a, [paragraph(0)], mtime=1000000100)
+    write_file(b, [paragraph(11), paragraph(12)], mtime=1000000100)
+    os.remove(c)
+    d = os.path.join(processor.data_dir, "d.txt")
+    write_file(d, [paragraph(3)])
+
+    diff = processor.diff_files(manifest, processor.list_source_files())
+    key = processor.file_key
+    assert diff["added"] == [key(d)]
+    assert diff["changed"] == [key(b)]
+    assert diff["removed"] == [key(c)]
+    assert diff["unchanged"] == [key(a)]
+    # Only files that were hashed get fresh fingerprints
+    assert sorted(diff["stats"]) == sorted([key(a), key(b), key(d)])
+    assert diff["stats"][key(a)]["sha256"] == manifest["files"][key(a)]["sha256"]
+
+
+def test_add_change_remove(make_processor, parsed):
+    processor = make_processor()
+    a = os.path.join(processor.data_dir, "a.txt")
+    b = os.path.join(processor.data_dir, "b.txt")
+    write_file(a, [paragraph(1), paragraph(2)])
+    write_file(b, [paragraph(3)])
+    index, store = processor.process_documents()
+    assert sorted(parsed) == ["a.txt", "b.txt"]
+    assert len(store) == index.ntotal == 3
+    first_ids = {text: chunk[0] for text, chunk in stored_chunks(store).items()}
+
+    # Nothing changed: nothing is parsed and the build stays published
+    parsed.clear()
+    index, store = processor.process_documents()
+    assert parsed == []
+    assert len(store) == 3
+
+    # Added file: only it is parsed, and existing chunks keep their IDs
+    c = os.path.join(processor.data_dir, "c.txt")
+    write_file(c, [paragraph(4)])
+    parsed.clear()
+    index, store = processor.process_documents()
+    assert parsed == ["c.txt"]
+    chunks = stored_chunks(store)
+    assert len(store) == index.ntotal == 4
+    assert all(chunks[text][0] == chunk_id for text, chunk_id in first_ids.items())
+    assert chunks[paragraph(4)][0] == 3
+
+    # Changed file: its old chunks are dropped, new ones get fresh IDs
+    write_file(a, [paragraph(5)], mtime=os.stat(a).st_mtime + 10)
+    parsed.clear()
+    index, store = processor.process_documents()
+    assert parsed == ["a.txt"]
+    chunks = stored_chunks(store)
+    assert sorted(chunks) == sorted([paragraph(3), paragraph(4), paragraph(5)])
+    assert chunks[paragraph(5)][0] == 4
+    assert len(store) == index.ntotal == 3
+    manifest = processor.load_manifest()
+    assert manifest["files"][processor.file_key(a)]["id_ranges"] == [[4, 5]]
+    assert manifest["next_id"] == 5
+
+    # Removed file
+    os.remove(b)
+    parsed.clear()
+    index, store = processor.process_documents()
+    assert parsed == []
+    assert sorted(stored_chunks(store)) == sorted([paragraph(4), paragraph(5)])
+    assert len(store) == index.ntotal == 2
+    assert processor.file_key(b) not in processor.load_manifest()["files"]
+
+    # The published build plus the previous one are kept, older builds pruned
+    builds = [name for name in os.listdir(processor.data_file) if name.startswith(BUILD_PREFIX)]
+    assert len(builds) == 2
+    with open(os.path.join(processor.data_file, CURRENT_FILE), 'r', encoding='utf-8') as f:
+        assert f.read().strip() in builds
+
+
+def test_duplicates_of_changed_file_are_reparsed(make_processor, parsed):
+    processor = make_processor()
+    a = os.path.join(processor.data_dir, "a.txt")
+    b = os.path.join(processor.data_dir, "b.txt")
+    write_file(a, [paragraph(1), paragraph(2)])
+    processor.process_documents()
+    write_file(b, [paragraph(1), paragraph(3)])
+    index, store = processor.process_documents()
+
+    # b's copy of paragraph 1 is only a reference to a's chunk
+    chunks = stored_chunks(store)
+    assert len(store) == 3
+    assert chunks[paragraph(1)][1:] == (a, [b])
+    assert processor.build_stats["duplicates_exact"] == 1
+    manifest = processor.load_manifest()
+    assert manifest["files"][processor.file_key(b)]["duplicate_ids"] == [chunks[paragraph(1)][0]]
+
+    # Changing a drops that chunk, so b is parsed again and stores it itself
+    write_file(a, [paragraph(2)], mtime=os.stat(a).st_mtime + 10)
+    parsed.clear()
+    index, store = processor.process_documents()
+    assert sorted(parsed) == ["a.txt", "b.txt"]
+    chunks = stored_chunks(store)
+    assert chunks[paragraph(1)][1:] == (b, [])
+    assert sorted(chunks) == sorted([paragraph(1), paragraph(2), paragraph(3)])
+    assert len(store) == index.ntotal == 3
+    assert "duplicate_ids" not in processor.load_manifest()["files"][processor.file_key(b)]
+
+
+def test_remove_file_repoints_duplicate_references(make_processor, parsed):
+    processor = make_processor()
+    a = os.path.join(processor.data_dir, "a.txt")
+    b = os.path.join(processor.data_dir, "b.txt")
+    write_file(a, [paragraph(1), paragraph(2)])
+    processor.process_documents()
+    write_file(b, [paragraph(1), paragraph(3)])
+    processor.process_documents()
+
+    os.remove(a)
+    parsed.clear()
+    assert processor.remove_file(a) == 2
+    assert parsed == ["b.txt"]
+    assert processor.build_stats == {
+        "removed_chunks": 2, "dropped_references": 0, "repointed_references": 1, "reindexed_files": 1
+    }
+    store = ChunkStore(processor.data_file)
+    chunks = stored_chunks(store)
+    assert sorted(chunks) == sorted([paragraph(1), paragraph(3)])
+    assert chunks[paragraph(1)][1:] == (b, [])
+    assert list(processor.load_manifest()["files"]) == [processor.file_key(b)]
+
+
+def test_remove_file_drops_its_duplicate_references(make_processor, parsed):
+    processor = make_processor()
+    a = os.path.join(processor.data_dir, "a.txt")
+    b = os.path.join(processor.data_dir, "b.txt")
+    write_file(a, [paragraph(1), paragraph(2)])
+    processor.process_documents()
+    write_file(b, [paragraph(1), paragraph(3)])
+    processor.process_documents()
+
+    # Only b's own chunk was stored; its copy of paragraph 1 is a reference on a's chunk
+    os.remove(b)
+    parsed.clear()
+    assert processor.remove_file(b) == 1
+    assert parsed == []
+    assert processor.build_stats == {
+        "removed_chunks": 1, "dropped_references": 1, "repointed_references": 0, "reindexed_files": 0
+    }
+    store = ChunkStore(processor.data_file)
+    chunks = stored_chunks(store)
+    assert chunks == {
+        paragraph(1): (chunks[paragraph(1)][0], a, []),
+        paragraph(2): (chunks[paragraph(2)][0], a, [])
+    }
+    assert processor.load_index(store).ntotal == 2
+    # Unknown files are a no-op
+    assert processor.remove_file(b) == 0
+
+
+def test_remove_file_drops_and_repoints_references(make_processor, parsed):
+    processor = make_processor()
+    a, b, c = (os.path.join(processor.data_dir, name) for name in ("a.txt", "b.txt", "c.txt"))
+    write_file(a, [paragraph(1), paragraph(2)])
+    processor.process_documents()
+    write_file(b, [paragraph(1), paragraph(3)])
+    processor.process_documents()
+    write_file(c, [paragraph(3), paragraph(2)])
+    processor.process_documents()
+
+    # b references a's chunk, and c references b's chunk
+    os.remove(b)
+    parsed.clear()
+    assert processor.remove_file(b) == 1
+    assert parsed == ["c.txt"]
+    assert processor.build_stats == {
+        "removed_chunks": 1, "dropped_references": 1, "repointed_references": 1, "reindexed_files": 1
+    }
+    chunks = stored_chunks(ChunkStore(processor.data_file))
+    assert {text: chunk[1:] for text, chunk in chunks.items()} == {
+        paragraph(1): (a, []),
+        paragraph(2): (a, [c]),
+        paragraph(3): (c, [])
+    }
+
+
+def test_remove_file_repoints_repeated_and_near_duplicates(make_processor, parsed):
+    processor = make_processor()
+    a, b, c = (os.path.join(processor.data_dir, name) for name in ("a.txt", "b.txt", "c.txt"))
+    write_file(a, [paragraph(1), paragraph(2)])
+    processor.process_documents()
+    # b repeats a's first chunk twice; c repeats a's second and nearly repeats b's own
+    write_file(b, [paragraph(1), paragraph(4), paragraph(1)])
+    processor.process_documents()
+    write_file(c, [paragraph(2), paragraph(4) + " again"])
+    processor.process_documents()
+    assert processor.build_stats["duplicates_near"] == 1
+
+    os.remove(a)
+    parsed.clear()
+    assert processor.remove_file(a) == 2
+    assert sorted(parsed) == ["b.txt", "c.txt"]
+    assert processor.build_stats == {
+        "removed_chunks": 2, "dropped_references": 0, "repointed_references": 2, "reindexed_files": 2
+    }
+    chunks = stored_chunks(ChunkStore(processor.data_file))
+    # b's second copy of paragraph 1 now references b's first
+    assert {text: chunk[1:] for text, chunk in chunks.items()} == {
+        paragraph(1): (b, [b]),
+        paragraph(2): (c, []),
+        paragraph(4): (b, [c])
+    }
+    assert sorted(processor.load_manifest()["files"]) == [processor.file_key(b), processor.file_key(c)]
+
+
+def test_remove_file_drops_near_duplicate_references(make_processor, parsed):
+    processor = make_processor()
+    a = os.path.join(processor.data_dir, "a.txt")
+    b = os.path.join(processor.data_dir, "b.txt")
+    write_file(a, [paragraph(1), paragraph(2)])
+    processor.process_documents()
+    write_file(b, [paragraph(1) + " again", paragraph(2) + " again"])
+    processor.process_documents()
+
+    os.remove(b)
+    parsed.clear()
+    assert processor.remove_file(b) == 0
+    assert parsed == []
+    assert processor.build_stats == {
+        "removed_chunks": 0, "dropped_references": 2, "repointed_references": 0, "reindexed_files": 0
+    }
+    chunks = stored_chunks(ChunkStore(processor.data_file))
+    assert {text: chunk[1:] for text, chunk in chunks.items()} == {paragraph(1): (a, []), paragraph(2): (a, [])}
+    assert list(processor.load_manifest()["files"]) == [processor.file_key(a)]
+
+
+def test_settings_change_reindexes_every_file(make_processor, parsed):
+    processor = make_processor()
+    for seed, name in enumerate("abc"):
+        write_file(os.path.join(processor.data_dir, f"{name}.txt"), [paragraph(seed)])
+    processor.process_documents()
+
+    parsed.clear()
+    processor = make_processor(chunk_size=500)
+    index, store = processor.process_documents()
+    assert sorted(parsed) == ["a.txt", "b.txt", "c.txt"]
+    assert processor.build_stats["chunks_parsed"] == 3
+    assert len(store) == index.ntotal == 3
+    # IDs start over with the new manifest
+    assert sorted(chunk[0] for chunk in stored_chunks(store).values()) == [0, 1, 2]
+    with open(processor.manifest_file, 'r', encoding='utf-8') as f:
+        assert json.load(f)["settings"]["chunk_size"] == 500
+
+    parsed.clear()
+    processor.process_documents()
+    assert parsed == []
+
+
+def test_ivf_index_updates_in_place(make_processor, parsed):
+    # nlist=2 trains from 78 vectors; below that an exact flat index is used
+    processor = make_processor(index_type="ivf_flat", index_params={"nlist": 2})
+    a = os.path.join(processor.data_dir, "a.txt")
+    write_file(a, [paragraph(seed) for seed in range(40)])
+    index, store = processor.process_documents()
+    assert index_factory.index_kind(index) == "flat"
+
+    # Growing past the training size rebuilds the IVF index from stored embeddings
+    b = os.path.join(processor.data_dir, "b.txt")
+    write_file(b, [paragraph(seed) for seed in range(100, 160)])
+    parsed.clear()
+    index, store = processor.process_documents()
+    assert parsed == ["b.txt"]
+    assert index_factory.index_kind(index) == "ivf_flat"
+    assert len(store) == index.ntotal == 100
+
+    # Removal happens in place, without retraining
+    write_file(a, [paragraph(seed) for seed in range(30)], mtime=os.stat(a).st_mtime + 10)
+    index, store = processor.process_documents()
+    assert index_factory.index_kind(index) == "ivf_flat"
+    assert len(store) == index.ntotal == 90
+    scores, ids = index.search(processor.embed_texts([paragraph(120)]), 1)
+    assert ids[0][0] == stored_chunks(store)[paragraph(120)][0]
+
+
+def test_hnsw_index_is_rebuilt_after_removal(make_processor, parsed):
+    processor = make_processor(index_type="hnsw")
+    a = os.path.join(processor.data_dir, "a.txt")
+    b = os.path.join(processor.data_dir, "b.txt")
+    write_file(a, [paragraph(seed) for seed in range(20)])
+    write_file(b, [paragraph(seed) for seed in range(100, 110)])
+    index, store = processor.process_documents()
+    assert index_factory.index_kind(index) == "hnsw"
+    assert len(store) == index.ntotal == 30
+
+    # HNSW cannot delete vectors, so a change rebuilds it from the store
+    write_file(a, [paragraph(seed) for seed in range(5)], mtime=os.stat(a).st_mtime + 10)
+    index, store = processor.process_documents()
+    assert index_factory.index_kind(index) == "hnsw"
+    assert len(store) == index.ntotal == 15
+
+    os.remove(b)
+    assert processor.remove_file(b) == 10
+    store = ChunkStore(processor.data_file)
+    index = processor.load_index(store)
+    assert len(store) == index.ntotal == 5
+    scores, ids = index.search(processor.embed_texts([paragraph(3)]), 1)
+    assert ids[0][0] == stored_chunks(store)[paragraph(3)][0]
+
+
+def test_incremental_build_matches_full_rebuild(make_processor, parsed, tmp_path):
+    processor = make_processor()
+    data_dir = processor.data_dir
+    for number in range(6):
+        # Every file repeats a paragraph of the previous one
+        write_file(os.path.join(data_dir, f"f{number}.txt"), [paragraph(number), paragraph(number + 1), paragraph(100 + number)])
+    processor.process_documents()
+    write_file(os.path.join(data_dir, "g.txt"), [paragraph(3), paragraph(200)])
+    processor.process_documents()
+    path = os.path.join(data_dir, "f2.txt")
+    write_file(path, [paragraph(300)], mtime=os.stat(path).st_mtime + 10)
+    processor.process_documents()
+    os.remove(os.path.join(data_dir, "f4.txt"))
+    processor.remove_file(os.path.join(data_dir, "f4.txt"))
+    store = ChunkStore(processor.data_file)
+
+    full = DocumentProcessor(
+        data_dir=data_dir, data_file=str(tmp_path / "full"), index_file=str(tmp_path / "full.faiss"),
+        manifest_file=str(tmp_path / "full.json"), bm25_file=str(tmp_path / "full_bm25"), text_cache_dir=None,
+        workers=1, embedding_backend=HashingEmbeddingBackend(dimension=32)
+    )
+    _, full_store = full.process_documents(incremental=False)
+
+    def contents(store):
+        chunks = stored_chunks(store)
+        return {text: (source, sorted(os.path.basename(s) for s in sources)) for text, (_, source, sources) in chunks.items()}
+
+    assert contents(store) == contents(full_store)
+
+    # Filter columns of copied rows still name each row's source
+    columns = store.filter_columns()
+    for row in range(len(store)):
+        assert columns["sources"][columns["source_codes"][row]] == store.metadata(row)["source"]
+
+    # Copied BM25 postings score like freshly tokenized ones
+    bm25, full_bm25 = BM25Index(store.bm25_file), BM25Index(full_store.bm25_file)
+    for seed in (1, 3, 101, 200, 300):
+        query = " ".join(paragraph(seed).split()[:5])
+        ids, scores = bm25.search(query, 5)
+        full_ids, full_scores = full_bm25.search(query, 5)
+        assert store.get(ids)["texts"] == full_store.get(full_ids)["texts"]
+        assert np.allclose(scores, full_scores)
+
+    # Merged dedup tables equal tables sorted from scratch
+    keys, rows = lookup_tables(store.text_hashes, store.minhashes, BANDS)
+    assert np.array_equal(store.lsh_keys, keys)
+    assert np.array_equal(store.lsh_rows, rows)
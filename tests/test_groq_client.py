@@ -0,0 +1,96 @@
+import pytest
+
+from benchmarks.fake_groq_server import start_server, DEFAULT_ANSWER
+from utils.groq_client import AsyncGroqClient, EventLoopThread, RateLimitError
+from utils.llm import GroqLLM, RATE_LIMITED_MESSAGE
+
+MESSAGES = [{"role": "user", "content": "What is planted?"}]
+
+
+@pytest.fixture
+def fake_groq():
+    servers = []
+
+    def start(**options):
+        options.setdefault("latency_ms", 0.0)
+        options.setdefault("token_delay_ms", 0.0)
+        server = start_server(port=0, **options)
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}", server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def loop():
+    loop = EventLoopThread(name="test-groq-loop")
+    yield loop
+    loop.stop()
+
+
+def stream_text(loop, client, **options):
+    chunks = loop.iterate(client.stream(MESSAGES, "fake-model", **options))
+    return "".join(chunk["choices"][0]["delta"].get("content") or "" for chunk in chunks)
+
+
+def test_stream_yields_the_answer(fake_groq, loop):
+    base_url, server = fake_groq()
+    client = AsyncGroqClient(api_key="test", base_url=base_url)
+
+    assert stream_text(loop, client) == DEFAULT_ANSWER
+    assert client.stats["requests"] == client.stats["attempts"] == 1
+
+
+def test_abandoned_stream_releases_its_slot(fake_groq, loop):
+    base_url, server = fake_groq()
+    client = AsyncGroqClient(api_key="test", base_url=base_url, max_in_flight=1, timeout=5.0)
+
+    chunks = loop.iterate(client.stream(MESSAGES, "fake-model"))
+    next(chunks)
+    chunks.close()
+
+    # With the only slot still held this would hit the deadline
+    assert stream_text(loop, client) == DEFAULT_ANSWER
+    loop.run(client.aclose())
+
+
+def test_stream_retries_and_gives_up_on_rate_limits(fake_groq, loop):
+    base_url, server = fake_groq(rate_limit=1.0, retry_after=0)
+    client = AsyncGroqClient(api_key="test", base_url=base_url, max_retries=2)
+
+    with pytest.raises(RateLimitError):
+        stream_text(loop, client)
+    assert client.stats["attempts"] == 3
+    assert client.stats["rate_limited"] == 3
+    assert server.stats["requests"] == 3
+
+
+def test_stream_response_goes_through_the_client(fake_groq, monkeypatch):
+    base_url, server = fake_groq()
+    monkeypatch.setenv("GROQ_API_KEY", "test")
+    monkeypatch.setenv("GROQ_BASE_URL", base_url)
+    llm = GroqLLM(model_name="fake-model", context_token_budget=None)
+    documents = {"texts": ["The planted fact."], "metadata": [{"source": "a.txt"}]}
+
+    events = list(llm.stream_response("What is planted?", documents))
+
+    assert "".join(e["text"] for e in events if e["type"] == "token") == DEFAULT_ANSWER
+    done = events[-1]
+    assert done["type"] == "done"
+    assert done["points"] == llm.parse_response_to_points(DEFAULT_ANSWER)
+    assert [e["text"] for e in events if e["type"] == "point"] == done["points"]
+    assert llm.client.stats["requests"] == 1
+
+
+def test_stream_response_reports_rate_limits(fake_groq, monkeypatch):
+    base_url, server = fake_groq(rate_limit=1.0, retry_after=0)
+    monkeypatch.setenv("GROQ_API_KEY", "test")
+    monkeypatch.setenv("GROQ_BASE_URL", base_url)
+    llm = GroqLLM(model_name="fake-model", max_retries=1, context_token_budget=None)
+
+    events = list(llm.stream_response("What is planted?", {"texts": [], "metadata": []}))
+
+    assert events == [{"type": "error", "text": RATE_LIMITED_MESSAGE}]
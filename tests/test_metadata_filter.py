@@ -0,0 +1,189 @@
+import os
+
+import numpy as np
+import pytest
+
+from helpers import paragraph, write_file
+from utils import document_processor
+from utils.chunk_store import ChunkStore
+from utils.metadata_filter import FilterSelection, MetadataFilter, normalize_filters
+from utils.retriever import RAGRetriever
+
+# a.pdf was uploaded first, then b.txt, then c.txt
+MTIMES = {"a.pdf": 1_000_000.0, "b.txt": 2_000_000.0, "c.txt": 3_000_000.0}
+
+
+@pytest.fixture
+def paged(monkeypatch):
+    """Split files on blank lines, three paragraphs to a page"""
+    def parse_file(file_path, chunk_size, chunk_overlap, pdf_extractor="pypdf", text_cache_dir=None, file_hash=None):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            texts = [text.strip() for text in f.read().split("\n\n") if text.strip()]
+        return [(text, {"source": file_path, "page": i // 3}) for i, text in enumerate(texts)], None
+
+    monkeypatch.setattr(document_processor, "parse_file", parse_file)
+
+
+def build(make_processor, **options):
+    data_dir = make_processor.data_dir
+    b = [paragraph(seed) for seed in range(100, 140)]
+    write_file(os.path.join(data_dir, "a.pdf"), [paragraph(seed) for seed in range(40)], MTIMES["a.pdf"])
+    write_file(os.path.join(data_dir, "b.txt"), b, MTIMES["b.txt"])
+    # c.txt repeats two chunks of b.txt, which are stored once with both sources
+    write_file(os.path.join(data_dir, "c.txt"), [paragraph(seed) for seed in range(200, 206)] + b[:2], MTIMES["c.txt"])
+    processor = make_processor(**options)
+    processor.process_documents()
+    return ChunkStore(processor.data_file)
+
+
+def brute_force_mask(store, filters):
+    """Rows matching filters, decided from each chunk's decoded metadata"""
+    filters = normalize_filters(filters)
+    ids = [int(i) for i in store.ids]
+    mask = np.ones(len(ids), dtype=bool)
+    for row, meta in enumerate(store.get(ids)["metadata"]):
+        sources = meta.get("sources", [meta["source"]])
+        names = {os.path.basename(source) for source in sources}
+        if "source" in filters and not names.intersection(filters["source"]):
+            mask[row] = False
+        if "file_type" in filters and not {name.rsplit(".", 1)[1] for name in names}.intersection(filters["file_type"]):
+            mask[row] = False
+        if "page" in filters:
+            first, last = filters["page"]
+            if (first is not None and meta["page"] < first) or (last is not None and meta["page"] > last):
+                mask[row] = False
+        if "uploaded_after" in filters and meta["uploaded_at"] < filters["uploaded_after"]:
+            mask[row] = False
+        if "uploaded_before" in filters and meta["uploaded_at"] > filters["uploaded_before"]:
+            mask[row] = False
+    return mask
+
+
+def brute_force_search(store, query_embedding, mask, k):
+    rows = np.flatnonzero(mask)
+    distances = np.sum((np.asarray(store.embeddings[rows]) - query_embedding) ** 2, axis=1)
+    return [int(store.ids[rows[i]]) for i in np.argsort(distances, kind='stable')[:k]]
+
+
+FILTERS = [
+    {"source": "c.txt"},
+    {"source": ["a.pdf", "c.txt"]},
+    {"file_type": "pdf"},
+    {"file_type": "txt", "page": [1, 2]},
+    {"page": {"min": 10}},
+    {"uploaded_after": 1_500_000},
+    {"uploaded_before": "1970-01-24T00:00:00", "page": 0},
+]
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_row_mask_matches_chunk_metadata(make_processor, paged, filters):
+    store = build(make_processor)
+
+    selection = MetadataFilter(store).select(filters)
+
+    expected = brute_force_mask(store, filters)
+    assert expected.any() and not expected.all()
+    np.testing.assert_array_equal(selection.row_mask, expected)
+    assert selection.count == expected.sum()
+
+
+def test_duplicate_sources_match_source_filters(make_processor, paged):
+    store = build(make_processor)
+
+    selection = MetadataFilter(store).select({"source": "c.txt"})
+
+    texts = store.get(selection.ids)["texts"]
+    assert len(texts) == 8
+    assert paragraph(100) in texts and paragraph(101) in texts
+
+
+def test_bitmap_marks_exactly_the_selected_ids():
+    ids = np.array([3, 9, 17, 64, 70, 200], dtype='int64')
+    row_mask = np.array([True, False, True, True, False, True])
+
+    selection = FilterSelection(row_mask, ids)
+
+    assert selection.ids.tolist() == [3, 17, 64, 200]
+    assert len(selection.bitmap) == (200 + 1 + 7) // 8
+    bits = np.unpackbits(selection.bitmap, bitorder='little')
+    assert np.flatnonzero(bits).tolist() == [3, 17, 64, 200]
+    assert selection.selector.n == len(selection.bitmap)
+    assert [i for i in range(4096) if selection.selector.is_member(i)] == [3, 17, 64, 200]
+
+
+def test_empty_selection_selects_nothing():
+    selection = FilterSelection(np.zeros(3, dtype=bool), np.array([1, 2, 3]))
+
+    assert selection.count == 0
+    assert not any(selection.selector.is_member(i) for i in range(8))
+
+
+@pytest.mark.parametrize("index_type, index_params", [
+    ("flat", None),
+    ("hnsw", None),
+    ("ivf_flat", {"nlist": 2})  # 86 chunks train 2 clusters, which nprobe visits exhaustively
+])
+@pytest.mark.parametrize("filters", FILTERS[:4])
+def test_filtered_search_matches_brute_force(make_processor, make_retriever, paged, index_type, index_params, filters):
+    store = build(make_processor, index_type=index_type, index_params=index_params)
+    retriever = make_retriever(top_k=5, hybrid=False)
+    query = paragraph(7)
+
+    result = retriever.retrieve(query, filters=filters)
+
+    mask = brute_force_mask(store, filters)
+    query_embedding = retriever.model.encode([query])[0]
+    assert result["ids"] == brute_force_search(store, query_embedding, mask, 5)
+
+
+def test_hybrid_search_keeps_keyword_hits_inside_the_filter(make_processor, make_retriever, paged):
+    store = build(make_processor)
+    retriever = make_retriever(top_k=5, hybrid=True)
+
+    # paragraph(7) is in a.pdf; its words must not pull it into a c.txt-only result
+    result = retriever.retrieve(paragraph(7), filters={"source": "c.txt"})
+
+    allowed = set(store.ids[brute_force_mask(store, {"source": "c.txt"})].tolist())
+    assert len(result["ids"]) == 5
+    assert set(result["ids"]) <= allowed
+
+
+def test_narrow_filter_falls_back_to_exact_search(make_processor, make_retriever, paged, monkeypatch):
+    # Only one of the two IVF clusters is visited per query, and c.txt's 8 chunks are in both
+    store = build(make_processor, index_type="ivf_flat", index_params={"nlist": 2, "nprobe": 1})
+    calls = []
+    exact_search = RAGRetriever.exact_search
+
+    def spy(store, rows, query_embedding, k):
+        calls.append(len(rows))
+        return exact_search(store, rows, query_embedding, k)
+
+    monkeypatch.setattr(RAGRetriever, "exact_search", staticmethod(spy))
+    retriever = make_retriever(top_k=8, hybrid=False)
+    filters = {"source": "c.txt"}
+    query = paragraph(203)
+
+    result = retriever.retrieve(query, filters=filters)
+
+    assert calls == [8]
+    mask = brute_force_mask(store, filters)
+    assert result["ids"] == brute_force_search(store, retriever.model.encode([query])[0], mask, 8)
+
+
+def test_selections_are_cached_by_normalized_filters(make_processor, paged):
+    store = build(make_processor)
+    metadata_filter = MetadataFilter(store, cache_size=2)
+
+    first = metadata_filter.select({"source": "a.pdf"})
+    assert metadata_filter.select({"source": ["a.pdf"]}) is first
+    assert metadata_filter.select({}) is None
+
+    second = metadata_filter.select({"page": 1})
+    assert metadata_filter.select({"page": [1, 1]}) is second
+    metadata_filter.select({"source": "a.pdf"})  # most recently used again
+    metadata_filter.select({"file_type": "txt"})  # evicts the page selection
+
+    assert metadata_filter.select({"source": "a.pdf"}) is first
+    assert metadata_filter.select({"page": 1}) is not second
+    assert len(metadata_filter.cache) == 2
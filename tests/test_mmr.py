@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+import pytest
+
+from helpers import paragraph, write_file
+from utils.retriever import maximal_marginal_relevance
+
+
+def reference_mmr(query, vectors, k, lambda_mult, by_rank=False):
+    """MMR written out pair by pair, as in Carbonell and Goldstein"""
+    def cosine(a, b):
+        return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+    n = len(vectors)
+    relevance = [cosine(vector, query) for vector in vectors]
+    if by_rank:
+        top, bottom = max(relevance), min(relevance)
+        relevance = [top - (top - bottom) * i / (n - 1) for i in range(n)]
+    picked = [0]
+    while len(picked) < k:
+        scores = {
+            i: lambda_mult * relevance[i] - (1 - lambda_mult) * max(cosine(vectors[i], vectors[j]) for j in picked)
+            for i in range(n) if i not in picked
+        }
+        picked.append(max(scores, key=lambda i: (scores[i], -i)))
+    return picked
+
+
+@pytest.mark.parametrize("lambda_mult", [0.0, 0.3, 0.7, 1.0])
+@pytest.mark.parametrize("by_rank", [False, True])
+def test_gram_matrix_mmr_matches_pairwise_mmr(lambda_mult, by_rank):
+    rng = np.random.RandomState(0)
+    query = rng.randn(16).astype('float32')
+    # Candidates of varied norms in retrieval order, several near-identical
+    vectors = rng.randn(40, 16).astype('float32') * rng.uniform(0.5, 3, size=(40, 1)).astype('float32')
+    vectors[5] = vectors[0] * 2 + 0.01
+    vectors[9] = vectors[3] + 0.01
+
+    picked = maximal_marginal_relevance(query, vectors, 10, lambda_mult, by_rank=by_rank)
+
+    assert picked == reference_mmr(query, vectors, 10, lambda_mult, by_rank)
+
+
+def test_lambda_one_keeps_the_relevance_order():
+    rng = np.random.RandomState(1)
+    query = rng.randn(8).astype('float32')
+    vectors = rng.randn(20, 8).astype('float32')
+    relevance = vectors @ query / np.linalg.norm(vectors, axis=1)
+    vectors = vectors[np.argsort(-relevance)]
+
+    assert maximal_marginal_relevance(query, vectors, 6, lambda_mult=1.0) == list(range(6))
+
+
+def test_near_identical_candidates_are_skipped():
+    query = np.array([1, 0, 0], dtype='float32')
+    vectors = np.array([
+        [1.0, 0.1, 0.0],
+        [1.0, 0.1, 0.001],  # same direction as the first
+        [0.7, -0.5, 0.5],
+        [0.0, 1.0, 0.0]
+    ], dtype='float32')
+
+    assert maximal_marginal_relevance(query, vectors, 2, lambda_mult=1.0) == [0, 1]
+    assert maximal_marginal_relevance(query, vectors, 2, lambda_mult=0.5) == [0, 2]
+
+
+def test_fewer_candidates_than_k_are_all_kept():
+    vectors = np.eye(3, dtype='float32')
+    assert maximal_marginal_relevance(vectors[0], vectors, 5) == [0, 1, 2]
+
+
+def test_retriever_mmr_keeps_one_copy_of_repeated_chunks(make_processor, make_retriever):
+    # Without dedup both copies of every paragraph are stored
+    write_file(os.path.join(make_processor.data_dir, "a.txt"), [paragraph(seed) for seed in range(10)])
+    write_file(os.path.join(make_processor.data_dir, "b.txt"), [paragraph(seed) for seed in range(10)])
+    make_processor(dedup=False).process_documents()
+    query = paragraph(3)
+
+    plain = make_retriever(top_k=3, mmr=False, hybrid=False).retrieve(query)
+    diverse = make_retriever(top_k=3, mmr=True, mmr_lambda=0.5, hybrid=False).retrieve(query)
+
+    assert plain["texts"][:2] == [query, query]
+    assert diverse["texts"][0] == query
+    assert len(set(diverse["texts"])) == 3
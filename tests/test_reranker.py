@@ -0,0 +1,70 @@
+"""Score caching of CrossEncoderReranker across index rebuilds"""
+import os
+import sys
+import types
+
+import numpy as np
+import pytest
+
+from helpers import paragraph, write_file
+from utils.reranker import CrossEncoderReranker
+
+
+class WordOverlapCrossEncoder:
+    """Scores a pair by the words query and text share, and records every pair scored"""
+
+    def __init__(self, model_name, max_length=512, device=None):
+        self.pairs = []
+
+    def predict(self, pairs, batch_size=32, show_progress_bar=False, convert_to_numpy=True):
+        self.pairs.extend(pairs)
+        return np.array([len(set(query.split()) & set(text.split())) for query, text in pairs], dtype='float32')
+
+
+@pytest.fixture
+def reranker(monkeypatch):
+    module = types.ModuleType("sentence_transformers")
+    module.CrossEncoder = WordOverlapCrossEncoder
+    monkeypatch.setitem(sys.modules, "sentence_transformers", module)
+    return CrossEncoderReranker(time_budget_ms=None)
+
+
+def test_scores_are_cached_per_query_and_version(reranker):
+    texts = ["red green blue", "green blue", "blue"]
+    order, scores = reranker.rerank("red green blue", [0, 1, 2], texts, 2, version="v1")
+    assert order == [0, 1]
+    assert scores == [3.0, 2.0]
+    assert len(reranker.model.pairs) == 3
+
+    reranker.rerank("red green blue", [0, 1, 2], texts, 2, version="v1")
+    assert len(reranker.model.pairs) == 3
+    assert reranker.stats["cache_hits"] == 3
+
+    # Same IDs in another build may be other texts
+    order, scores = reranker.rerank("red green blue", [0, 1, 2], list(reversed(texts)), 2, version="v2")
+    assert order == [2, 1]
+    assert len(reranker.model.pairs) == 6
+
+
+def test_scores_are_recomputed_after_reindexing(reranker, make_processor, make_retriever):
+    processor = make_processor()
+    path = os.path.join(processor.data_dir, "a.txt")
+    write_file(path, [paragraph(1), paragraph(2)])
+    processor.process_documents()
+    retriever = make_retriever(reranker=reranker, top_k=1, hybrid=False)
+    result = retriever.retrieve(paragraph(1))
+    assert result["texts"] == [paragraph(1)]
+    first_version = retriever.index_version
+
+    # A settings change re-indexes from scratch, so chunk IDs 0 and 1 now hold other texts
+    write_file(path, [paragraph(3), paragraph(4)], mtime=os.stat(path).st_mtime + 10)
+    make_processor(chunk_size=500).process_documents()
+    retriever.reload()
+    assert retriever.index_version != first_version
+
+    scored = len(reranker.model.pairs)
+    result = retriever.retrieve(paragraph(1))
+    assert {text for _, text in reranker.model.pairs[scored:]} == {paragraph(3), paragraph(4)}
+    assert result["rerank_scores"] == [max(
+        len(set(paragraph(1).split()) & set(paragraph(seed).split())) for seed in (3, 4)
+    )]
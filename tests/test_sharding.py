@@ -0,0 +1,129 @@
+"""Sharded indexes: global chunk IDs, keyword merging and the shard server protocol"""
+import os
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+
+import pytest
+
+from helpers import paragraph, write_file
+from benchmarks.offline import HashingEmbeddingBackend
+from utils.chunk_store import ChunkStore
+from utils.document_processor import shard_for_file
+from utils.sharding import (
+    ShardedDocumentProcessor, ShardedRetriever, ShardServer, RemoteShardBackend, ShardLayout,
+    merge_keyword_rankings, global_id, shard_authkey
+)
+
+N_SHARDS = 3
+
+
+@pytest.fixture
+def shards(tmp_path, parsed):
+    """A sharded index of 12 files with 3 paragraphs each"""
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    for number in range(12):
+        write_file(str(data_dir / f"file{number}.txt"), [paragraph(10 * number + i) for i in range(3)])
+    processor = ShardedDocumentProcessor(
+        str(data_dir), str(tmp_path / "index_shards"), N_SHARDS,
+        embedding_backend=HashingEmbeddingBackend(dimension=32), workers=1, text_cache_dir=None
+    )
+    assert processor.process_documents() == 36
+    return processor
+
+
+def test_merge_keyword_rankings_interleaves_by_rank():
+    rankings = [
+        [(0, 9.0), (3, 8.0), (6, 7.0)],
+        [(1, 2.0)],
+        [(2, 5.0), (5, 4.0)]
+    ]
+    # Raw scores would put shard 0's whole list first
+    assert merge_keyword_rankings(rankings) == [
+        (0, 9.0), (2, 5.0), (1, 2.0),
+        (3, 8.0), (5, 4.0),
+        (6, 7.0)
+    ]
+    assert merge_keyword_rankings([[], []]) == []
+
+
+def test_global_ids_are_unique_across_shards(shards):
+    layout = shards.layout
+    seen = {}
+    for shard in range(N_SHARDS):
+        store = ChunkStore(layout.paths(shard)["data_file"])
+        for batch in store.iter_batches():
+            for local_id, text, meta in zip(batch["ids"], batch["texts"], batch["metadata"]):
+                assert shard_for_file(meta["source"], shards.data_dir, N_SHARDS) == shard
+                seen[global_id(int(local_id), shard, N_SHARDS)] = text
+        store.close()
+    assert len(seen) == 36
+    # The shard is the remainder and the local ID the quotient
+    for chunk_id in seen:
+        assert global_id(chunk_id // N_SHARDS, chunk_id % N_SHARDS, N_SHARDS) == chunk_id
+
+
+@pytest.mark.parametrize("hybrid", [False, True])
+def test_sharded_retriever_maps_hits_to_their_chunks(shards, hybrid):
+    retriever = ShardedRetriever(
+        shards.layout.shards_dir, top_k=3, hybrid=hybrid, mmr=False,
+        embedding_backend=HashingEmbeddingBackend(dimension=32)
+    )
+    try:
+        for seed in (0, 51, 112):
+            result = retriever.retrieve(paragraph(seed))
+            assert result["texts"][0] == paragraph(seed)
+            chunk_id = result["ids"][0]
+            store = ChunkStore(shards.layout.paths(chunk_id % N_SHARDS)["data_file"])
+            assert store.get([chunk_id // N_SHARDS])["texts"] == [paragraph(seed)]
+            store.close()
+    finally:
+        retriever.close()
+
+
+def test_shard_authkey_is_required(shards, monkeypatch):
+    monkeypatch.delenv("SHARD_AUTHKEY", raising=False)
+    with pytest.raises(ValueError):
+        shard_authkey()
+    with pytest.raises(ValueError):
+        RemoteShardBackend([("127.0.0.1", 7000)])
+    server = ShardServer(shards.layout.shard_dir(0), 0, N_SHARDS)
+    with pytest.raises(ValueError):
+        server.serve_forever("127.0.0.1", 0)
+
+
+def serve(shard_dir, shard):
+    """Start a shard server on a free loopback port and return its address"""
+    ready = threading.Event()
+    address = []
+
+    def on_ready(listening):
+        address.append(listening)
+        ready.set()
+
+    server = ShardServer(shard_dir, shard, N_SHARDS)
+    threading.Thread(target=server.serve_forever, args=("127.0.0.1", 0, on_ready), daemon=True).start()
+    assert ready.wait(10)
+    return address[0]
+
+
+def test_remote_shards_authenticate_and_match_local_search(shards, monkeypatch):
+    monkeypatch.setenv("SHARD_AUTHKEY", "test-secret")
+    layout = ShardLayout.load(shards.layout.shards_dir)
+    addresses = [serve(layout.shard_dir(shard), shard) for shard in range(N_SHARDS)]
+
+    # A client with the wrong key is refused, and the server keeps serving
+    with pytest.raises(AuthenticationError):
+        Client(addresses[0], authkey=b"wrong-secret")
+
+    backend = HashingEmbeddingBackend(dimension=32)
+    remote = ShardedRetriever(addresses=addresses, top_k=5, mmr=False, embedding_backend=backend)
+    local = ShardedRetriever(layout.shards_dir, top_k=5, mmr=False, embedding_backend=backend)
+    try:
+        assert remote.build_ids == local.build_ids
+        for seed in (1, 62, 110):
+            assert remote.retrieve(paragraph(seed))["ids"] == local.retrieve(paragraph(seed))["ids"]
+    finally:
+        remote.close()
+        local.close()
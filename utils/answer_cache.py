@@ -0,0 +1,292 @@
+import re
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+def normalize_query(query):
+    """Normalize query text for exact matching: case, whitespace and trailing punctuation"""
+    query = re.sub(r'\s+', ' ', query.strip().lower())
+    return query.rstrip(' ?!.')
+
+
+class MemoryCacheBackend:
+    """In-process cache storage, ordered from least to most recently used"""
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.version = None
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+
+    def delete(self, key):
+        self.entries.pop(key, None)
+
+    def oldest_key(self):
+        return next(iter(self.entries), None)
+
+    def items(self):
+        return list(self.entries.items())
+
+    def clear(self):
+        self.entries.clear()
+
+    def get_version(self):
+        return self.version
+
+    def set_version(self, version):
+        self.version = version
+
+    def data_version(self):
+        # Only the owning AnswerCache writes to it
+        return 0
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SQLiteCacheBackend:
+    """
+    On-disk cache storage in a SQLite file
+
+    Survives restarts and can be shared by several worker processes; semantic
+    lookups pick up entries written by the other processes. The index version
+    is stored alongside the entries so a cache written against an old index is
+    discarded.
+    """
+
+    def __init__(self, path="answer_cache.sqlite3"):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, query TEXT, embedding BLOB, chunk_ids TEXT, "
+            "response TEXT, created REAL, last_used REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+
+    @staticmethod
+    def _to_entry(row):
+        query, embedding, chunk_ids, response, created = row
+        return {
+            "query": query,
+            "embedding": np.frombuffer(embedding, dtype='float32') if embedding is not None else None,
+            "chunk_ids": tuple(json.loads(chunk_ids)),
+            "response": json.loads(response),
+            "created": created
+        }
+
+    def get(self, key):
+        row = self.conn.execute(
+            "SELECT query, embedding, chunk_ids, response, created FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        self.conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        return self._to_entry(row)
+
+    def put(self, key, entry):
+        embedding = entry["embedding"]
+        self.conn.execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                key,
+                entry["query"],
+                np.asarray(embedding, dtype='float32').tobytes() if embedding is not None else None,
+                json.dumps(list(entry["chunk_ids"])),
+                json.dumps(entry["response"]),
+                entry["created"],
+                time.time()
+            )
+        )
+
+    def delete(self, key):
+        self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def oldest_key(self):
+        row = self.conn.execute("SELECT key FROM entries ORDER BY last_used LIMIT 1").fetchone()
+        return row[0] if row else None
+
+    def items(self):
+        rows = self.conn.execute(
+            "SELECT key, query, embedding, chunk_ids, response, created FROM entries"
+        ).fetchall()
+        return [(row[0], self._to_entry(row[1:])) for row in rows]
+
+    def clear(self):
+        self.conn.execute("DELETE FROM entries")
+
+    def get_version(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+        return row[0] if row else None
+
+    def set_version(self, version):
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (version,))
+
+    def data_version(self):
+        """Changes whenever another connection (another worker process) has written to the file"""
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+
+class AnswerCache:
+    """
+    Two-level cache of chatbot answers
+
+    Level 1 is an exact-match LRU on the normalized query text, checked before
+    anything else so repeats skip embedding, retrieval and the LLM. Level 2 is
+    semantic: after the query has been embedded and retrieved, an answer is
+    reused if a cached query's embedding is within `similarity_threshold`
+    cosine similarity and it retrieved the same chunk IDs.
+
+    Entries expire after `ttl` seconds, the least recently used entry is evicted
+    beyond `max_size`, and everything is dropped when the index version changes.
+    """
+
+    def __init__(self, backend=None, max_size=1024, ttl=24 * 3600, similarity_threshold=0.95):
+        """
+        Args:
+            backend: MemoryCacheBackend (default) or SQLiteCacheBackend
+            max_size: Maximum number of cached answers
+            ttl: Seconds an answer stays valid (None for no expiry)
+            similarity_threshold: Minimum cosine similarity for a semantic hit
+        """
+        # Not `backend or ...`: an empty backend has len() 0
+        self.backend = backend if backend is not None else MemoryCacheBackend()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.lock = threading.RLock()
+        self.counters = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+        # Normalized embeddings of cached queries, rebuilt lazily after changes
+        # here or, for a shared SQLite file, in another process
+        self._matrix = None
+        self._matrix_keys = []
+        self._matrix_version = None
+
+    def _expired(self, entry):
+        return self.ttl is not None and time.time() - entry["created"] > self.ttl
+
+    def check_version(self, version):
+        """Drop all entries if they were cached against a different index version"""
+        with self.lock:
+            if version is None or self.backend.get_version() == version:
+                return
+            if len(self.backend):
+                self.counters["invalidations"] += 1
+            self.backend.clear()
+            self.backend.set_version(version)
+            self._matrix = None
+
+    def invalidate(self):
+        """Drop every cached answer"""
+        with self.lock:
+            self.backend.clear()
+            self._matrix = None
+            self.counters["invalidations"] += 1
+
+    def lookup_exact(self, query):
+        """Cached response for the same normalized query text, or None"""
+        with self.lock:
+            key = normalize_query(query)
+            entry = self.backend.get(key)
+            if entry is not None and self._expired(entry):
+                self.backend.delete(key)
+                self._matrix = None
+                entry = None
+            if entry is not None:
+                self.counters["exact_hits"] += 1
+                return entry["response"]
+            return None
+
+    def lookup_semantic(self, query_embedding, chunk_ids):
+        """
+        Cached response for a paraphrase of the query, or None
+
+        Args:
+            query_embedding: Embedding of the new query
+            chunk_ids: Chunk IDs retrieved for the new query
+        """
+        with self.lock:
+            self._refresh_matrix()
+            if self._matrix is not None and len(self._matrix_keys):
+                query = np.asarray(query_embedding, dtype='float32').reshape(-1)
+                query = query / (np.linalg.norm(query) or 1.0)
+                similarities = self._matrix @ query
+                chunk_ids = tuple(int(i) for i in chunk_ids)
+
+                # Best candidates first; the chunk IDs must match exactly
+                for position in np.argsort(-similarities):
+                    if similarities[position] < self.similarity_threshold:
+                        break
+                    key = self._matrix_keys[position]
+                    entry = self.backend.get(key)
+                    if entry is None or self._expired(entry):
+                        continue
+                    if tuple(entry["chunk_ids"]) == chunk_ids:
+                        self.counters["semantic_hits"] += 1
+                        return entry["response"]
+
+            self.counters["misses"] += 1
+            return None
+
+    def store(self, query, query_embedding, chunk_ids, response):
+        """Cache a response for a query"""
+        with self.lock:
+            key = normalize_query(query)
+            embedding = np.asarray(query_embedding, dtype='float32').reshape(-1)
+            self.backend.put(key, {
+                "query": query,
+                "embedding": embedding / (np.linalg.norm(embedding) or 1.0),
+                "chunk_ids": tuple(int(i) for i in chunk_ids),
+                "response": response,
+                "created": time.time()
+            })
+            while len(self.backend) > self.max_size:
+                self.backend.delete(self.backend.oldest_key())
+                self.counters["evictions"] += 1
+            self._matrix = None
+
+    def _refresh_matrix(self):
+        """Rebuild the embedding matrix used for semantic lookups, dropping expired entries"""
+        version = self.backend.data_version()
+        if self._matrix is not None and version == self._matrix_version:
+            return
+        self._matrix_version = version
+        keys, embeddings = [], []
+        for key, entry in self.backend.items():
+            if self._expired(entry):
+                self.backend.delete(key)
+            elif entry["embedding"] is not None:
+                keys.append(key)
+                embeddings.append(entry["embedding"])
+        self._matrix_keys = keys
+        self._matrix = np.vstack(embeddings) if embeddings else np.empty((0, 0), dtype='float32')
+
+    def stats(self):
+        """Hit/miss counters, hit rate and current size"""
+        with self.lock:
+            lookups = self.counters["exact_hits"] + self.counters["semantic_hits"] + self.counters["misses"]
+            hits = self.counters["exact_hits"] + self.counters["semantic_hits"]
+            return dict(
+                self.counters,
+                size=len(self.backend),
+                hit_rate=hits / lookups if lookups else 0.0,
+                similarity_threshold=self.similarity_threshold
+            )
@@ -0,0 +1,222 @@
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from utils.metadata_filter import FilterError, normalize_filters
+from utils.dedup import unique_sources
+from utils import metrics
+
+
+def parse_question(item, position):
+    """
+    Normalize one batch entry
+
+    Args:
+        item: A question string, or a dict with "question" (or "message"/"query")
+            and optional "id" and "filters"
+        position: Index of the entry, used as its ID when it has none
+
+    Returns:
+        {"id", "question", "filters"}
+
+    Raises:
+        ValueError: If the entry has no question
+    """
+    if isinstance(item, str):
+        item = {"question": item}
+    if not isinstance(item, dict):
+        raise ValueError(f"Entry {position}: expected a string or an object")
+    question = item.get("question") or item.get("message") or item.get("query")
+    if not isinstance(question, str) or not question.strip():
+        raise ValueError(f"Entry {position}: missing 'question'")
+    return {
+        "id": str(item.get("id", position)),
+        "question": question.strip(),
+        "filters": item.get("filters")
+    }
+
+
+def read_questions(path):
+    """Questions from a JSONL file: one string or object per line"""
+    questions = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{line_number + 1}: invalid JSON ({e})")
+            questions.append(parse_question(item, len(questions)))
+    return questions
+
+
+def completed_ids(output_path):
+    """
+    IDs already answered in an output file
+
+    Failed answers are not counted, so a resumed run retries them. A line cut
+    off by an interruption is ignored.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(record, dict) and not record.get("error"):
+                done.add(str(record.get("id")))
+    return done
+
+
+class BatchAnswerer:
+    """
+    Answers many questions with batched retrieval and concurrent LLM calls
+
+    Questions are retrieved `retrieve_batch_size` at a time, with one
+    embedding call and one FAISS search per batch (questions sharing the same
+    filters are batched together). Their LLM calls then run on a pool of
+    `concurrency` threads, and answers are yielded in completion order while
+    the next batch is retrieved. Batch answers bypass the answer cache.
+    """
+
+    def __init__(self, chatbot, concurrency=8, retrieve_batch_size=256):
+        """
+        Args:
+            chatbot: The RAGChatbot whose retriever and LLM answer the questions
+            concurrency: LLM calls in flight at once
+            retrieve_batch_size: Questions embedded and searched together
+        """
+        self.chatbot = chatbot
+        self.concurrency = max(1, int(concurrency))
+        self.retrieve_batch_size = max(1, int(retrieve_batch_size))
+
+    def _batches(self, questions):
+        """(normalized filters, questions) in batches, grouped by filters in first-seen order"""
+        groups = {}
+        for question in questions:
+            filters = normalize_filters(question["filters"])
+            key = json.dumps(filters, sort_keys=True)
+            groups.setdefault(key, (filters, []))[1].append(question)
+        for filters, group in groups.values():
+            for start in range(0, len(group), self.retrieve_batch_size):
+                yield filters, group[start:start + self.retrieve_batch_size]
+
+    def _answer(self, question, retrieved_docs, started):
+        response_data = self.chatbot.llm.generate_response(question["question"], retrieved_docs)
+        error = bool(response_data.get('error'))
+        metrics.CHAT_REQUESTS.labels("error" if error else "answered").inc()
+        record = {
+            "id": question["id"],
+            "question": question["question"],
+            "response": response_data['text'],
+            "response_points": response_data['points'],
+            "sources": unique_sources(retrieved_docs["metadata"]),
+            "latency_ms": round((time.time() - started) * 1000, 1)
+        }
+        if error:
+            record["error"] = response_data['text']
+        return record
+
+    @staticmethod
+    def _failed(question, message):
+        metrics.CHAT_REQUESTS.labels("error").inc()
+        return {"id": question["id"], "question": question["question"], "error": message}
+
+    def answer(self, questions, skip_ids=()):
+        """
+        Answer questions, skipping already answered IDs
+
+        Args:
+            questions: Entries from parse_question
+            skip_ids: IDs to leave out (e.g. from completed_ids)
+
+        Yields:
+            One result dict per question, in completion order. Failed
+            questions have an "error" message.
+        """
+        skip_ids = set(skip_ids)
+        valid = []
+        for question in questions:
+            if question["id"] in skip_ids:
+                continue
+            try:
+                normalize_filters(question["filters"])
+            except FilterError as e:
+                yield self._failed(question, str(e))
+                continue
+            valid.append(question)
+
+        pending = set()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch-llm") as executor:
+            for filters, batch in self._batches(valid):
+                started = time.time()
+                try:
+                    with metrics.stage("batch", "retrieve"):
+                        results = self.chatbot.retriever.retrieve_many(
+                            [question["question"] for question in batch], filters=filters
+                        )
+                except Exception as e:
+                    print(f"Batch retrieval failed: {str(e)}")
+                    for question in batch:
+                        yield self._failed(question, f"Retrieval failed: {str(e)}")
+                    continue
+
+                for question, retrieved_docs in zip(batch, results):
+                    pending.add(executor.submit(self._answer, question, retrieved_docs, started))
+
+                # Keep at most a few batches of LLM calls queued; stream what is done meanwhile
+                while len(pending) > max(self.concurrency, self.retrieve_batch_size):
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+
+def _ends_with_newline(path):
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def run_batch(chatbot, input_path, output_path, concurrency=8, resume=True, retrieve_batch_size=256):
+    """
+    Answer a JSONL file of questions into a JSONL file of answers
+
+    Answers are appended and flushed one line at a time in completion order.
+    With `resume`, questions already answered in `output_path` are skipped,
+    so an interrupted run continues where it stopped.
+
+    Returns:
+        Dict with the numbers of answered, failed and skipped questions
+    """
+    questions = read_questions(input_path)
+    done = completed_ids(output_path) if resume else set()
+    skipped = sum(1 for question in questions if question["id"] in done)
+    total = len(questions) - skipped
+    print(f"Answering {total} questions ({skipped} already answered) with concurrency {concurrency}")
+
+    answerer = BatchAnswerer(chatbot, concurrency=concurrency, retrieve_batch_size=retrieve_batch_size)
+    answered = failed = 0
+    started = time.time()
+    with open(output_path, 'a' if resume else 'w', encoding='utf-8') as f:
+        if f.tell() > 0 and not _ends_with_newline(output_path):
+            f.write("\n")  # Close a line cut off by an interruption
+        for record in answerer.answer(questions, skip_ids=done):
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            if record.get("error"):
+                failed += 1
+            else:
+                answered += 1
+            if (answered + failed) % 50 == 0 or answered + failed == total:
+                elapsed = time.time() - started
+                print(f"{answered + failed}/{total} done ({failed} failed, {(answered + failed) / max(elapsed, 1e-9):.1f} questions/s)")
+    return {"answered": answered, "failed": failed, "skipped": skipped}
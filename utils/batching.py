@@ -0,0 +1,137 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+
+class BatcherClosed(RuntimeError):
+    """Raised by MicroBatcher.submit() once the batcher is closed"""
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent calls into batches
+
+    Callers block in submit(). A background thread takes the first waiting item,
+    keeps collecting items for up to `window_ms` (or until `max_batch_size`
+    items are queued), hands the whole batch to `process_batch` in one call and
+    fans the results back out to the callers. Under load this turns many
+    batch-of-one operations into a few large ones, at the cost of at most
+    `window_ms` extra latency; a lone request is processed as soon as its
+    window expires.
+
+    Safe to create before a pre-fork server forks: a forked child does not
+    inherit the background thread, so it starts its own on first submit.
+
+    close() may race with submit(): an item is either queued before the
+    close() sentinel and processed, or rejected with BatcherClosed, so no
+    caller is left waiting.
+    """
+
+    def __init__(self, process_batch, window_ms=3.0, max_batch_size=64, name="micro-batcher"):
+        """
+        Args:
+            process_batch: Function taking a list of items and returning a list
+                of results in the same order
+            window_ms: How long to wait for more items after the first one
+            max_batch_size: Largest batch handed to process_batch
+            name: Name of the background thread
+        """
+        self.process_batch = process_batch
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.queue = queue.Queue()
+        self.stats = {"batches": 0, "items": 0, "max_batch": 0}
+        self.name = name
+        self._closed = False
+        self._lock = threading.Lock()
+        self._start()
+
+    def _start(self):
+        self.queue = queue.Queue()
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def submit(self, item, timeout=None):
+        """
+        Process an item as part of the next batch and return its result
+
+        Raises:
+            BatcherClosed: If close() was called; the item was not processed
+        """
+        future = Future()
+        # Checking _closed and queueing under the lock keeps the item ahead of close()'s sentinel
+        with self._lock:
+            if self._closed:
+                raise BatcherClosed(f"{self.name} is closed")
+            if self._pid != os.getpid():
+                self._start()
+            self.queue.put((item, future))
+        return future.result(timeout=timeout)
+
+    def _collect(self):
+        """Block for the first item, then gather more until the window closes"""
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if any(entry is None for entry in batch):
+                # close() sentinel: finish the real items and anything still queued, then stop
+                batch = [entry for entry in batch if entry is not None]
+                while True:
+                    try:
+                        entry = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if entry is not None:
+                        batch.append(entry)
+                for start in range(0, len(batch), self.max_batch_size):
+                    self._process(batch[start:start + self.max_batch_size])
+                return
+            self._process(batch)
+
+    def _process(self, batch):
+        if not batch:
+            return
+        items = [item for item, _ in batch]
+        futures = [future for _, future in batch]
+        try:
+            results = self.process_batch(items)
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        self.stats["batches"] += 1
+        self.stats["items"] += len(items)
+        self.stats["max_batch"] = max(self.stats["max_batch"], len(items))
+        for future, result in zip(futures, results):
+            future.set_result(result)
+
+    def close(self):
+        """Stop the background thread after the queued items are processed"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self.queue.put(None)
+            thread = self._thread if self._pid == os.getpid() else None
+        if thread is not None:
+            thread.join()
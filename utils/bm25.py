@@ -0,0 +1,257 @@
+import os
+import re
+import json
+import shutil
+from collections import Counter
+import numpy as np
+
+BM25_VERSION = 1
+
+# Words and identifiers such as "ipv4", "802.11", "tcp/ip" or "cs-301"
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[._/\-][a-z0-9]+)*")
+SEPARATORS = re.compile(r"[._/\-]")
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have how if in into is it its of on or "
+    "that the their there these this to was were what when where which who why will with".split()
+)
+
+
+def tokenize(text):
+    """
+    Lowercase terms of a text for BM25
+
+    Compound identifiers are kept whole and also split into their parts, so
+    "CS-301" matches both "cs-301" and "301".
+    """
+    terms = [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+    for token in [token for token in terms if not token.isalnum()]:
+        terms.extend(part for part in SEPARATORS.split(token) if part and part not in STOPWORDS)
+    return terms
+
+
+def bm25_exists(path):
+    """Whether a BM25 index has been written at path"""
+    return os.path.exists(os.path.join(path, "bm25.json"))
+
+
+class BM25Builder:
+    """
+    Accumulates documents and writes a BM25 inverted index
+
+    Documents are added in the same order as the rows of the chunk store.
+    Only term counts are kept in memory, one block of arrays per batch; the
+    postings are laid out once in save(). The documents of a previous index
+    are added with add_index(), which copies their postings instead of
+    tokenizing the texts again.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocabulary = {}
+        # (ids, doc_lengths, term_ids, term_counts, rows) per block; rows count from the block's first document
+        self.blocks = []
+
+    def add(self, ids, texts):
+        """Add a batch of chunks"""
+        vocabulary = self.vocabulary
+        doc_lengths, doc_terms, doc_counts = [], [], []
+        for text in texts:
+            terms = tokenize(text)
+            counts = Counter(terms)
+            doc_lengths.append(len(terms))
+            doc_terms.append(np.fromiter(
+                (vocabulary.setdefault(term, len(vocabulary)) for term in counts), dtype='int32', count=len(counts)
+            ))
+            doc_counts.append(np.fromiter(counts.values(), dtype='float32', count=len(counts)))
+        if not doc_lengths:
+            return
+        self.blocks.append((
+            np.asarray(ids, dtype='int64'),
+            np.asarray(doc_lengths, dtype='float32'),
+            np.concatenate(doc_terms),
+            np.concatenate(doc_counts),
+            np.repeat(np.arange(len(doc_terms), dtype='int32'), [len(terms) for terms in doc_terms])
+        ))
+
+    def add_index(self, index, exclude_ids=None):
+        """
+        Add the documents of an existing index, except exclude_ids
+
+        Returns:
+            False, adding nothing, when the index predates stored term counts
+        """
+        if index.term_counts is None or index.doc_lengths is None:
+            return False
+        keep = np.ones(len(index), dtype=bool)
+        if exclude_ids is not None and len(exclude_ids):
+            keep[np.isin(index.ids, np.asarray(exclude_ids, dtype='int64'))] = False
+        if not keep.any():
+            return True
+
+        indptr = np.asarray(index.indptr)
+        doc_rows = np.asarray(index.doc_rows)
+        term_ids = np.repeat(np.arange(len(indptr) - 1, dtype='int32'), np.diff(indptr))
+        kept = keep[doc_rows]
+        term_ids, doc_rows = term_ids[kept], doc_rows[kept]
+        # Terms only removed documents used are dropped from the vocabulary
+        mapping = np.full(len(indptr) - 1, -1, dtype='int32')
+        for term_id in np.unique(term_ids):
+            mapping[term_id] = self.vocabulary.setdefault(index.terms[term_id], len(self.vocabulary))
+        self.blocks.append((
+            np.asarray(index.ids, dtype='int64')[keep],
+            np.asarray(index.doc_lengths, dtype='float32')[keep],
+            mapping[term_ids],
+            np.asarray(index.term_counts)[kept],
+            (np.cumsum(keep) - 1)[doc_rows].astype('int32')
+        ))
+        return True
+
+    def __len__(self):
+        return sum(len(block[0]) for block in self.blocks)
+
+    def save(self, path, build_id=None):
+        """
+        Write the index to the directory at path, replacing any existing one
+
+        path is meant to be inside an unpublished chunk store build (see
+        ChunkStoreWriter.bm25_file), which is published with the store, so
+        readers never see a partly written index.
+
+        The postings are stored in CSR form: the documents containing term t are
+        doc_rows[indptr[t]:indptr[t + 1]], and weights holds their BM25
+        term-frequency component, so a query is scored with one multiply-add
+        per posting.
+
+        Args:
+            path: Directory to write
+            build_id: Build ID of the chunk store the rows belong to
+        """
+        n_docs = len(self)
+        n_terms = len(self.vocabulary)
+        offsets = np.cumsum([0] + [len(block[0]) for block in self.blocks])
+        ids = np.concatenate([block[0] for block in self.blocks]) if n_docs else np.empty(0, dtype='int64')
+        doc_lengths = np.concatenate([block[1] for block in self.blocks]) if n_docs else np.empty(0, dtype='float32')
+        avgdl = float(doc_lengths.mean()) if n_docs and doc_lengths.sum() else 1.0
+
+        term_ids = np.concatenate([block[2] for block in self.blocks]) if n_docs else np.empty(0, dtype='int32')
+        tf = np.concatenate([block[3] for block in self.blocks]) if n_docs else np.empty(0, dtype='float32')
+        doc_rows = np.concatenate([
+            block[4] + np.int32(offset) for block, offset in zip(self.blocks, offsets)
+        ]) if n_docs else np.empty(0, dtype='int32')
+
+        # Group postings by term; a stable sort keeps each list in row order
+        order = np.argsort(term_ids, kind='stable')
+        term_ids, tf, doc_rows = term_ids[order], tf[order], doc_rows[order]
+        df = np.bincount(term_ids, minlength=n_terms)
+        indptr = np.zeros(n_terms + 1, dtype='int64')
+        np.cumsum(df, out=indptr[1:])
+
+        norm = self.k1 * (1 - self.b + self.b * doc_lengths[doc_rows] / avgdl)
+        weights = (tf * (self.k1 + 1) / (tf + norm)).astype('float32')
+        idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5)).astype('float32')
+
+        vocabulary = [None] * n_terms
+        for term, term_id in self.vocabulary.items():
+            vocabulary[term_id] = term
+
+        if os.path.exists(path):
+            shutil.rmtree(path)  # Hard links of the build this one was forked from
+        os.makedirs(path)
+        np.save(os.path.join(path, "ids.npy"), ids)
+        np.save(os.path.join(path, "indptr.npy"), indptr)
+        np.save(os.path.join(path, "doc_rows.npy"), doc_rows)
+        np.save(os.path.join(path, "weights.npy"), weights)
+        # Raw counts, so the next build can copy these postings (see add_index)
+        np.save(os.path.join(path, "term_counts.npy"), tf)
+        np.save(os.path.join(path, "doc_lengths.npy"), doc_lengths)
+        np.save(os.path.join(path, "idf.npy"), idf)
+        with open(os.path.join(path, "vocabulary.json"), 'w', encoding='utf-8') as f:
+            json.dump(vocabulary, f, ensure_ascii=False)
+        with open(os.path.join(path, "bm25.json"), 'w', encoding='utf-8') as f:
+            json.dump({
+                "version": BM25_VERSION,
+                "build_id": build_id,
+                "count": n_docs,
+                "terms": n_terms,
+                "postings": int(len(doc_rows)),
+                "avgdl": avgdl,
+                "k1": self.k1,
+                "b": self.b
+            }, f)
+
+        print(f"Saved BM25 index ({n_docs} chunks, {n_terms} terms) to {path}")
+
+
+class BM25Index:
+    """
+    Read-only BM25 index written by BM25Builder
+
+    The postings arrays are memory-mapped; a query touches only the postings
+    of its own terms.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "bm25.json"), 'r', encoding='utf-8') as f:
+            self.info = json.load(f)
+        if self.info.get("version") != BM25_VERSION:
+            raise ValueError(f"Unsupported BM25 index version in {path}: {self.info.get('version')}")
+
+        with open(os.path.join(path, "vocabulary.json"), 'r', encoding='utf-8') as f:
+            self.terms = json.load(f)
+        self.vocabulary = {term: term_id for term_id, term in enumerate(self.terms)}
+        self.ids = np.load(os.path.join(path, "ids.npy"), mmap_mode='r')
+        self.indptr = np.load(os.path.join(path, "indptr.npy"), mmap_mode='r')
+        self.doc_rows = np.load(os.path.join(path, "doc_rows.npy"), mmap_mode='r')
+        self.weights = np.load(os.path.join(path, "weights.npy"), mmap_mode='r')
+        self.idf = np.load(os.path.join(path, "idf.npy"))
+        # Indexes written before these were saved cannot be copied by add_index
+        self.term_counts = self._load_optional("term_counts.npy")
+        self.doc_lengths = self._load_optional("doc_lengths.npy")
+
+    def _load_optional(self, name):
+        file_path = os.path.join(self.path, name)
+        return np.load(file_path, mmap_mode='r') if os.path.exists(file_path) else None
+
+    def __len__(self):
+        return int(self.info["count"])
+
+    @property
+    def build_id(self):
+        """Build ID of the chunk store this index was built with"""
+        return self.info.get("build_id")
+
+    def search(self, query, k, row_mask=None):
+        """
+        Score all chunks against a query
+
+        Args:
+            query: The query text
+            k: Number of results
+            row_mask: Optional boolean mask of the chunks that may be returned,
+                one entry per chunk store row (the index shares the store's row order)
+
+        Returns:
+            (chunk IDs, scores), best first; only chunks sharing a term with
+            the query are returned
+        """
+        term_ids = [self.vocabulary[term] for term in tokenize(query) if term in self.vocabulary]
+        if not term_ids or k <= 0:
+            return np.empty(0, dtype='int64'), np.empty(0, dtype='float32')
+
+        scores = np.zeros(len(self), dtype='float32')
+        # Repeated query terms count once per occurrence, as in the BM25 sum
+        for term_id in term_ids:
+            start, end = int(self.indptr[term_id]), int(self.indptr[term_id + 1])
+            # Rows are unique within one postings list, so += accumulates correctly
+            scores[self.doc_rows[start:end]] += self.idf[term_id] * self.weights[start:end]
+        if row_mask is not None:
+            scores[~row_mask] = 0
+
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind='stable')]
+        return np.asarray(self.ids[matched], dtype='int64'), scores[matched]
@@ -0,0 +1,845 @@
+import os
+import sys
+import json
+import mmap
+import uuid
+import shutil
+import pickle
+import numpy as np
+import faiss
+from utils.dedup import BANDS, table_keys, sorted_table
+
+STORE_VERSION = 1
+# IO_FLAG_MMAP_IFC (FAISS >= 1.10) also maps flat codes; it must not be combined with IO_FLAG_MMAP
+IO_FLAGS_MMAP = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def read_index(index_file, mmap_index=True):
+    """
+    Read a FAISS index written with faiss.write_index
+
+    Args:
+        index_file: Path to the index file
+        mmap_index: Memory-map the index read-only so worker processes share the page cache
+    """
+    if mmap_index:
+        return faiss.read_index(index_file, IO_FLAGS_MMAP)
+    return faiss.read_index(index_file)
+
+
+def write_index(index, index_file):
+    """Write a FAISS index atomically (readers never see a half-written file)"""
+    tmp_file = f"{index_file}.tmp-{os.getpid()}"
+    faiss.write_index(index, tmp_file)
+    os.replace(tmp_file, index_file)
+
+
+# Inside data_file: the pointer to the published build, and each build's indexes
+CURRENT_FILE = "CURRENT"
+BUILD_PREFIX = "build-"
+BUILD_INDEX_FILE = "index.faiss"
+BUILD_BM25_DIR = "bm25"
+# Store files written directly in data_file before builds were versioned
+LEGACY_STORE_FILES = (
+    "store.json", "ids.npy", "embeddings.npy", "texts.bin", "metadata.bin",
+    "text_offsets.npy", "metadata_offsets.npy", "sources.json", "source_codes.npy",
+    "pages.npy", "uploaded_at.npy", "text_hashes.npy", "minhashes.npy", "duplicates.json"
+)
+
+
+def current_build(data_file):
+    """
+    Directory of the published build of a chunk store
+
+    data_file holds one directory per build (chunk store, FAISS index and
+    BM25 index) and a CURRENT file naming the published one. Stores written
+    before builds were versioned keep their files directly in data_file.
+
+    Returns:
+        The build directory, data_file itself for the old layout, or None
+        when nothing has been published
+    """
+    try:
+        with open(os.path.join(data_file, CURRENT_FILE), 'r', encoding='utf-8') as f:
+            return os.path.join(data_file, f.read().strip())
+    except FileNotFoundError:
+        pass
+    if os.path.exists(os.path.join(data_file, "store.json")):
+        return data_file
+    return None
+
+
+def store_exists(data_file):
+    """Whether a chunk store has been published at data_file"""
+    return current_build(data_file) is not None
+
+
+def index_exists(index_file, data_file):
+    """Whether a chunk store and its FAISS index have been published"""
+    build = current_build(data_file)
+    if build is None:
+        return False
+    if build == data_file:
+        return os.path.exists(index_file)  # Old layout: the index is a file of its own
+    return os.path.exists(os.path.join(build, BUILD_INDEX_FILE))
+
+
+def publish_build(data_file, build_path, legacy_files=()):
+    """
+    Make a finished build the published one
+
+    The chunk store, FAISS index and BM25 index of the build are published
+    together by atomically replacing the CURRENT file, so readers open either
+    all old or all new files. The previous build is kept for readers that
+    resolved CURRENT just before the switch; older builds are deleted (memory
+    maps of their files stay valid). The store files of the old layout
+    (LEGACY_STORE_FILES), and legacy_files (the index files it used), are
+    deleted once a versioned build has been published before this one; other
+    files in data_file are left alone.
+
+    Args:
+        data_file: Root directory of the chunk store
+        build_path: The build directory, inside data_file
+        legacy_files: Old-layout FAISS index file and BM25 directory
+    """
+    previous = current_build(data_file)
+    tmp_file = os.path.join(data_file, f"{CURRENT_FILE}.tmp-{os.getpid()}")
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        f.write(os.path.basename(build_path))
+    os.replace(tmp_file, os.path.join(data_file, CURRENT_FILE))
+
+    keep = {os.path.basename(build_path)}
+    if previous is not None and previous != data_file:
+        keep.add(os.path.basename(previous))
+    for entry in os.scandir(data_file):
+        if entry.is_dir() and entry.name.startswith(BUILD_PREFIX) and entry.name not in keep:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+    if previous != data_file:
+        # Nobody can still be resolving the old layout
+        for name in LEGACY_STORE_FILES:
+            path = os.path.join(data_file, name)
+            if os.path.isfile(path):
+                os.remove(path)
+        for path in legacy_files:
+            if path and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif path and os.path.isfile(path):
+                os.remove(path)
+
+
+def open_published(data_file, open_files):
+    """
+    Open the files of the published build, again if it is replaced meanwhile
+
+    publish_build() deletes a build once two newer ones have been published,
+    so a reader that resolved CURRENT just before can find its files gone.
+    If opening fails and CURRENT has changed since, the new build is opened.
+
+    Args:
+        data_file: Root directory of the chunk store
+        open_files: Function that opens the ChunkStore at data_file and the
+            indexes published with it
+
+    Returns:
+        What open_files() returns
+    """
+    while True:
+        build = current_build(data_file)
+        try:
+            return open_files()
+        except Exception:
+            if current_build(data_file) == build:
+                raise
+
+
+def fork_build(store, data_file, index_file=None, bm25_file=None):
+    """
+    Start a new build from the files of an existing one
+
+    Used when only the FAISS or BM25 index changes: the store files are hard
+    links (copies where linking fails), as are the indexes, which the caller
+    then overwrites. The build is published with publish_build().
+
+    Args:
+        store: ChunkStore of the build to start from
+        data_file: Root directory of the chunk store
+        index_file, bm25_file: Indexes of a store in the old layout
+
+    Returns:
+        The path of the new, unpublished build
+    """
+    build_path = os.path.join(data_file, f"{BUILD_PREFIX}{uuid.uuid4().hex}")
+    os.makedirs(build_path)
+
+    def link(src, dst):
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+
+    for entry in os.scandir(store.path):
+        if entry.is_file() and not entry.name.startswith(CURRENT_FILE):
+            link(entry.path, os.path.join(build_path, entry.name))
+    index_file = store.index_file or index_file
+    if index_file and os.path.exists(index_file) and not os.path.exists(os.path.join(build_path, BUILD_INDEX_FILE)):
+        link(index_file, os.path.join(build_path, BUILD_INDEX_FILE))
+    bm25_file = store.bm25_file or bm25_file
+    if bm25_file and os.path.isdir(bm25_file):
+        os.makedirs(os.path.join(build_path, BUILD_BM25_DIR))
+        for entry in os.scandir(bm25_file):
+            if entry.is_file():
+                link(entry.path, os.path.join(build_path, BUILD_BM25_DIR, entry.name))
+    return build_path
+
+
+class ChunkStore:
+    """
+    Read-only, memory-mapped store of chunk texts, metadata and embeddings
+
+    The store directory holds a CURRENT file naming the published build and
+    one directory per build (see publish_build). Layout of a build:
+        index.faiss           the FAISS index over the build's embeddings
+        bm25/                 the BM25 index over its texts (optional)
+        store.json            version, build ID, row count and embedding dimension
+        ids.npy               chunk IDs, sorted ascending (row i holds ids[i])
+        embeddings.npy        float32 embedding matrix, one row per chunk
+        texts.bin             UTF-8 texts back to back, sliced by text_offsets.npy
+        metadata.bin          JSON metadata back to back, sliced by metadata_offsets.npy
+        sources.json          distinct metadata["source"] values
+        source_codes.npy      int32 position of each row's source in sources.json (-1 if none)
+        pages.npy             int32 metadata["page"] of each row (-1 if none)
+        uploaded_at.npy       float64 metadata["uploaded_at"] of each row (NaN if none)
+        text_hashes.npy       uint64 exact-content hash of each row (optional)
+        minhashes.npy         uint32 MinHash signature of each row (optional)
+        lsh_keys.npy          uint64 (bands + 1, rows) exact-hash and LSH band keys,
+                              sorted per table, with their rows in lsh_rows.npy
+                              (written with the fingerprints)
+        duplicates.json       {chunk ID: [{"source", "page"}, ...]} where the
+                              chunk's duplicates were found (optional)
+
+    sources.json to uploaded_at.npy are filter columns (see utils.metadata_filter);
+    stores written before they existed get them computed from the metadata on
+    first use. The fingerprints, their lookup tables and the duplicates are
+    written when chunks are deduplicated at ingestion (see utils.dedup).
+
+    Only the rows that are actually read are paged in, so opening a large store
+    is cheap and the OS page cache is shared between processes.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path: The store directory, or one build directory in it
+        """
+        self.root = path
+        path = current_build(path)
+        if path is None:
+            raise FileNotFoundError(f"No chunk store has been published in {self.root}")
+        self.path = path
+        # Indexes published with this build; None for stores in the old layout
+        self.index_file = self._optional_path(BUILD_INDEX_FILE)
+        self.bm25_file = self._optional_path(BUILD_BM25_DIR)
+        with open(os.path.join(path, "store.json"), 'r', encoding='utf-8') as f:
+            self.info = json.load(f)
+        if self.info.get("version") != STORE_VERSION:
+            raise ValueError(f"Unsupported chunk store version in {path}: {self.info.get('version')}")
+
+        self.ids = np.load(os.path.join(path, "ids.npy"), mmap_mode='r')
+        self.embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode='r')
+        self.text_offsets = np.load(os.path.join(path, "text_offsets.npy"), mmap_mode='r')
+        self.metadata_offsets = np.load(os.path.join(path, "metadata_offsets.npy"), mmap_mode='r')
+        self._texts = self._map(os.path.join(path, "texts.bin"))
+        self._metadata = self._map(os.path.join(path, "metadata.bin"))
+        self.text_hashes = self._load_optional("text_hashes.npy")
+        self.minhashes = self._load_optional("minhashes.npy")
+        self.lsh_keys = self._load_optional("lsh_keys.npy")
+        self.lsh_rows = self._load_optional("lsh_rows.npy")
+        self._filter_columns = None
+        self._duplicates = None
+
+    def _optional_path(self, name):
+        file_path = os.path.join(self.path, name)
+        return file_path if os.path.exists(file_path) else None
+
+    def _load_optional(self, name):
+        file_path = os.path.join(self.path, name)
+        return np.load(file_path, mmap_mode='r') if os.path.exists(file_path) else None
+
+    @staticmethod
+    def _map(file_path):
+        """Memory-map a blob file (empty files cannot be mapped)"""
+        if os.path.getsize(file_path) == 0:
+            return b""
+        with open(file_path, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return int(self.info["count"])
+
+    @property
+    def dimension(self):
+        return int(self.info["dimension"])
+
+    @property
+    def build_id(self):
+        """Unique ID of this build of the store; changes whenever it is rewritten"""
+        return self.info.get("build_id")
+
+    def rows_for_ids(self, ids):
+        """
+        Translate chunk IDs into row numbers
+
+        Returns:
+            An int64 array of rows, -1 for IDs that are not in the store
+        """
+        ids = np.asarray(ids, dtype='int64')
+        if len(self) == 0:
+            return np.full(len(ids), -1, dtype='int64')
+        rows = np.searchsorted(self.ids, ids)
+        rows = np.minimum(rows, len(self) - 1)
+        return np.where(self.ids[rows] == ids, rows, -1).astype('int64')
+
+    def text(self, row):
+        """Text of a single row"""
+        start, end = int(self.text_offsets[row]), int(self.text_offsets[row + 1])
+        return self._texts[start:end].decode('utf-8')
+
+    def metadata(self, row):
+        """Metadata dict of a single row"""
+        start, end = int(self.metadata_offsets[row]), int(self.metadata_offsets[row + 1])
+        return json.loads(self._metadata[start:end].decode('utf-8'))
+
+    def duplicate_sources(self):
+        """Where each deduplicated chunk's duplicates were found: {chunk ID: [{"source", "page"}, ...]}"""
+        if self._duplicates is None:
+            duplicates = {}
+            file_path = os.path.join(self.path, "duplicates.json")
+            if os.path.exists(file_path):
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    duplicates = {int(chunk_id): entries for chunk_id, entries in json.load(f).items()}
+            self._duplicates = duplicates
+        return self._duplicates
+
+    def get(self, ids):
+        """
+        Fetch texts and metadata for chunk IDs, reading only those rows
+
+        The metadata of a chunk that had duplicates also lists every source
+        it was found in under "sources" and the duplicates' {"source", "page"}
+        under "duplicates".
+
+        Returns:
+            A dictionary with "rows", "texts" and "metadata" lists
+        """
+        ids = np.asarray(ids, dtype='int64')
+        rows = [int(row) for row in self.rows_for_ids(ids)]
+        duplicates = self.duplicate_sources()
+        metadata = []
+        for chunk_id, row in zip(ids, rows):
+            meta = self.metadata(row)
+            entries = duplicates.get(int(chunk_id))
+            if entries:
+                sources = [meta.get("source")] if meta.get("source") is not None else []
+                for entry in entries:
+                    if entry["source"] not in sources:
+                        sources.append(entry["source"])
+                meta["sources"] = sources
+                meta["duplicates"] = entries
+            metadata.append(meta)
+        return {
+            "rows": rows,
+            "texts": [self.text(row) for row in rows],
+            "metadata": metadata
+        }
+
+    def filter_columns(self):
+        """
+        Per-row metadata columns used by metadata filters
+
+        Returns:
+            A dict with "sources" (list of distinct sources), "source_codes",
+            "pages" and "uploaded_at" arrays with one entry per row, and
+            "duplicate_rows"/"duplicate_codes" pairing rows with the
+            sources of their duplicates
+        """
+        if self._filter_columns is None:
+            if os.path.exists(os.path.join(self.path, "sources.json")):
+                with open(os.path.join(self.path, "sources.json"), 'r', encoding='utf-8') as f:
+                    sources = json.load(f)
+                columns = {
+                    "sources": sources,
+                    "source_codes": np.load(os.path.join(self.path, "source_codes.npy"), mmap_mode='r'),
+                    "pages": np.load(os.path.join(self.path, "pages.npy"), mmap_mode='r'),
+                    "uploaded_at": np.load(os.path.join(self.path, "uploaded_at.npy"), mmap_mode='r')
+                }
+            else:
+                columns = FilterColumns()
+                for row in range(len(self)):
+                    columns.add(self.metadata(row))
+                columns = columns.arrays()
+
+            sources = list(columns["sources"])
+            codes = {source: code for code, source in enumerate(sources)}
+            duplicate_rows, duplicate_codes = [], []
+            duplicates = self.duplicate_sources()
+            for row, entries in zip(self.rows_for_ids(list(duplicates)), duplicates.values()):
+                if row < 0:
+                    continue
+                for entry in entries:
+                    if entry["source"] not in codes:
+                        codes[entry["source"]] = len(sources)
+                        sources.append(entry["source"])
+                    duplicate_rows.append(int(row))
+                    duplicate_codes.append(codes[entry["source"]])
+            columns["sources"] = sources
+            columns["duplicate_rows"] = np.asarray(duplicate_rows, dtype='int64')
+            columns["duplicate_codes"] = np.asarray(duplicate_codes, dtype='int32')
+            self._filter_columns = columns
+        return self._filter_columns
+
+    def iter_batches(self, batch_size=4096, exclude_ids=None):
+        """
+        Iterate over the store in row batches
+
+        Args:
+            batch_size: Number of rows per batch
+            exclude_ids: Chunk IDs to skip
+
+        Yields:
+            Dictionaries with "ids", "texts", "metadata" and "embeddings", plus
+            "text_hashes" and "minhashes" when the store has fingerprints
+        """
+        exclude_ids = np.asarray(exclude_ids if exclude_ids is not None else [], dtype='int64')
+        for start in range(0, len(self), batch_size):
+            end = min(start + batch_size, len(self))
+            ids = np.asarray(self.ids[start:end])
+            rows = np.arange(start, end)
+            if len(exclude_ids):
+                keep = ~np.isin(ids, exclude_ids)
+                ids, rows = ids[keep], rows[keep]
+            if len(rows) == 0:
+                continue
+            batch = {
+                "ids": ids,
+                "texts": [self.text(row) for row in rows],
+                "metadata": [self.metadata(row) for row in rows],
+                "embeddings": np.asarray(self.embeddings[rows], dtype='float32')
+            }
+            if self.text_hashes is not None and self.minhashes is not None:
+                batch["text_hashes"] = np.asarray(self.text_hashes[rows])
+                batch["minhashes"] = np.asarray(self.minhashes[rows])
+            yield batch
+
+    def close(self):
+        """Release the memory maps"""
+        for blob in (self._texts, self._metadata):
+            if isinstance(blob, mmap.mmap):
+                blob.close()
+
+
+class FilterColumns:
+    """Accumulates the filter columns of metadata rows"""
+
+    def __init__(self):
+        self.source_index = {}
+        self.source_codes = []
+        self.pages = []
+        self.uploaded_at = []
+
+    def add(self, meta):
+        source = meta.get("source")
+        if source is None:
+            self.source_codes.append(-1)
+        else:
+            self.source_codes.append(self.source_index.setdefault(str(source), len(self.source_index)))
+        page = meta.get("page")
+        self.pages.append(int(page) if isinstance(page, (int, float)) else -1)
+        uploaded_at = meta.get("uploaded_at")
+        self.uploaded_at.append(float(uploaded_at) if isinstance(uploaded_at, (int, float)) else np.nan)
+
+    def take(self):
+        """The columns added since the last take(), as little-endian arrays"""
+        columns = (
+            np.asarray(self.source_codes, dtype='<i4'),
+            np.asarray(self.pages, dtype='<i4'),
+            np.asarray(self.uploaded_at, dtype='<f8')
+        )
+        self.source_codes, self.pages, self.uploaded_at = [], [], []
+        return columns
+
+    @property
+    def sources(self):
+        return list(self.source_index)
+
+    def arrays(self):
+        source_codes, pages, uploaded_at = self.take()
+        return {"sources": self.sources, "source_codes": source_codes, "pages": pages, "uploaded_at": uploaded_at}
+
+
+class ChunkStoreWriter:
+    """
+    Streaming writer for a ChunkStore
+
+    Rows are appended in batches and written straight to disk, so the writer's
+    memory does not grow with the corpus. The store is written to a new build
+    directory; after close(), the FAISS index is saved to index_file and the
+    BM25 index to bm25_file, and publish() makes all three current at once.
+    Rows must be appended in ascending ID order.
+
+    The surviving rows of the previous build are copied first with
+    append_store(), as raw byte ranges. Fingerprints (see utils.dedup) are
+    only kept when every batch has them; their lookup tables are then
+    written on close(), merging the previous build's tables with the keys of
+    the new rows. Sources of deduplicated chunks are collected with
+    add_duplicate() and written on close().
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path: The store directory
+        """
+        self.root = path
+        self.build_id = uuid.uuid4().hex
+        self.path = os.path.join(path, f"{BUILD_PREFIX}{self.build_id}")
+        self.index_file = os.path.join(self.path, BUILD_INDEX_FILE)
+        self.bm25_file = os.path.join(self.path, BUILD_BM25_DIR)
+        os.makedirs(self.path)
+
+        self.count = 0
+        self.dimension = None
+        self.last_id = -1
+        self._ids = open(os.path.join(self.path, "ids.bin"), 'wb')
+        self._embeddings = open(os.path.join(self.path, "embeddings.bin"), 'wb')
+        self._texts = open(os.path.join(self.path, "texts.bin"), 'wb')
+        self._metadata = open(os.path.join(self.path, "metadata.bin"), 'wb')
+        self._text_offsets = open(os.path.join(self.path, "text_offsets.bin"), 'wb')
+        self._metadata_offsets = open(os.path.join(self.path, "metadata_offsets.bin"), 'wb')
+        self._source_codes = open(os.path.join(self.path, "source_codes.bin"), 'wb')
+        self._pages = open(os.path.join(self.path, "pages.bin"), 'wb')
+        self._uploaded_at = open(os.path.join(self.path, "uploaded_at.bin"), 'wb')
+        self._filter_columns = FilterColumns()
+        self._text_hashes = None
+        self._minhashes = None
+        self.num_perm = None
+        self.fingerprints = True
+        self.duplicates = {}
+        self._copied = None
+        self._text_end = 0
+        self._metadata_end = 0
+        np.zeros(1, dtype='<i8').tofile(self._text_offsets)
+        np.zeros(1, dtype='<i8').tofile(self._metadata_offsets)
+
+    def append(self, ids, texts, metadata, embeddings, text_hashes=None, minhashes=None):
+        """Append a batch of rows, optionally with their text hashes and MinHash signatures"""
+        ids = np.asarray(ids, dtype='<i8')
+        if len(ids) == 0:
+            return
+        if ids[0] <= self.last_id or np.any(np.diff(ids) <= 0):
+            raise ValueError("Chunk IDs must be appended in ascending order")
+
+        embeddings = np.ascontiguousarray(embeddings, dtype='<f4')
+        if self.dimension is None:
+            self.dimension = int(embeddings.shape[1])
+        elif embeddings.shape[1] != self.dimension:
+            raise ValueError(f"Embedding dimension {embeddings.shape[1]} does not match {self.dimension}")
+
+        text_offsets = []
+        for text in texts:
+            encoded = text.encode('utf-8')
+            self._texts.write(encoded)
+            self._text_end += len(encoded)
+            text_offsets.append(self._text_end)
+
+        metadata_offsets = []
+        for meta in metadata:
+            encoded = json.dumps(meta, ensure_ascii=False, default=str).encode('utf-8')
+            self._metadata.write(encoded)
+            self._metadata_end += len(encoded)
+            metadata_offsets.append(self._metadata_end)
+            self._filter_columns.add(meta)
+        source_codes, pages, uploaded_at = self._filter_columns.take()
+        source_codes.tofile(self._source_codes)
+        pages.tofile(self._pages)
+        uploaded_at.tofile(self._uploaded_at)
+
+        self._append_fingerprints(text_hashes, minhashes)
+
+        ids.tofile(self._ids)
+        embeddings.tofile(self._embeddings)
+        np.asarray(text_offsets, dtype='<i8').tofile(self._text_offsets)
+        np.asarray(metadata_offsets, dtype='<i8').tofile(self._metadata_offsets)
+        self.count += len(ids)
+        self.last_id = int(ids[-1])
+
+    def append_store(self, store, exclude_ids=None, fingerprints=True, batch_size=65536):
+        """
+        Copy the rows of an existing store, except exclude_ids
+
+        Texts, metadata and columns are copied as byte ranges, with no
+        decoding, so the cost is a bulk copy per run of surviving rows. Must
+        come before any append().
+
+        Args:
+            store: The ChunkStore to copy from; must stay open until close()
+            exclude_ids: Chunk IDs to drop
+            fingerprints: Copy the store's fingerprints (when it has them)
+            batch_size: Largest number of rows copied at once
+
+        Returns:
+            The number of rows copied
+        """
+        if self.count:
+            raise ValueError("append_store() must come before any other rows")
+        keep = np.ones(len(store), dtype=bool)
+        if exclude_ids is not None and len(exclude_ids):
+            keep[np.isin(store.ids, np.asarray(exclude_ids, dtype='int64'))] = False
+        rows = np.flatnonzero(keep)
+        if len(rows) == 0:
+            return 0
+        if self.dimension is None:
+            self.dimension = store.dimension
+        elif store.dimension != self.dimension:
+            raise ValueError(f"Embedding dimension {store.dimension} does not match {self.dimension}")
+
+        columns = store.filter_columns()
+        sources = columns["sources"]
+        source_codes = np.asarray(columns["source_codes"])
+        # Re-code the sources the surviving rows use
+        mapping = np.full(len(sources) + 1, -1, dtype='<i4')
+        for code in np.unique(source_codes[rows]):
+            if code >= 0:
+                mapping[code] = self._filter_columns.source_index.setdefault(sources[code], len(self._filter_columns.source_index))
+
+        fingerprints = fingerprints and store.text_hashes is not None and store.minhashes is not None
+        breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+        for run_start, run_end in zip(rows[np.r_[0, breaks]], rows[np.r_[breaks - 1, len(rows) - 1]] + 1):
+            for start in range(int(run_start), int(run_end), batch_size):
+                end = min(start + batch_size, int(run_end))
+                self._copy_rows(store, start, end, mapping[source_codes[start:end]], columns, fingerprints)
+
+        if self.fingerprints and store.lsh_keys is not None and store.lsh_keys.shape[0] == BANDS + 1:
+            self._copied = {
+                "count": self.count,
+                "keys": store.lsh_keys,
+                "rows": store.lsh_rows,
+                "keep": keep,
+                "new_rows": np.cumsum(keep) - 1
+            }
+        return self.count
+
+    @staticmethod
+    def _write_range(f, blob, start, end):
+        if end > start:
+            with memoryview(blob) as view, view[start:end] as part:
+                f.write(part)
+
+    def _copy_rows(self, store, start, end, source_codes, columns, fingerprints):
+        """Copy the contiguous rows start:end of store"""
+        text_offsets = np.asarray(store.text_offsets[start:end + 1], dtype='<i8')
+        self._write_range(self._texts, store._texts, int(text_offsets[0]), int(text_offsets[-1]))
+        (text_offsets[1:] - text_offsets[0] + self._text_end).tofile(self._text_offsets)
+        self._text_end += int(text_offsets[-1] - text_offsets[0])
+
+        metadata_offsets = np.asarray(store.metadata_offsets[start:end + 1], dtype='<i8')
+        self._write_range(self._metadata, store._metadata, int(metadata_offsets[0]), int(metadata_offsets[-1]))
+        (metadata_offsets[1:] - metadata_offsets[0] + self._metadata_end).tofile(self._metadata_offsets)
+        self._metadata_end += int(metadata_offsets[-1] - metadata_offsets[0])
+
+        source_codes.astype('<i4').tofile(self._source_codes)
+        np.asarray(columns["pages"][start:end], dtype='<i4').tofile(self._pages)
+        np.asarray(columns["uploaded_at"][start:end], dtype='<f8').tofile(self._uploaded_at)
+
+        if fingerprints:
+            self._append_fingerprints(store.text_hashes[start:end], store.minhashes[start:end])
+        else:
+            self._append_fingerprints(None, None)
+
+        np.asarray(store.ids[start:end], dtype='<i8').tofile(self._ids)
+        np.asarray(store.embeddings[start:end], dtype='<f4').tofile(self._embeddings)
+        self.count += end - start
+        self.last_id = int(store.ids[end - 1])
+
+    def _append_fingerprints(self, text_hashes, minhashes):
+        if not self.fingerprints:
+            return
+        if text_hashes is None or minhashes is None:
+            self._drop_fingerprints()
+            return
+        minhashes = np.ascontiguousarray(minhashes, dtype='<u4')
+        if self._text_hashes is None:
+            if self.count > 0:
+                # Earlier rows had none
+                self._drop_fingerprints()
+                return
+            self.num_perm = int(minhashes.shape[1])
+            self._text_hashes = open(os.path.join(self.path, "text_hashes.bin"), 'wb')
+            self._minhashes = open(os.path.join(self.path, "minhashes.bin"), 'wb')
+        elif minhashes.shape[1] != self.num_perm:
+            self._drop_fingerprints()
+            return
+        np.asarray(text_hashes, dtype='<u8').tofile(self._text_hashes)
+        minhashes.tofile(self._minhashes)
+
+    def _drop_fingerprints(self):
+        self.fingerprints = False
+        for f in (self._text_hashes, self._minhashes):
+            if f is not None:
+                f.close()
+                os.remove(f.name)
+        self._text_hashes = self._minhashes = None
+
+    def add_duplicate(self, chunk_id, source, page=None):
+        """Record that chunk_id's content was also found in source (at page)"""
+        entry = {"source": source, "page": page}
+        entries = self.duplicates.setdefault(int(chunk_id), [])
+        if entry not in entries:
+            entries.append(entry)
+
+    @staticmethod
+    def _raw_to_npy(raw_file, npy_file, dtype, shape):
+        """Wrap a raw little-endian dump in an .npy header without loading it"""
+        with open(npy_file, 'wb') as out:
+            np.lib.format.write_array_header_1_0(
+                out, {"descr": np.dtype(dtype).str, "fortran_order": False, "shape": shape}
+            )
+            with open(raw_file, 'rb') as src:
+                shutil.copyfileobj(src, out, 1 << 20)
+        os.remove(raw_file)
+
+    def _files(self):
+        files = (self._ids, self._embeddings, self._texts, self._metadata, self._text_offsets,
+                 self._metadata_offsets, self._source_codes, self._pages, self._uploaded_at)
+        return files + tuple(f for f in (self._text_hashes, self._minhashes) if f is not None)
+
+    def close(self):
+        """Finish writing the store; it is not visible to readers until publish()"""
+        for f in self._files():
+            f.close()
+
+        dimension = self.dimension or 0
+
+        def join(name):
+            return os.path.join(self.path, name)
+
+        self._raw_to_npy(join("ids.bin"), join("ids.npy"), '<i8', (self.count,))
+        self._raw_to_npy(join("embeddings.bin"), join("embeddings.npy"), '<f4', (self.count, dimension))
+        self._raw_to_npy(join("text_offsets.bin"), join("text_offsets.npy"), '<i8', (self.count + 1,))
+        self._raw_to_npy(join("metadata_offsets.bin"), join("metadata_offsets.npy"), '<i8', (self.count + 1,))
+        self._raw_to_npy(join("source_codes.bin"), join("source_codes.npy"), '<i4', (self.count,))
+        self._raw_to_npy(join("pages.bin"), join("pages.npy"), '<i4', (self.count,))
+        self._raw_to_npy(join("uploaded_at.bin"), join("uploaded_at.npy"), '<f8', (self.count,))
+        with open(join("sources.json"), 'w', encoding='utf-8') as f:
+            json.dump(self._filter_columns.sources, f, ensure_ascii=False)
+        if self._text_hashes is not None:
+            self._raw_to_npy(join("text_hashes.bin"), join("text_hashes.npy"), '<u8', (self.count,))
+            self._raw_to_npy(join("minhashes.bin"), join("minhashes.npy"), '<u4', (self.count, self.num_perm))
+            if self.num_perm % BANDS == 0:
+                self._write_lookup_tables(join)
+        if self.duplicates:
+            with open(join("duplicates.json"), 'w', encoding='utf-8') as f:
+                json.dump({str(chunk_id): entries for chunk_id, entries in sorted(self.duplicates.items())},
+                          f, ensure_ascii=False)
+
+        with open(join("store.json"), 'w', encoding='utf-8') as f:
+            json.dump({
+                "version": STORE_VERSION,
+                "build_id": self.build_id,
+                "count": self.count,
+                "dimension": dimension
+            }, f)
+
+    def _write_lookup_tables(self, join):
+        """
+        Sorted exact-hash and LSH band tables of the fingerprints (see DuplicateIndex.add_stored)
+
+        The tables of a store copied with append_store() are reused: its
+        surviving entries keep their order, and the keys of the rows appended
+        since are sorted and merged in, one table at a time.
+        """
+        text_hashes = np.load(join("text_hashes.npy"), mmap_mode='r')
+        minhashes = np.load(join("minhashes.npy"), mmap_mode='r')
+        copied = self._copied
+        start = copied["count"] if copied is not None else 0
+        keys_out = np.lib.format.open_memmap(join("lsh_keys.npy"), mode='w+', dtype='<u8', shape=(BANDS + 1, self.count))
+        rows_out = np.lib.format.open_memmap(join("lsh_rows.npy"), mode='w+', dtype='<i8', shape=(BANDS + 1, self.count))
+        for table in range(BANDS + 1):
+            keys, rows = sorted_table(table_keys(text_hashes[start:], minhashes[start:], BANDS, table))
+            rows += start
+            if copied is not None:
+                old_rows = np.asarray(copied["rows"][table])
+                keep = copied["keep"][old_rows]
+                old_keys = np.asarray(copied["keys"][table])[keep]
+                # New rows come after stored rows with the same key
+                position = np.searchsorted(old_keys, keys, side='right')
+                keys = np.insert(old_keys, position, keys)
+                rows = np.insert(copied["new_rows"][old_rows[keep]], position, rows)
+            keys_out[table] = keys
+            rows_out[table] = rows
+        keys_out.flush()
+        rows_out.flush()
+        del keys_out, rows_out
+        self._copied = None
+
+    def publish(self, legacy_files=()):
+        """Publish the closed store together with its indexes (see publish_build)"""
+        publish_build(self.root, self.path, legacy_files)
+
+    def abort(self):
+        """Discard everything written so far"""
+        for f in self._files():
+            f.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def migrate_legacy_pickles(
+    legacy_index_file="faiss_index.pkl",
+    legacy_data_file="documents_data.pkl",
+    data_file="documents_data"
+):
+    """
+    Convert the old pickled index and data into the native on-disk format
+
+    Only run this on pickles you produced yourself: unpickling executes code.
+    Indexes without chunk IDs get IDs equal to their row positions.
+
+    Returns:
+        The number of chunks migrated
+    """
+    with open(legacy_index_file, 'rb') as f:
+        index = pickle.load(f)
+    with open(legacy_data_file, 'rb') as f:
+        data = pickle.load(f)
+
+    embeddings = np.asarray(data["embeddings"], dtype='float32')
+    ids = np.asarray(data.get("ids", np.arange(len(data["texts"]))), dtype='int64')
+
+    if not isinstance(index, faiss.IndexIDMap2):
+        # Rebuild from the stored embeddings so the index carries chunk IDs
+        index = faiss.IndexIDMap2(faiss.IndexFlatL2(embeddings.shape[1]))
+        index.add_with_ids(embeddings, ids)
+
+    order = np.argsort(ids, kind='stable')
+    writer = ChunkStoreWriter(data_file)
+    try:
+        writer.append(
+            ids[order],
+            [data["texts"][i] for i in order],
+            [data["metadata"][i] for i in order],
+            embeddings[order]
+        )
+    except Exception:
+        writer.abort()
+        raise
+    writer.close()
+    write_index(index, writer.index_file)
+    writer.publish()
+
+    print(f"Migrated {len(ids)} chunks from {legacy_index_file}/{legacy_data_file} to {data_file}")
+    return len(ids)
+
+
+if __name__ == "__main__":
+    # Usage: python -m utils.chunk_store [legacy_index.pkl legacy_data.pkl data_dir]
+    migrate_legacy_pickles(*sys.argv[1:4])
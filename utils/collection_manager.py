@@ -0,0 +1,275 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from utils.chunk_store import index_exists, current_build, BUILD_BM25_DIR
+from utils import metrics
+
+# Collection names are used as directory names and in URLs
+COLLECTION_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$")
+DEFAULT_COLLECTION = "default"
+
+COLLECTIONS_LOADED = metrics.Gauge(
+    "rag_collections_loaded", "Collections with a loaded index"
+)
+COLLECTIONS_MEMORY = metrics.Gauge(
+    "rag_collections_memory_bytes", "Estimated memory of the loaded collections"
+)
+COLLECTION_LOADS = metrics.Counter(
+    "rag_collection_loads", "Collection loads and evictions", ["event"]
+)
+
+
+class CollectionError(Exception):
+    """A collection request that cannot be served"""
+
+
+class CollectionNotFound(CollectionError):
+    """No collection with this name exists"""
+
+
+class CollectionNotReady(CollectionError):
+    """The collection exists but has no index to search yet"""
+
+
+class Collection:
+    """
+    The files of one named document set
+
+    Each collection has its own upload directory, FAISS index, chunk store,
+    BM25 index and manifest, so collections are indexed and searched
+    independently.
+    """
+
+    def __init__(self, name, data_dir, index_file, data_file, manifest_file, bm25_file):
+        self.name = name
+        self.data_dir = data_dir
+        self.index_file = index_file
+        self.data_file = data_file
+        self.manifest_file = manifest_file
+        self.bm25_file = bm25_file
+
+    @classmethod
+    def in_directory(cls, name, root):
+        """The standard layout: everything under root/<name>/"""
+        base = os.path.join(root, name)
+        return cls(
+            name,
+            data_dir=os.path.join(base, "data"),
+            index_file=os.path.join(base, "faiss_index.faiss"),
+            data_file=os.path.join(base, "documents_data"),
+            manifest_file=os.path.join(base, "index_manifest.json"),
+            bm25_file=os.path.join(base, "bm25_index")
+        )
+
+    def index_exists(self):
+        return index_exists(self.index_file, self.data_file)
+
+    def list_files(self, extensions):
+        """Uploaded files with one of the given extensions"""
+        if not os.path.isdir(self.data_dir):
+            return []
+        return sorted(
+            name for name in os.listdir(self.data_dir)
+            if os.path.isfile(os.path.join(self.data_dir, name)) and name.rsplit('.', 1)[-1].lower() in extensions
+        )
+
+    def footprint_bytes(self):
+        """
+        Memory the collection can occupy once loaded
+
+        Indexes, chunk stores and BM25 postings are memory-mapped, so this is
+        the size of the published build's files: the most the collection can
+        keep resident.
+        """
+        build = current_build(self.data_file)
+        if build is not None and build != self.data_file:
+            paths = [build, os.path.join(build, BUILD_BM25_DIR)]
+        else:
+            paths = [self.index_file, self.data_file, self.bm25_file]  # Old layout
+        total = 0
+        for path in paths:
+            if os.path.isfile(path):
+                total += os.path.getsize(path)
+            elif os.path.isdir(path):
+                for entry in os.scandir(path):
+                    if entry.is_file():
+                        total += entry.stat().st_size
+        return total
+
+    def processor_options(self):
+        """Path arguments for DocumentProcessor and RAGChatbot"""
+        return {
+            "data_dir": self.data_dir,
+            "index_file": self.index_file,
+            "data_file": self.data_file,
+            "manifest_file": self.manifest_file,
+            "bm25_file": self.bm25_file
+        }
+
+
+class CollectionManager:
+    """
+    Named collections, loaded lazily and evicted least-recently-used first
+
+    A collection's chatbot is created by `factory(collection)` the first time
+    it is used. When the loaded collections exceed `max_memory_mb` (estimated
+    with Collection.footprint_bytes) or `max_loaded`, the least recently used
+    ones are closed; they are reopened from disk on their next request.
+    Requests already running on an evicted collection finish normally.
+    """
+
+    def __init__(self, root, factory, max_memory_mb=None, max_loaded=None):
+        """
+        Args:
+            root: Directory holding one subdirectory per collection
+            factory: Function creating the chatbot for a Collection
+            max_memory_mb: Memory ceiling for loaded collections (None for no limit)
+            max_loaded: Maximum number of loaded collections (None for no limit)
+        """
+        self.root = root
+        self.factory = factory
+        self.max_memory = max_memory_mb * 1024 * 1024 if max_memory_mb else None
+        self.max_loaded = max_loaded
+        self.registered = {}
+        self.loaded = OrderedDict()  # name -> (chatbot, footprint), least recently used first
+        self.load_locks = {}
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def validate_name(name):
+        if not COLLECTION_NAME.match(name or ""):
+            raise CollectionError(
+                f"Invalid collection name '{name}': use up to 64 letters, digits, '-' or '_'"
+            )
+
+    def register(self, collection):
+        """Add a collection with a custom layout (e.g. the legacy single index)"""
+        self.registered[collection.name] = collection
+
+    def create(self, name):
+        """Create a collection (a no-op if it exists) and return it"""
+        self.validate_name(name)
+        collection = self.registered.get(name) or Collection.in_directory(name, self.root)
+        os.makedirs(collection.data_dir, exist_ok=True)
+        return collection
+
+    def get(self, name):
+        """
+        The collection with this name
+
+        Raises:
+            CollectionNotFound: If it was never created
+        """
+        if name in self.registered:
+            return self.registered[name]
+        self.validate_name(name)
+        collection = Collection.in_directory(name, self.root)
+        if not os.path.isdir(collection.data_dir):
+            raise CollectionNotFound(f"Collection '{name}' not found")
+        return collection
+
+    def names(self):
+        on_disk = [
+            name for name in os.listdir(self.root)
+            if COLLECTION_NAME.match(name) and os.path.isdir(os.path.join(self.root, name, "data"))
+        ]
+        return sorted(set(on_disk) | set(self.registered))
+
+    def chatbot(self, name):
+        """
+        The loaded chatbot of a collection, loading it on first use
+
+        Raises:
+            CollectionNotFound: If the collection does not exist
+        """
+        collection = self.get(name)
+        with self.lock:
+            entry = self.loaded.get(name)
+            if entry is not None:
+                self.loaded.move_to_end(name)
+                return entry[0]
+            load_lock = self.load_locks.setdefault(name, threading.Lock())
+
+        # Loading can take seconds; only requests for this collection wait
+        with load_lock:
+            with self.lock:
+                entry = self.loaded.get(name)
+                if entry is not None:
+                    self.loaded.move_to_end(name)
+                    return entry[0]
+            print(f"Loading collection '{name}'...")
+            chatbot = self.factory(collection)
+            COLLECTION_LOADS.labels("load").inc()
+            with self.lock:
+                self.loaded[name] = (chatbot, collection.footprint_bytes())
+                evicted = self._evict_over_limit(keep=name)
+        for evicted_name, evicted_chatbot in evicted:
+            print(f"Evicting collection '{evicted_name}'")
+            evicted_chatbot.close()
+        return chatbot
+
+    def loaded_chatbot(self, name):
+        """The chatbot of a collection if it is loaded, else None"""
+        with self.lock:
+            entry = self.loaded.get(name)
+        return entry[0] if entry is not None else None
+
+    def reload(self, name):
+        """Hot-swap a rebuilt index into the collection if it is loaded"""
+        chatbot = self.loaded_chatbot(name)
+        if chatbot is None:
+            return  # Loaded from the new files on next use
+        chatbot.reload_index()
+        footprint = self.get(name).footprint_bytes()
+        with self.lock:
+            if name in self.loaded:
+                self.loaded[name] = (chatbot, footprint)
+            evicted = self._evict_over_limit(keep=name)
+        for evicted_name, evicted_chatbot in evicted:
+            print(f"Evicting collection '{evicted_name}'")
+            evicted_chatbot.close()
+
+    def evict(self, name):
+        """Close a loaded collection; returns whether it was loaded"""
+        with self.lock:
+            entry = self.loaded.pop(name, None)
+            self._update_gauges()
+        if entry is None:
+            return False
+        COLLECTION_LOADS.labels("evict").inc()
+        entry[0].close()
+        return True
+
+    def _evict_over_limit(self, keep):
+        """Pop least recently used collections until within limits; call with the lock held"""
+        evicted = []
+        while len(self.loaded) > 1:
+            memory = sum(footprint for _, footprint in self.loaded.values())
+            over_memory = self.max_memory is not None and memory > self.max_memory
+            over_count = self.max_loaded is not None and len(self.loaded) > self.max_loaded
+            if not (over_memory or over_count):
+                break
+            name = next(iter(self.loaded))
+            if name == keep:
+                self.loaded.move_to_end(name)
+                name = next(iter(self.loaded))
+            evicted.append((name, self.loaded.pop(name)[0]))
+            COLLECTION_LOADS.labels("evict").inc()
+        self._update_gauges()
+        return evicted
+
+    def _update_gauges(self):
+        COLLECTIONS_LOADED.set(len(self.loaded))
+        COLLECTIONS_MEMORY.set(sum(footprint for _, footprint in self.loaded.values()))
+
+    def stats(self):
+        with self.lock:
+            loaded = [(name, footprint) for name, (_, footprint) in self.loaded.items()]
+        return {
+            "loaded": [name for name, _ in loaded],
+            "memory_bytes": sum(footprint for _, footprint in loaded),
+            "max_memory_bytes": self.max_memory,
+            "max_loaded": self.max_loaded
+        }
@@ -0,0 +1,284 @@
+import os
+import math
+import threading
+from utils import metrics
+from utils.dedup import chunk_sources
+
+# Hugging Face tokenizers for Groq model families; others use an estimate
+MODEL_TOKENIZERS = {
+    "llama3": "NousResearch/Meta-Llama-3-8B",
+    "llama-3": "NousResearch/Meta-Llama-3-8B"
+}
+
+# Shortest shared text treated as chunk overlap when positions are unknown
+MIN_OVERLAP_CHARS = 20
+
+
+class TokenCounter:
+    """
+    Counts tokens with the target model's tokenizer
+
+    Uses the `tokenizers` library with the Hugging Face tokenizer matching
+    the Groq model, loaded on first use from a local tokenizer.json or the
+    Hugging Face cache. It is only downloaded with allow_download. If the
+    tokenizer cannot be loaded (unknown model, not available locally,
+    library missing), it falls back to an estimate of `chars_per_token`
+    characters per token.
+    """
+
+    def __init__(self, model_name=None, tokenizer_name=None, chars_per_token=4.0, allow_download=False):
+        """
+        Args:
+            model_name: Groq model name, used to pick a tokenizer
+            tokenizer_name: Hugging Face tokenizer, or a local tokenizer.json
+                file or directory, to use instead
+            chars_per_token: Characters per token of the fallback estimate
+            allow_download: Download the tokenizer from the Hugging Face Hub
+                when it is not available locally
+        """
+        self.chars_per_token = chars_per_token
+        self.tokenizer_name = tokenizer_name or self.tokenizer_for_model(model_name)
+        self.allow_download = allow_download
+        self._tokenizer = None
+        self._loaded = not self.tokenizer_name
+        self._lock = threading.Lock()
+
+    @property
+    def tokenizer(self):
+        """The tokenizer, or None when token counts are estimated"""
+        if not self._loaded:
+            self.load()
+        return self._tokenizer
+
+    def load(self):
+        """Load the tokenizer if that has not been tried yet; returns it or None"""
+        with self._lock:
+            if not self._loaded:
+                try:
+                    with metrics.startup_step(f"tokenizer:{self.tokenizer_name}", "load"):
+                        self._tokenizer = self._load_tokenizer()
+                except Exception as e:
+                    print(f"Could not load tokenizer {self.tokenizer_name} ({e}); estimating token counts")
+                self._loaded = True
+        return self._tokenizer
+
+    def tokenizer_file(self):
+        """Local tokenizer.json for tokenizer_name (a path or the Hugging Face cache), or None"""
+        path = os.path.expanduser(self.tokenizer_name)
+        if os.path.isdir(path):
+            path = os.path.join(path, "tokenizer.json")
+        if os.path.isfile(path):
+            return path
+        from huggingface_hub import try_to_load_from_cache
+        cached = try_to_load_from_cache(self.tokenizer_name, "tokenizer.json")
+        return cached if isinstance(cached, str) else None
+
+    def _load_tokenizer(self):
+        from tokenizers import Tokenizer
+        path = self.tokenizer_file()
+        if path is not None:
+            return Tokenizer.from_file(path)
+        if self.allow_download:
+            return Tokenizer.from_pretrained(self.tokenizer_name)
+        raise FileNotFoundError(f"{self.tokenizer_name} is not a local file or in the Hugging Face cache")
+
+    @staticmethod
+    def tokenizer_for_model(model_name):
+        """Hugging Face tokenizer for a Groq model name, or None"""
+        name = (model_name or "").lower()
+        for prefix, tokenizer_name in MODEL_TOKENIZERS.items():
+            if name.startswith(prefix):
+                return tokenizer_name
+        return None
+
+    def count(self, text):
+        """Number of tokens in a text"""
+        if self.tokenizer is None:
+            return math.ceil(len(text) / self.chars_per_token)
+        return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+
+    def truncate(self, text, max_tokens):
+        """The longest prefix of text with at most max_tokens tokens"""
+        if max_tokens <= 0:
+            return ""
+        if self.tokenizer is None:
+            end = int(max_tokens * self.chars_per_token)
+        else:
+            offsets = self.tokenizer.encode(text, add_special_tokens=False).offsets
+            if len(offsets) <= max_tokens:
+                return text
+            end = offsets[max_tokens - 1][1]
+        if end >= len(text):
+            return text
+        # Cut at a word boundary when there is one close by
+        space = text.rfind(" ", 0, end)
+        return text[:space if space > end * 0.8 else end]
+
+
+def text_overlap(first, second, max_overlap=400):
+    """
+    Length of the longest suffix of first that is a prefix of second
+
+    Returns 0 unless at least MIN_OVERLAP_CHARS characters overlap.
+    """
+    probe = second[:MIN_OVERLAP_CHARS]
+    if len(probe) < MIN_OVERLAP_CHARS:
+        return 0
+    position = first.find(probe, max(0, len(first) - max_overlap))
+    while position != -1:
+        if second.startswith(first[position:]):
+            return len(first) - position
+        position = first.find(probe, position + 1)
+    return 0
+
+
+class ContextPacker:
+    """
+    Builds the prompt context from retrieved chunks within a token budget
+
+    Chunks from the same source and page that overlap or touch (the splitter
+    repeats up to chunk_overlap characters between neighbours) are merged into
+    a single span, so shared text is sent once. Spans are then added in rank
+    order until the budget is used up; the span that crosses the budget is
+    truncated and lower-ranked spans are dropped.
+    """
+
+    def __init__(self, token_counter, token_budget=3000, min_span_tokens=32):
+        """
+        Args:
+            token_counter: TokenCounter for the target model
+            token_budget: Maximum context tokens (None for no limit)
+            min_span_tokens: Smallest truncated span worth including
+        """
+        self.token_counter = token_counter
+        self.token_budget = token_budget
+        self.min_span_tokens = min_span_tokens
+
+    @staticmethod
+    def format_document(number, source, text):
+        return f"Document {number} (from {source}):\n{text}\n"
+
+    def merge_chunks(self, texts, metadata):
+        """
+        Merge overlapping or adjacent chunks of the same source and page
+
+        Chunk positions come from the splitter's "start_index" metadata; older
+        chunks without it are merged when one's end repeats the other's start.
+
+        Returns:
+            Spans as dicts with "text", "metadata", "rank" (best rank of the
+            merged chunks) and "chunks" (number merged), best rank first
+        """
+        groups = {}
+        for rank, (text, meta) in enumerate(zip(texts, metadata)):
+            key = (meta.get("source"), meta.get("page"))
+            groups.setdefault(key, []).append({"text": text, "metadata": meta, "rank": rank, "chunks": 1})
+
+        spans = []
+        for group in groups.values():
+            if all("start_index" in span["metadata"] for span in group):
+                spans.extend(self._merge_by_position(group))
+            else:
+                spans.extend(self._merge_by_text(group))
+        return sorted(spans, key=lambda span: span["rank"])
+
+    @staticmethod
+    def _merge_by_position(group):
+        group = sorted(group, key=lambda span: span["metadata"]["start_index"])
+        merged = [dict(group[0])]
+        for span in group[1:]:
+            current = merged[-1]
+            current_start = current["metadata"]["start_index"]
+            current_end = current_start + len(current["text"])
+            start = span["metadata"]["start_index"]
+            if start > current_end:
+                merged.append(dict(span))
+                continue
+            # Overlapping or adjacent: append only the part not already covered
+            current["text"] += span["text"][current_end - start:]
+            current["rank"] = min(current["rank"], span["rank"])
+            current["chunks"] += span["chunks"]
+        return merged
+
+    @staticmethod
+    def _merge_by_text(group):
+        spans = [dict(span) for span in group]
+        merged_any = True
+        while merged_any and len(spans) > 1:
+            merged_any = False
+            for i in range(len(spans)):
+                for j in range(len(spans)):
+                    if i == j:
+                        continue
+                    first, second = spans[i], spans[j]
+                    if second["text"] in first["text"]:
+                        combined = first["text"]
+                    else:
+                        overlap = text_overlap(first["text"], second["text"])
+                        if not overlap:
+                            continue
+                        combined = first["text"] + second["text"][overlap:]
+                    first["text"] = combined
+                    first["rank"] = min(first["rank"], second["rank"])
+                    first["chunks"] += second["chunks"]
+                    del spans[j]
+                    merged_any = True
+                    break
+                if merged_any:
+                    break
+        return spans
+
+    def pack(self, retrieved_documents):
+        """
+        Build the context string for a prompt
+
+        Returns:
+            (context, stats) where stats reports "chunks", "spans" sent,
+            "chunks_merged", "spans_dropped", "truncated", "tokens_original"
+            (the chunks concatenated in full), "tokens" and "tokens_saved"
+        """
+        texts = retrieved_documents["texts"]
+        metadata = retrieved_documents["metadata"]
+        counter = self.token_counter
+
+        original = "\n".join(
+            self.format_document(i + 1, ", ".join(chunk_sources(meta)), text)
+            for i, (text, meta) in enumerate(zip(texts, metadata))
+        )
+        tokens_original = counter.count(original) if original else 0
+
+        spans = self.merge_chunks(texts, metadata)
+        parts, tokens, truncated = [], 0, False
+        for span in spans:
+            source = ", ".join(chunk_sources(span["metadata"]))  # every file a deduplicated chunk came from
+            separator = 1 if parts else 0  # newline joining documents
+            document = self.format_document(len(parts) + 1, source, span["text"])
+            cost = counter.count(document) + separator
+            if self.token_budget is None or tokens + cost <= self.token_budget:
+                parts.append(document)
+                tokens += cost
+                continue
+
+            # Over budget: keep what fits of this span and drop the lower-ranked rest
+            header_cost = counter.count(self.format_document(len(parts) + 1, source, "")) + separator
+            remaining = self.token_budget - tokens - header_cost
+            if remaining >= self.min_span_tokens:
+                document = self.format_document(len(parts) + 1, source, counter.truncate(span["text"], remaining))
+                parts.append(document)
+                tokens += counter.count(document) + separator
+                truncated = True
+            break
+
+        context = "\n".join(parts)
+        stats = {
+            "chunks": len(texts),
+            "spans": len(parts),
+            "chunks_merged": len(texts) - len(spans),
+            "spans_dropped": len(spans) - len(parts),
+            "truncated": truncated,
+            "tokens_original": tokens_original,
+            "tokens": tokens,
+            "tokens_saved": max(0, tokens_original - tokens),
+            "token_budget": self.token_budget
+        }
+        return context, stats
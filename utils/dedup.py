@@ -0,0 +1,276 @@
+import zlib
+import hashlib
+import numpy as np
+
+NUM_PERM = 64
+BANDS = 16
+SHINGLE_SIZE = 3
+DEFAULT_THRESHOLD = 0.85
+
+_SHINGLE_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+_BAND_MULTIPLIER = np.uint64(0x100000001B3)
+_SHIFT = np.uint64(32)
+
+
+def normalize_text(text):
+    """Lower-case text with whitespace collapsed, so formatting differences do not matter"""
+    return " ".join(text.lower().split())
+
+
+def text_hash(text):
+    """64-bit hash of the normalized text, for exact duplicate detection"""
+    digest = hashlib.blake2b(normalize_text(text).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def chunk_sources(meta):
+    """
+    Every source a chunk was found in
+
+    Deduplicated chunks carry the sources of their duplicates in
+    metadata["sources"] (see ChunkStore.get); other chunks have just one.
+    """
+    return meta.get("sources") or [meta.get("source", "Unknown source")]
+
+
+def unique_sources(metadata):
+    """Sources of a list of chunk metadata, flattened in first-seen order"""
+    sources = []
+    for meta in metadata:
+        for source in chunk_sources(meta):
+            if source not in sources:
+                sources.append(source)
+    return sources
+
+
+def band_keys(signatures, bands):
+    """
+    64-bit key of each LSH band of each signature
+
+    Signatures sharing a band's values share its key; the rare keys shared
+    by different values only add candidates, which are then checked by
+    similarity.
+
+    Returns:
+        A (n, bands) uint64 matrix
+    """
+    signatures = np.asarray(signatures, dtype=np.uint64)
+    rows = signatures.reshape(len(signatures), bands, signatures.shape[1] // bands)
+    keys = np.zeros((len(signatures), bands), dtype=np.uint64)
+    for column in range(rows.shape[2]):
+        keys = keys * _BAND_MULTIPLIER + rows[:, :, column]
+    return keys
+
+
+def table_keys(text_hashes, signatures, bands, table):
+    """
+    Keys of one lookup table: table 0 holds exact text hashes, table b the key of band b - 1
+
+    Returns:
+        A uint64 array with one key per chunk
+    """
+    if table == 0:
+        return np.asarray(text_hashes, dtype=np.uint64)
+    width = signatures.shape[1] // bands
+    return band_keys(signatures[:, (table - 1) * width:table * width], 1)[:, 0]
+
+
+def sorted_table(keys):
+    """
+    Keys in ascending order with the row each came from
+
+    Rows with equal keys stay in row order, so the first match of a key is
+    the earliest row holding it.
+    """
+    order = np.argsort(keys, kind='stable')
+    return keys[order], order.astype(np.int64)
+
+
+def lookup_tables(text_hashes, signatures, bands):
+    """
+    Sorted key tables of the exact hash and every LSH band
+
+    Returns:
+        (keys, rows): (bands + 1, n) uint64 keys sorted per table and the
+        int64 row of each key
+    """
+    keys = np.empty((bands + 1, len(text_hashes)), dtype=np.uint64)
+    rows = np.empty((bands + 1, len(text_hashes)), dtype=np.int64)
+    for table in range(bands + 1):
+        keys[table], rows[table] = sorted_table(table_keys(text_hashes, signatures, bands, table))
+    return keys, rows
+
+
+class MinHasher:
+    """
+    MinHash signatures over word shingles
+
+    The Jaccard similarity of two texts' shingle sets is estimated by the
+    share of signature positions that agree. Shingle hashes are combined
+    from per-word hashes and permuted with multiply-shift hashing, all in
+    numpy, so a chunk is fingerprinted in well under a millisecond. The
+    permutations are derived from a fixed seed, so signatures stored with a
+    chunk store stay comparable across builds and processes.
+    """
+
+    def __init__(self, num_perm=NUM_PERM, shingle_size=SHINGLE_SIZE, seed=1):
+        """
+        Args:
+            num_perm: Signature length; more permutations give tighter estimates
+            shingle_size: Words per shingle
+            seed: Seed of the hash permutations
+        """
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        # Multiply-shift hashing needs odd multipliers
+        self.a = rng.randint(0, np.iinfo(np.int64).max, size=num_perm, dtype=np.int64).astype(np.uint64) | np.uint64(1)
+        self.b = rng.randint(0, np.iinfo(np.int64).max, size=num_perm, dtype=np.int64).astype(np.uint64)
+
+    def shingle_hashes(self, text):
+        """64-bit hashes of the text's word shingles (repeats do not change the signature)"""
+        words = text.lower().split()
+        hashes = np.fromiter((zlib.crc32(word.encode('utf-8')) for word in words), dtype=np.uint64, count=len(words))
+        n = min(self.shingle_size, len(words))
+        if n == 0:
+            return np.zeros(1, dtype=np.uint64)
+        count = len(words) - n + 1
+        shingles = hashes[:count].copy()
+        for offset in range(1, n):
+            shingles = shingles * _SHINGLE_MULTIPLIER + hashes[offset:offset + count]
+        return shingles
+
+    def signature(self, text):
+        """uint32 signature of one text"""
+        # (a*x + b) mod 2^64, top 32 bits: one permutation per column
+        permuted = (np.outer(self.shingle_hashes(text), self.a) + self.b) >> _SHIFT
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def fingerprints(self, texts):
+        """
+        Exact hashes and MinHash signatures of a batch of texts
+
+        Returns:
+            A uint64 array of text hashes and a (n, num_perm) uint32 signature matrix
+        """
+        hashes = np.fromiter((text_hash(text) for text in texts), dtype=np.uint64, count=len(texts))
+        signatures = np.empty((len(texts), self.num_perm), dtype=np.uint32)
+        for i, text in enumerate(texts):
+            signatures[i] = self.signature(text)
+        return hashes, signatures
+
+
+class DuplicateIndex:
+    """
+    Finds exact and near duplicates among the chunks added so far
+
+    Exact duplicates are found by text hash. Near duplicates go through
+    locality-sensitive hashing: signatures are cut into bands, chunks sharing
+    any band are candidates, and a candidate counts as a duplicate when its
+    estimated Jaccard similarity reaches the threshold. The first chunk added
+    with a given content is the canonical one.
+
+    The chunks of an existing store are registered at once with add_stored():
+    they are looked up in sorted key tables (saved with the store, see
+    ChunkStoreWriter) by binary search, so no per-chunk Python state is
+    built for them. Chunks added one by one are kept in dictionaries.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, num_perm=NUM_PERM, bands=BANDS):
+        """
+        Args:
+            threshold: Estimated Jaccard similarity from which chunks are near duplicates
+            num_perm: Signature length, must be a multiple of bands
+            bands: LSH bands; more bands find less similar candidates
+        """
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.exact = {}
+        self.signatures = {}
+        self.buckets = [{} for _ in range(bands)]
+        self.stored = None
+
+    def __len__(self):
+        stored = int(self.stored["alive"].sum()) if self.stored is not None else 0
+        return stored + len(self.signatures)
+
+    def _band_keys(self, signature):
+        return band_keys(signature[np.newaxis], self.bands)[0].tolist()
+
+    def add(self, chunk_id, text_hash, signature):
+        """Register a canonical chunk"""
+        chunk_id = int(chunk_id)
+        self.exact.setdefault(int(text_hash), chunk_id)
+        self.signatures[chunk_id] = signature
+        for bucket, key in zip(self.buckets, self._band_keys(signature)):
+            bucket.setdefault(key, []).append(chunk_id)
+
+    def add_many(self, ids, text_hashes, signatures):
+        for chunk_id, hash_value, signature in zip(ids, text_hashes, signatures):
+            self.add(chunk_id, hash_value, signature)
+
+    def add_stored(self, ids, text_hashes, signatures, tables=None, exclude_ids=None):
+        """
+        Register the chunks of a store as canonical, before any add()
+
+        Args:
+            ids: Sorted chunk IDs, one per store row
+            text_hashes, signatures: Fingerprints of the rows
+            tables: (keys, rows) saved with the store, or None to sort them here
+            exclude_ids: IDs of rows that are being removed
+        """
+        if self.stored is not None or self.signatures:
+            raise ValueError("add_stored() must come before any other chunks")
+        if tables is None or len(tables[0]) != self.bands + 1:
+            tables = lookup_tables(text_hashes, signatures, self.bands)
+        alive = np.ones(len(ids), dtype=bool)
+        if exclude_ids is not None and len(exclude_ids):
+            alive[np.isin(ids, exclude_ids)] = False
+        self.stored = {"ids": ids, "signatures": signatures, "keys": tables[0], "rows": tables[1], "alive": alive}
+
+    def _stored_rows(self, table, key):
+        """Live store rows whose key in a table matches, in row order"""
+        keys = self.stored["keys"][table]
+        start = int(np.searchsorted(keys, np.uint64(key), side='left'))
+        end = int(np.searchsorted(keys, np.uint64(key), side='right'))
+        rows = np.asarray(self.stored["rows"][table][start:end])
+        return rows[self.stored["alive"][rows]]
+
+    def find(self, text_hash, signature):
+        """
+        Canonical chunk a new chunk duplicates
+
+        Returns:
+            (chunk ID, "exact" or "near"), or (None, None) if the chunk is new
+        """
+        # Stored chunks were registered first, so they win ties
+        if self.stored is not None:
+            rows = self._stored_rows(0, text_hash)
+            if len(rows):
+                return int(self.stored["ids"][rows[0]]), "exact"
+        chunk_id = self.exact.get(int(text_hash))
+        if chunk_id is not None:
+            return chunk_id, "exact"
+
+        keys = self._band_keys(signature)
+        candidates = {}
+        if self.stored is not None:
+            for band, key in enumerate(keys, 1):
+                for row in self._stored_rows(band, key):
+                    candidates[int(self.stored["ids"][row])] = row
+        for bucket, key in zip(self.buckets, keys):
+            for candidate in bucket.get(key, ()):
+                candidates[candidate] = None
+        best, best_similarity = None, 0.0
+        for candidate in sorted(candidates):
+            row = candidates[candidate]
+            candidate_signature = self.signatures[candidate] if row is None else self.stored["signatures"][row]
+            similarity = np.count_nonzero(candidate_signature == signature) / self.num_perm
+            if similarity >= self.threshold and similarity > best_similarity:
+                best, best_similarity = candidate, similarity
+        if best is None:
+            return None, None
+        return best, "near"
@@ -1,119 +1,952 @@
 import os
-import pickle
+import json
+import zlib
+import hashlib
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from typing import List, Dict, Any, Union
-from sentence_transformers import SentenceTransformer
 import faiss
 import glob
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import DirectoryLoader, TextLoader
-from langchain_community.document_loaders.pdf import PyPDFLoader
-from langchain.docstore.document import Document
+from utils import index_factory
+from utils.embeddings import create_embedding_backend
+from utils.chunk_store import (
+    ChunkStore, ChunkStoreWriter, read_index, write_index, index_exists, fork_build, publish_build,
+    BUILD_INDEX_FILE, BUILD_BM25_DIR
+)
+from utils.bm25 import BM25Builder, BM25Index, bm25_exists
+from utils.dedup import MinHasher, DuplicateIndex, DEFAULT_THRESHOLD
+from utils.text_cache import TextCache, PDF_EXTRACTORS
+from utils import metrics
+
+MANIFEST_VERSION = 1
+
+_splitters = {}
+
+
+def load_file(file_path):
+    """Load the pages of a single text or PDF file"""
+    # LangChain is imported on first use, so importing this module stays cheap
+    from langchain_community.document_loaders import TextLoader
+    from langchain_community.document_loaders.pdf import PyPDFLoader
+
+    if file_path.lower().endswith(".pdf"):
+        loader = PyPDFLoader(file_path)
+    else:
+        loader = TextLoader(file_path)
+    return loader.load()
+
+
+def extract_pages(file_path, pdf_extractor="pypdf"):
+    """
+    Text and metadata of each page of a text or PDF file
+
+    Args:
+        file_path: File to extract
+        pdf_extractor: "pypdf" (through LangChain's PyPDFLoader) or "pymupdf",
+            which is several times faster on large PDFs (needs PyMuPDF)
+
+    Returns:
+        A list of (text, metadata) tuples
+    """
+    if pdf_extractor == "pymupdf" and file_path.lower().endswith(".pdf"):
+        import pymupdf
+        with pymupdf.open(file_path) as pdf:
+            return [(page.get_text(), {"source": file_path, "page": number}) for number, page in enumerate(pdf)]
+    return [(doc.page_content, doc.metadata) for doc in load_file(file_path)]
+
+
+def parse_file(file_path, chunk_size, chunk_overlap, pdf_extractor="pypdf", text_cache_dir=None, file_hash=None):
+    """
+    Extract and split one file; runs inside ingestion worker processes
+
+    PDF text is read from the text cache when text_cache_dir and the file's
+    SHA-256 are given, and stored there after a fresh extraction.
+
+    Returns:
+        (chunks, cached): the (text, metadata) tuples of the chunks, which
+        pickle more cheaply than Documents, and whether the text came from
+        the cache (None when the cache was not used)
+    """
+    pages, cached, cache = None, None, None
+    if text_cache_dir is not None and file_hash is not None and file_path.lower().endswith(".pdf"):
+        cache = TextCache(text_cache_dir)
+        pages = cache.get(file_hash, pdf_extractor)
+        cached = pages is not None
+    if pages is None:
+        pages = extract_pages(file_path, pdf_extractor)
+        if cache is not None:
+            cache.put(file_hash, pdf_extractor, pages)
+    else:
+        # Entries are shared by files with the same contents
+        pages = [(text, dict(meta, source=file_path)) for text, meta in pages]
+
+    key = (chunk_size, chunk_overlap)
+    if key not in _splitters:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        # start_index lets the context packer merge overlapping neighbours
+        _splitters[key] = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            add_start_index=True
+        )
+    chunks = _splitters[key].create_documents([text for text, _ in pages], [meta for _, meta in pages])
+    return [(chunk.page_content, chunk.metadata) for chunk in chunks], cached
+
+
+def shard_for_file(file_path, data_dir, n_shards):
+    """
+    Shard a source file belongs to
+
+    Hashes the path relative to the data directory with CRC-32, so the
+    assignment is the same in every process and on every machine, and a
+    file's chunks always stay together in one shard.
+    """
+    key = os.path.relpath(file_path, data_dir).replace(os.sep, "/")
+    return zlib.crc32(key.encode('utf-8')) % n_shards
+
 
 class DocumentProcessor:
-    def __init__(self, data_dir: str, model_name: str = "all-MiniLM-L6-v2"):
+    def __init__(
+        self,
+        data_dir: str,
+        model_name: str = "all-MiniLM-L6-v2",
+        index_file: str = "faiss_index.faiss",
+        data_file: str = "documents_data",
+        manifest_file: str = "index_manifest.json",
+        index_type: str = "flat",
+        index_params: Dict[str, Any] = None,
+        embed_batch_size: int = 256,
+        workers: int = None,
+        embedding_backend: str = "sentence-transformers",
+        embedding_options: Dict[str, Any] = None,
+        bm25_file: str = "bm25_index",
+        shard: tuple = None,
+        dedup: bool = True,
+        dedup_threshold: float = DEFAULT_THRESHOLD,
+        chunk_size: int = 1000,
+        chunk_overlap: int = 200,
+        pdf_extractor: str = "pypdf",
+        text_cache_dir: str = "text_cache"
+    ):
         """
         Initialize the document processor with a data directory and embedding model
-        
+
         Args:
             data_dir: Directory containing documents to process
             model_name: Name of the SentenceTransformer model to use for embeddings
+            index_file: Path of the FAISS index of a chunk store in the old layout;
+                new builds keep the index in data_file (see utils.chunk_store)
+            data_file: Directory the memory-mapped chunk store and its indexes are saved to
+            manifest_file: Path of the per-file hash manifest used for incremental updates
+            index_type: FAISS index type: "flat", "ivf_flat", "ivf_pq" or "hnsw"
+            index_params: Overrides for utils.index_factory.DEFAULT_INDEX_PARAMS
+            embed_batch_size: Chunks embedded and written per batch
+            workers: Processes used to parse files (defaults to the CPU count)
+            embedding_backend: "sentence-transformers" or "onnx" (see utils.embeddings)
+            embedding_options: Backend options such as batch_size, num_threads or quantize
+            bm25_file: Directory of the BM25 keyword index of a chunk store in the
+                old layout (None to build no BM25 index); new builds keep it in data_file
+            shard: (shard number, shard count) to only index the files whose
+                stable hash routes them to this shard (see utils.sharding)
+            dedup: Store and embed exact and near-duplicate chunks only once
+                (see utils.dedup); with shards, duplicates are found per shard
+            dedup_threshold: Estimated Jaccard similarity from which chunks are near duplicates
+            chunk_size: Characters per chunk
+            chunk_overlap: Characters repeated between neighbouring chunks
+            pdf_extractor: "pypdf" or "pymupdf" (faster, needs PyMuPDF)
+            text_cache_dir: Directory of the extracted-text cache (see
+                utils.text_cache), shared by all indexes; None to disable it
         """
+        if pdf_extractor not in PDF_EXTRACTORS:
+            raise ValueError(f"Unknown PDF extractor {pdf_extractor!r}, expected one of {sorted(PDF_EXTRACTORS)}")
         self.data_dir = data_dir
-        self.model = SentenceTransformer(model_name)
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200
-        )
-    
-    def load_documents(self):
-        """Load documents from the data directory"""
-        documents = []
-        
-        # Load text files
+        self.index_file = index_file
+        self.data_file = data_file
+        self.manifest_file = manifest_file
+        self.bm25_file = bm25_file
+        self.shard = shard
+        self.index_type = index_type
+        self.index_params = index_factory.index_params(**(index_params or {}))
+        self.embed_batch_size = embed_batch_size
+        self.workers = workers or os.cpu_count() or 1
+        self.model_name = model_name
+        self.embedding_backend = embedding_backend
+        self.embedding_options = embedding_options or {}
+        self._model = None
+        self.dedup = dedup
+        self.dedup_threshold = dedup_threshold
+        self.build_stats = {}
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.pdf_extractor = pdf_extractor
+        self.text_cache_dir = text_cache_dir
+        self.cache_stats = {}
+        self._text_splitter = None
+
+    @property
+    def text_splitter(self):
+        """Text splitter, created (and LangChain imported) on first use"""
+        if self._text_splitter is None:
+            from langchain.text_splitter import RecursiveCharacterTextSplitter
+            self._text_splitter = RecursiveCharacterTextSplitter(
+                chunk_size=self.chunk_size,
+                chunk_overlap=self.chunk_overlap,
+                add_start_index=True
+            )
+        return self._text_splitter
+
+    @property
+    def model(self):
+        """Embedding backend, loaded on first use so index maintenance stays cheap"""
+        if self._model is None:
+            self._model = create_embedding_backend(self.embedding_backend, self.model_name, **self.embedding_options)
+        return self._model
+
+    def list_source_files(self):
+        """List the text and PDF files that make up the corpus"""
         txt_files = glob.glob(os.path.join(self.data_dir, "**/*.txt"), recursive=True)
-        for file_path in txt_files:
-            loader = TextLoader(file_path)
-            documents.extend(loader.load())
-        
-        # Load PDF files from data directory
         pdf_files_in_data = glob.glob(os.path.join(self.data_dir, "**/*.pdf"), recursive=True)
-        for file_path in pdf_files_in_data:
-            loader = PyPDFLoader(file_path)
-            documents.extend(loader.load())
-            
+
         # Also check for PDF files in the main directory (one level up)
         main_dir = os.path.dirname(self.data_dir)
         pdf_files_in_main = glob.glob(os.path.join(main_dir, "*.pdf"))
-        for file_path in pdf_files_in_main:
-            loader = PyPDFLoader(file_path)
-            documents.extend(loader.load())
-        
-        print(f"Loaded {len(documents)} document pages from {len(txt_files)} text files and {len(pdf_files_in_data) + len(pdf_files_in_main)} PDF files")
+
+        files = txt_files + pdf_files_in_data + pdf_files_in_main
+        if self.shard is not None:
+            number, count = self.shard
+            files = [path for path in files if shard_for_file(path, self.data_dir, count) == number]
+        return files
+
+    def load_file(self, file_path):
+        """Load the pages of a single text or PDF file"""
+        return load_file(file_path)
+
+    def count_cache(self, stage, hits, misses=0):
+        """Record cache hits and misses of an ingestion stage in cache_stats and the metrics"""
+        counts = self.cache_stats.setdefault(stage, {"hits": 0, "misses": 0})
+        counts["hits"] += hits
+        counts["misses"] += misses
+        if hits:
+            metrics.INGEST_CACHE_LOOKUPS.labels(stage, "hit").inc(hits)
+        if misses:
+            metrics.INGEST_CACHE_LOOKUPS.labels(stage, "miss").inc(misses)
+
+    def cache_hit_rates(self):
+        """Hit rate of each ingestion stage's cache in the last run: {stage: rate or None}"""
+        return {
+            stage: counts["hits"] / (counts["hits"] + counts["misses"]) if counts["hits"] + counts["misses"] else None
+            for stage, counts in self.cache_stats.items()
+        }
+
+    def iter_parsed_files(self, file_paths, file_hashes=None):
+        """
+        Parse and split files in a process pool
+
+        At most two files per worker are in flight, so memory stays bounded no
+        matter how many files there are. PDFs whose SHA-256 is given in
+        file_hashes go through the text cache, counted under the "extract"
+        stage of cache_stats.
+
+        Yields:
+            (file_path, [(text, metadata), ...]) in completion order
+        """
+        file_hashes = file_hashes or {}
+        text_cache_dir = self.text_cache_dir
+
+        def args(file_path):
+            return (file_path, self.chunk_size, self.chunk_overlap, self.pdf_extractor,
+                    text_cache_dir, file_hashes.get(file_path))
+
+        def result(chunks, cached):
+            if cached is not None:
+                self.count_cache("extract", int(cached), int(not cached))
+            return chunks
+
+        workers = min(self.workers, len(file_paths))
+
+        if workers <= 1:
+            for file_path in file_paths:
+                yield file_path, result(*parse_file(*args(file_path)))
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            remaining = iter(file_paths)
+            pending = {}
+
+            def submit_next():
+                file_path = next(remaining, None)
+                if file_path is not None:
+                    pending[executor.submit(parse_file, *args(file_path))] = file_path
+
+            for _ in range(2 * workers):
+                submit_next()
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file_path = pending.pop(future)
+                    yield file_path, result(*future.result())
+                    submit_next()
+
+    def load_documents(self, file_paths=None):
+        """
+        Load documents from the data directory
+
+        Args:
+            file_paths: Optional list of files to load instead of the whole corpus
+        """
+        if file_paths is None:
+            file_paths = self.list_source_files()
+
+        documents = []
+        for file_path in file_paths:
+            documents.extend(self.load_file(file_path))
+
+        num_pdfs = sum(1 for path in file_paths if path.lower().endswith(".pdf"))
+        print(f"Loaded {len(documents)} document pages from {len(file_paths) - num_pdfs} text files and {num_pdfs} PDF files")
         return documents
-    
+
     def split_documents(self, documents):
         """Split documents into chunks"""
         chunks = self.text_splitter.split_documents(documents)
         print(f"Split into {len(chunks)} chunks")
         return chunks
-    
+
+    def embed_texts(self, texts):
+        """Embed a batch of texts as a float32 matrix"""
+        return self.model.encode(texts)
+
     def create_embeddings(self, chunks):
         """Create embeddings for document chunks"""
         texts = [doc.page_content for doc in chunks]
         metadata = [doc.metadata for doc in chunks]
-        
+
         # Create embeddings
-        embeddings = self.model.encode(texts)
-        
+        embeddings = self.embed_texts(texts)
+
         return {
             "texts": texts,
             "embeddings": embeddings,
             "metadata": metadata
         }
-    
-    def build_faiss_index(self, embeddings):
-        """Build a FAISS index from embeddings"""
+
+    def build_faiss_index(self, embeddings, ids=None):
+        """
+        Build a FAISS index of the configured type from embeddings
+
+        Indexes keep stable chunk IDs so vectors can later be removed without
+        rebuilding. IVF types are trained on the embeddings when there are
+        enough of them, otherwise an exact flat index is built.
+
+        Args:
+            embeddings: Embedding matrix, one row per chunk
+            ids: Chunk IDs for the rows (defaults to 0..n-1)
+        """
         # Convert embeddings to float32 numpy array
         embedding_array = np.array(embeddings).astype('float32')
-        
-        # Get the dimensionality
-        dimension = embedding_array.shape[1]
-        
-        # Create FAISS index
-        index = faiss.IndexFlatL2(dimension)
-        
-        # Add vectors to the index
-        index.add(embedding_array)
-        
-        return index
-    
-    def save_index_and_data(self, index, data, index_file="faiss_index.pkl", data_file="documents_data.pkl"):
-        """Save the FAISS index and document data to disk"""
-        # Save the FAISS index
-        with open(index_file, 'wb') as f:
-            pickle.dump(index, f)
-        
-        # Save the document data
-        with open(data_file, 'wb') as f:
-            pickle.dump(data, f)
-        
-        print(f"Saved index to {index_file} and data to {data_file}")
-    
-    def process_documents(self):
-        """Process documents from loading to saving the index"""
-        documents = self.load_documents()
-        chunks = self.split_documents(documents)
-        data = self.create_embeddings(chunks)
-        index = self.build_faiss_index(data["embeddings"])
-        
-        self.save_index_and_data(
-            index, 
-            {
-                "texts": data["texts"],
-                "metadata": data["metadata"],
-                "embeddings": data["embeddings"]
+
+        if ids is None:
+            ids = np.arange(len(embedding_array), dtype='int64')
+
+        return index_factory.build_index(embedding_array, ids, self.index_type, self.index_params)
+
+    def build_index_from_store(self, store):
+        """Rebuild the index from the stored embeddings, without re-embedding"""
+        builder = index_factory.IndexBuilder(store.dimension, self.index_type, self.index_params)
+        for start in range(0, len(store), 65536):
+            end = min(start + 65536, len(store))
+            builder.add(np.asarray(store.embeddings[start:end]), np.asarray(store.ids[start:end]))
+        return builder.finalize()
+
+    def needs_index_rebuild(self, index, store):
+        """
+        Whether the index must be rebuilt from the store after an update
+
+        True when the configured type changed, when a flat fallback index has
+        grown large enough to train the configured type, or when the index
+        cannot delete vectors in place (HNSW).
+        """
+        kind = index_factory.index_kind(index)
+        if kind == "hnsw" and self.index_type == "hnsw":
+            return len(store) != index.ntotal
+        if kind != self.index_type:
+            return len(store) >= index_factory.training_size(self.index_type, self.index_params)
+        return False
+
+    def needs_bm25_rebuild(self, store):
+        """Whether the BM25 index is missing or belongs to another store build"""
+        if self.bm25_file is None:
+            return False
+        bm25_file = store.bm25_file or self.bm25_file
+        if not bm25_exists(bm25_file):
+            return True
+        return BM25Index(bm25_file).build_id != store.build_id
+
+    def copy_bm25(self, store, builder, stale_ids):
+        """
+        Add the rows of store, except stale_ids, to a BM25Builder
+
+        The postings of the store's own BM25 index are copied when it has
+        them; otherwise the texts are tokenized again.
+        """
+        if self.bm25_file is None:
+            return
+        bm25_file = store.bm25_file or self.bm25_file
+        if bm25_exists(bm25_file):
+            index = BM25Index(bm25_file)
+            if index.build_id == store.build_id and builder.add_index(index, stale_ids):
+                return
+        for batch in store.iter_batches(exclude_ids=stale_ids):
+            builder.add(batch["ids"], batch["texts"])
+
+    def build_bm25_from_store(self, store, bm25_file):
+        """Rebuild the BM25 index from the stored texts into bm25_file"""
+        builder = BM25Builder()
+        for start in range(0, len(store), 4096):
+            rows = range(start, min(start + 4096, len(store)))
+            builder.add(np.asarray(store.ids[start:rows.stop]), [store.text(row) for row in rows])
+        builder.save(bm25_file, store.build_id)
+
+    def save_index(self, index, index_file):
+        """Save the FAISS index into an unpublished build, in FAISS's native format"""
+        write_index(index, index_file)
+        print(f"Saved index to {index_file}")
+
+    def load_index(self, store):
+        """Load the FAISS index published with a store into memory so it can be modified"""
+        return read_index(store.index_file or self.index_file, mmap_index=False)
+
+    def index_exists(self):
+        """Whether a chunk store and its index have been published"""
+        return index_exists(self.index_file, self.data_file)
+
+    def publish(self, build_path):
+        """Publish a finished build (store, index and BM25 index) and drop old-layout files"""
+        publish_build(self.data_file, build_path, legacy_files=(self.index_file, self.bm25_file))
+
+    def index_settings(self):
+        """Settings that change the stored chunks or their embeddings; changing any re-indexes every file"""
+        return {
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "model_name": self.model_name,
+            "pdf_extractor": self.pdf_extractor
+        }
+
+    def load_manifest(self):
+        """Load the file manifest, or None if there is no usable one"""
+        if not os.path.exists(self.manifest_file):
+            return None
+        with open(self.manifest_file, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get("version") != MANIFEST_VERSION:
+            return None
+        return manifest
+
+    def save_manifest(self, manifest):
+        """Write the file manifest atomically"""
+        tmp_file = self.manifest_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_file, self.manifest_file)
+
+    @staticmethod
+    def file_key(file_path):
+        """Normalized key identifying a file in the manifest"""
+        return os.path.normcase(os.path.abspath(file_path))
+
+    @staticmethod
+    def hash_file(file_path):
+        """SHA-256 of a file's contents"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def diff_files(self, manifest, file_paths):
+        """
+        Compare the files on disk against the manifest
+
+        Files whose size and mtime are unchanged are trusted without hashing;
+        otherwise the content hash decides whether a file really changed.
+
+        Returns:
+            A dictionary with "added", "changed", "removed" and "unchanged" file
+            keys, plus a "stats" dict of fresh fingerprints for files on disk
+        """
+        known = manifest["files"] if manifest else {}
+        diff = {"added": [], "changed": [], "removed": [], "unchanged": [], "stats": {}}
+
+        on_disk = {}
+        for file_path in file_paths:
+            on_disk[self.file_key(file_path)] = file_path
+
+        for key, file_path in on_disk.items():
+            stat = os.stat(file_path)
+            entry = known.get(key)
+            if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+                diff["unchanged"].append(key)
+                continue
+
+            fingerprint = {
+                "path": file_path,
+                "sha256": self.hash_file(file_path),
+                "size": stat.st_size,
+                "mtime": stat.st_mtime
             }
+            diff["stats"][key] = fingerprint
+            if entry is None:
+                diff["added"].append(key)
+            elif entry["sha256"] == fingerprint["sha256"]:
+                # Touched but identical content: refresh the fingerprint only
+                diff["unchanged"].append(key)
+            else:
+                diff["changed"].append(key)
+
+        diff["removed"] = [key for key in known if key not in on_disk]
+        return diff
+
+    @staticmethod
+    def ids_from_ranges(id_ranges):
+        """Expand [[start, end), ...] ranges into an ID array"""
+        if not id_ranges:
+            return np.empty(0, dtype='int64')
+        return np.concatenate([np.arange(start, end, dtype='int64') for start, end in id_ranges])
+
+    def write_store(self, old_store, stale_ids, new_batches, stale_sources=()):
+        """
+        Write a new chunk store: surviving rows of old_store followed by new_batches
+
+        Args:
+            old_store: The current ChunkStore, or None
+            stale_ids: IDs of old_store rows to drop
+            new_batches: Iterable of dicts with "ids", "texts", "metadata", "embeddings"
+            stale_sources: Sources of the removed files
+
+        The BM25 index is rebuilt from the same rows. Duplicate sources of
+        surviving rows are kept, except those of stale_sources.
+
+        Returns:
+            The closed ChunkStoreWriter; its build is published once the
+            FAISS index has been saved to its index_file
+        """
+        writer = ChunkStoreWriter(self.data_file)
+        bm25 = BM25Builder()
+        try:
+            if old_store is not None:
+                writer.append_store(old_store, stale_ids)
+                self.copy_bm25(old_store, bm25, stale_ids)
+            for batch in new_batches:
+                writer.append(
+                    batch["ids"], batch["texts"], batch["metadata"], batch["embeddings"],
+                    batch.get("text_hashes"), batch.get("minhashes")
+                )
+                if self.bm25_file is not None:
+                    bm25.add(batch["ids"], batch["texts"])
+            if old_store is not None:
+                self.carry_duplicates(old_store, writer, stale_ids, set(stale_sources))
+        except Exception:
+            writer.abort()
+            raise
+        writer.close()
+        print(f"Saved {writer.count} chunks to {self.data_file}")
+        if self.bm25_file is not None:
+            bm25.save(writer.bm25_file, writer.build_id)
+        return writer
+
+    @staticmethod
+    def carry_duplicates(old_store, writer, stale_ids, stale_sources):
+        """Copy the duplicate sources of surviving rows, dropping those from stale files"""
+        stale_ids = set(np.asarray(stale_ids, dtype='int64').tolist())
+        for chunk_id, entries in old_store.duplicate_sources().items():
+            if chunk_id in stale_ids:
+                continue
+            for entry in entries:
+                if entry["source"] not in stale_sources:
+                    writer.add_duplicate(chunk_id, entry["source"], entry.get("page"))
+
+    def add_dependent_files(self, manifest, diff):
+        """
+        Treat unchanged files as changed when their chunks were deduplicated
+        against chunks of changed or removed files
+
+        Those chunks were never stored themselves, so the files are parsed
+        again; repeated until no more files depend on stale chunks.
+
+        Returns:
+            The number of files added to diff["changed"]
+        """
+        stale = set()
+        for key in diff["changed"] + diff["removed"]:
+            stale.update(self.ids_from_ranges(manifest["files"][key]["id_ranges"]).tolist())
+
+        added = 0
+        while stale:
+            dependents = [
+                key for key in diff["unchanged"]
+                if not stale.isdisjoint(manifest["files"][key].get("duplicate_ids", ()))
+            ]
+            stale = set()
+            for key in dependents:
+                entry = manifest["files"][key]
+                diff["unchanged"].remove(key)
+                diff["changed"].append(key)
+                diff["stats"].setdefault(key, {
+                    "path": entry["path"], "sha256": entry["sha256"], "size": entry["size"], "mtime": entry["mtime"]
+                })
+                stale.update(self.ids_from_ranges(entry["id_ranges"]).tolist())
+                added += 1
+        return added
+
+    def process_documents(self, incremental=True, progress=None):
+        """
+        Process documents from loading to saving the index
+
+        With a manifest from a previous run only added or changed files are
+        parsed and embedded; vectors of changed or deleted files are removed
+        from the existing index by ID. A BM25 keyword index over the same
+        chunks is written alongside, and the three are published together as
+        one new build (see utils.chunk_store.publish_build).
+
+        With dedup on, each new chunk is fingerprinted first: a chunk whose
+        content (exactly or nearly) matches a chunk already in the index is
+        not embedded or stored again, its source is added to the matching
+        chunk's duplicate sources instead. The share of parsed chunks dropped
+        this way is printed, kept in build_stats and exported as a metric.
+
+        Files are only re-indexed from scratch when index_settings() differ
+        from the manifest's. PDF text then comes from the text cache, so only
+        chunking and embedding are redone. Hit rates of the "files"
+        (unchanged files), "extract" (text cache) and "embed" (stored
+        embeddings reused) stages are printed and kept in cache_stats.
+
+        Args:
+            incremental: Reuse the existing index and manifest when possible
+            progress: Optional callback progress(stage, current=None, total=None)
+                called with the stages "scanning", "copying" (kept chunks),
+                "loading" (files), "embedding" (chunks embedded / parsed so far),
+                "writing" and "done"
+
+        Time spent per stage is recorded in utils.metrics under the "ingest"
+        pipeline.
+
+        Returns:
+            The FAISS index and the ChunkStore it was saved with
+        """
+        progress = progress or (lambda stage, current=None, total=None: None)
+        self.cache_stats, self.build_stats = {}, {}
+        settings = self.index_settings()
+
+        progress("scanning")
+        with metrics.stage("ingest", "scan"):
+            file_paths = self.list_source_files()
+            manifest = self.load_manifest() if incremental else None
+            if manifest is not None and manifest.get("settings", settings) != settings:
+                changed = sorted(name for name in settings if manifest["settings"].get(name) != settings[name])
+                print(f"Index settings changed ({', '.join(changed)}): re-indexing every file")
+                manifest = None
+
+            index, store = None, None
+            if manifest is not None and self.index_exists():
+                store = ChunkStore(self.data_file)
+                index = self.load_index(store)
+
+            if manifest is None:
+                manifest = {"version": MANIFEST_VERSION, "next_id": 0, "files": {}}
+            manifest["settings"] = settings
+
+            diff = self.diff_files(manifest, file_paths)
+
+        # Refresh fingerprints of touched-but-identical files
+        for key in diff["unchanged"]:
+            if key in diff["stats"]:
+                stats = diff["stats"][key]
+                manifest["files"][key].update(size=stats["size"], mtime=stats["mtime"], path=stats["path"])
+
+        if index is not None and not (diff["added"] or diff["changed"] or diff["removed"]):
+            rebuild_index, rebuild_bm25 = self.needs_index_rebuild(index, store), self.needs_bm25_rebuild(store)
+            if rebuild_index or rebuild_bm25:
+                # Publish the new index in a new build that shares the store's files
+                build_path = fork_build(store, self.data_file, self.index_file, self.bm25_file)
+                if rebuild_index:
+                    print(f"Rebuilding {self.index_type} index from {len(store)} stored embeddings...")
+                    index = self.build_index_from_store(store)
+                    self.save_index(index, os.path.join(build_path, BUILD_INDEX_FILE))
+                if rebuild_bm25:
+                    print(f"Building BM25 index from {len(store)} stored chunks...")
+                    self.build_bm25_from_store(store, os.path.join(build_path, BUILD_BM25_DIR))
+                self.publish(build_path)
+                store.close()
+                store = ChunkStore(self.data_file)
+            self.save_manifest(manifest)
+            self.count_cache("files", len(diff["unchanged"]))
+            self.count_cache("embed", len(store))
+            self.build_stats = {"cache_hit_rates": self.cache_hit_rates()}
+            progress("done", len(store), len(store))
+            print(f"Index is up to date ({len(store)} chunks, {index_factory.describe_index(index)})")
+            return index, store
+
+        dependents = self.add_dependent_files(manifest, diff) if index is not None else 0
+        print(
+            f"Files: {len(diff['added'])} added, {len(diff['changed'])} changed, "
+            f"{len(diff['removed'])} removed, {len(diff['unchanged'])} unchanged"
+            + (f" ({dependents} re-parsed because their duplicates' originals changed)" if dependents else "")
+        )
+        self.count_cache("files", len(diff["unchanged"]), len(diff["added"]) + len(diff["changed"]))
+
+        # Drop the vectors of changed and removed files
+        stale_ids = np.empty(0, dtype='int64')
+        stale_sources = {manifest["files"][key]["path"] for key in diff["changed"] + diff["removed"]}
+        if index is not None:
+            stale_ids = np.concatenate([stale_ids] + [
+                self.ids_from_ranges(manifest["files"][key]["id_ranges"])
+                for key in diff["changed"] + diff["removed"]
+            ])
+            if len(stale_ids) and index_factory.supports_removal(index):
+                index.remove_ids(stale_ids)
+        for key in diff["removed"]:
+            del manifest["files"][key]
+
+        # Stream the new content through the pipeline: files are parsed in a
+        # process pool, chunks are embedded in bounded batches, and each batch
+        # goes straight into the index and the new chunk store
+        new_files = {diff["stats"][key]["path"]: key for key in diff["added"] + diff["changed"]}
+        writer = ChunkStoreWriter(self.data_file)
+        bm25 = BM25Builder()
+        builder = None
+        pending = []
+        counts = {"chunks_parsed": 0, "chunks_embedded": 0, "duplicates_exact": 0, "duplicates_near": 0}
+        hasher = MinHasher() if self.dedup else None
+        duplicates = DuplicateIndex(self.dedup_threshold, hasher.num_perm) if self.dedup else None
+
+        def flush(batch):
+            nonlocal builder
+            ids = np.array([chunk[0] for chunk in batch], dtype='int64')
+            texts = [chunk[1] for chunk in batch]
+            metadata = [chunk[2] for chunk in batch]
+            text_hashes = minhashes = None
+            if hasher is not None:
+                text_hashes = np.array([chunk[3] for chunk in batch], dtype='uint64')
+                minhashes = np.stack([chunk[4] for chunk in batch])
+            with metrics.stage("ingest", "embed"):
+                embeddings = self.embed_texts(texts)
+            with metrics.stage("ingest", "index_add"):
+                if index is None:
+                    if builder is None:
+                        builder = index_factory.IndexBuilder(embeddings.shape[1], self.index_type, self.index_params)
+                    builder.add(embeddings, ids)
+                else:
+                    index.add_with_ids(embeddings, ids)
+            with metrics.stage("ingest", "store_write"):
+                writer.append(ids, texts, metadata, embeddings, text_hashes, minhashes)
+                if self.bm25_file is not None:
+                    bm25.add(ids, texts)
+            metrics.INGESTED_CHUNKS.inc(len(batch))
+            self.count_cache("embed", 0, len(batch))
+            counts["chunks_embedded"] += len(batch)
+            progress("embedding", counts["chunks_embedded"], counts["chunks_parsed"])
+
+        try:
+            # Surviving rows come first: their IDs are all below next_id
+            if store is not None:
+                progress("copying", 0, len(store))
+                with metrics.stage("ingest", "copy"):
+                    if hasher is None or (store.minhashes is not None and store.minhashes.shape[1] == hasher.num_perm):
+                        # Rows are copied as byte ranges and stored chunks are
+                        # looked up in the store's dedup tables: no Python
+                        # work per surviving chunk
+                        self.count_cache("embed", writer.append_store(store, stale_ids, fingerprints=hasher is not None))
+                        if hasher is not None:
+                            tables = (store.lsh_keys, store.lsh_rows) if store.lsh_keys is not None else None
+                            duplicates.add_stored(store.ids, store.text_hashes, store.minhashes, tables, stale_ids)
+                    else:
+                        # Stores written without dedup get their fingerprints computed once here
+                        for batch in store.iter_batches(exclude_ids=stale_ids):
+                            text_hashes, minhashes = hasher.fingerprints(batch["texts"])
+                            duplicates.add_many(batch["ids"], text_hashes, minhashes)
+                            writer.append(
+                                batch["ids"], batch["texts"], batch["metadata"], batch["embeddings"],
+                                text_hashes, minhashes
+                            )
+                            self.count_cache("embed", len(batch["ids"]))
+                    self.copy_bm25(store, bm25, stale_ids)
+                    self.carry_duplicates(store, writer, stale_ids, stale_sources)
+
+            progress("loading", 0, len(new_files))
+            file_hashes = {path: diff["stats"][key]["sha256"] for path, key in new_files.items()}
+            parsed_files = metrics.timed_iter(self.iter_parsed_files(list(new_files), file_hashes), "ingest", "parse")
+            for files_done, (file_path, chunks) in enumerate(parsed_files, 1):
+                metrics.INGESTED_FILES.inc()
+                key = new_files[file_path]
+                stats = diff["stats"][key]
+
+                # Each file gets a contiguous ID range, in completion order
+                start = manifest["next_id"]
+                end = start + len(chunks)
+                manifest["next_id"] = end
+                manifest["files"][key] = {
+                    "path": stats["path"],
+                    "sha256": stats["sha256"],
+                    "size": stats["size"],
+                    "mtime": stats["mtime"],
+                    "id_ranges": [[start, end]] if end > start else []
+                }
+                # The file's modification time is when it was uploaded into the data directory
+                file_chunks = [
+                    (chunk_id, text, dict(meta, uploaded_at=stats["mtime"]))
+                    for chunk_id, (text, meta) in zip(range(start, end), chunks)
+                ]
+                if hasher is None:
+                    pending.extend(file_chunks)
+                else:
+                    with metrics.stage("ingest", "dedup"):
+                        text_hashes, minhashes = hasher.fingerprints([text for _, text, _ in file_chunks])
+                        duplicate_ids = set()
+                        for (chunk_id, text, meta), text_hash, minhash in zip(file_chunks, text_hashes, minhashes):
+                            canonical, kind = duplicates.find(text_hash, minhash)
+                            if canonical is None:
+                                duplicates.add(chunk_id, text_hash, minhash)
+                                pending.append((chunk_id, text, meta, text_hash, minhash))
+                                continue
+                            writer.add_duplicate(canonical, meta.get("source"), meta.get("page"))
+                            duplicate_ids.add(canonical)
+                            counts[f"duplicates_{kind}"] += 1
+                            metrics.DUPLICATE_CHUNKS.labels(kind).inc()
+                        if duplicate_ids:
+                            # Lets a later update re-parse this file when those chunks go stale
+                            manifest["files"][key]["duplicate_ids"] = sorted(duplicate_ids)
+                counts["chunks_parsed"] += len(chunks)
+                progress("loading", files_done, len(new_files))
+
+                while len(pending) >= self.embed_batch_size:
+                    flush(pending[:self.embed_batch_size])
+                    pending = pending[self.embed_batch_size:]
+
+            if pending:
+                flush(pending)
+
+            if builder is not None:
+                with metrics.stage("ingest", "index_add"):
+                    index = builder.finalize()
+            if index is None:
+                raise ValueError(f"No documents found to index in {self.data_dir}")
+        except BaseException:
+            writer.abort()
+            raise
+
+        print(f"Parsed {len(new_files)} files into {counts['chunks_parsed']} chunks")
+        duplicate_count = counts["duplicates_exact"] + counts["duplicates_near"]
+        counts["dedup_ratio"] = duplicate_count / counts["chunks_parsed"] if counts["chunks_parsed"] else 0.0
+        if hasher is not None:
+            metrics.DEDUP_RATIO.set(counts["dedup_ratio"])
+            print(
+                f"Dedup: {duplicate_count} of {counts['chunks_parsed']} chunks were duplicates "
+                f"({counts['dedup_ratio']:.1%}; {counts['duplicates_exact']} exact, "
+                f"{counts['duplicates_near']} near) and were not embedded"
+            )
+        print("Cache hit rates: " + ", ".join(
+            f"{stage} {rate:.1%} ({self.cache_stats[stage]['hits']}/"
+            f"{self.cache_stats[stage]['hits'] + self.cache_stats[stage]['misses']})"
+            for stage, rate in self.cache_hit_rates().items() if rate is not None
+        ))
+        counts["cache_hit_rates"] = self.cache_hit_rates()
+        self.build_stats = counts
+        progress("writing")
+        with metrics.stage("ingest", "write"):
+            writer.close()
+            print(f"Saved {writer.count} chunks to {self.data_file}")
+            if self.bm25_file is not None:
+                bm25.save(writer.bm25_file, writer.build_id)
+        if store is not None:
+            store.close()
+        store = ChunkStore(writer.path)
+
+        if self.needs_index_rebuild(index, store):
+            print(f"Rebuilding {self.index_type} index from {len(store)} stored embeddings...")
+            with metrics.stage("ingest", "index_rebuild"):
+                index = self.build_index_from_store(store)
+
+        with metrics.stage("ingest", "save"):
+            self.save_index(index, writer.index_file)
+            self.publish(writer.path)
+            self.save_manifest(manifest)
+        progress("done", len(store), len(store))
+        print(f"Index: {index_factory.describe_index(index)}")
+
+        return index, store
+
+    def remove_file(self, file_path):
+        """
+        Remove a single file's vectors from the saved index without a rebuild
+
+        If chunks of other files were deduplicated against this file's chunks,
+        those files need re-embedding, so an incremental process_documents()
+        runs instead; the file must already be gone from the data directory.
+
+        Chunks of the file that were deduplicated at ingestion were never
+        stored, so they are not counted as removed. The duplicate references
+        dropped from other files' chunks, the references of other files re-
+        pointed by parsing them again, and the number of those files are
+        counted separately in build_stats.
+
+        Returns:
+            The number of stored chunks removed
+        """
+        manifest = self.load_manifest()
+        key = self.file_key(file_path)
+        if manifest is None or key not in manifest["files"] or not self.index_exists():
+            return 0
+
+        entry = manifest["files"][key]
+        ids = self.ids_from_ranges(entry["id_ranges"])
+        store = ChunkStore(self.data_file)
+        stored_ids = ids[store.rows_for_ids(ids) >= 0]
+        own_ids = set(ids.tolist())
+        duplicate_sources = store.duplicate_sources()
+        # This file's duplicates of other files' chunks: dropped from those chunks' sources
+        dropped = sum(
+            1 for chunk_id, entries in duplicate_sources.items() if chunk_id not in own_ids
+            for duplicate in entries if duplicate["source"] == entry["path"]
+        )
+        # Other files' duplicates of this file's chunks: re-pointed by parsing those files again
+        repointed = sum(
+            1 for chunk_id in own_ids
+            for duplicate in duplicate_sources.get(chunk_id, ()) if duplicate["source"] != entry["path"]
+        )
+
+        others = [other for other in manifest["files"] if other != key]
+        dependents = self.add_dependent_files(manifest, {"changed": [], "removed": [key], "unchanged": others, "stats": {}})
+        if dependents:
+            # Other files' chunks were deduplicated against this file's, so
+            # they have to be embedded again: run a full incremental update
+            store.close()
+            self.process_documents()
+        else:
+            index = self.load_index(store)
+            if len(stored_ids) and index_factory.supports_removal(index):
+                index.remove_ids(stored_ids)
+            manifest["files"].pop(key)
+
+            writer = self.write_store(store, ids, [], stale_sources=[entry["path"]])
+            store.close()
+            store = ChunkStore(writer.path)
+            if self.needs_index_rebuild(index, store):
+                index = self.build_index_from_store(store)
+            store.close()
+            self.save_index(index, writer.index_file)
+            self.publish(writer.path)
+            self.save_manifest(manifest)
+
+        self.build_stats = {
+            "removed_chunks": len(stored_ids),
+            "dropped_references": dropped,
+            "repointed_references": repointed,
+            "reindexed_files": dependents
+        }
+        print(
+            f"Removed {len(stored_ids)} chunks of {key}; dropped {dropped} of its duplicate references "
+            f"to other files' chunks and re-pointed {repointed} references to its chunks "
+            f"by re-parsing {dependents} files"
         )
-        
-        return index, data
\ No newline at end of file
+        return len(stored_ids)
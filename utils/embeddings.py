@@ -0,0 +1,253 @@
+import os
+import threading
+import numpy as np
+from utils import metrics
+
+BACKENDS = ("sentence-transformers", "onnx")
+
+# Process-wide embedding models by (backend, model name, device, options)
+_shared_backends = {}
+_shared_backends_lock = threading.Lock()
+
+
+def huggingface_id(model_name):
+    """Full Hugging Face ID for short SentenceTransformer model names"""
+    return model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+
+
+class EmbeddingBackend:
+    """
+    Base class for embedding backends
+
+    Subclasses implement _encode_batch(); encode() sorts texts by length so each
+    batch holds texts of similar length and little compute is spent on padding,
+    then restores the original order.
+    """
+
+    name = None
+
+    def __init__(self, model_name, batch_size=64, num_threads=None):
+        """
+        Args:
+            model_name: SentenceTransformer model name
+            batch_size: Texts encoded per forward pass
+            num_threads: CPU threads used for inference (None keeps the library default)
+        """
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+
+    def _encode_batch(self, texts):
+        raise NotImplementedError
+
+    def encode(self, texts, batch_size=None):
+        """
+        Embed texts
+
+        Returns:
+            A float32 matrix with one row per text, in input order
+        """
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, self.dimension), dtype='float32')
+
+        batch_size = batch_size or self.batch_size
+        order = np.argsort([-len(text) for text in texts], kind='stable')
+        embeddings = np.empty((len(texts), self.dimension), dtype='float32')
+        for start in range(0, len(texts), batch_size):
+            rows = order[start:start + batch_size]
+            embeddings[rows] = self._encode_batch([texts[row] for row in rows])
+        return embeddings
+
+    @property
+    def dimension(self):
+        raise NotImplementedError
+
+
+class SentenceTransformerBackend(EmbeddingBackend):
+    """PyTorch inference through sentence-transformers"""
+
+    name = "sentence-transformers"
+
+    def __init__(self, model_name, batch_size=64, num_threads=None, device=None):
+        super().__init__(model_name, batch_size, num_threads)
+        with metrics.startup_step("sentence_transformers", "import"):
+            from sentence_transformers import SentenceTransformer
+
+        if num_threads:
+            import torch
+            torch.set_num_threads(num_threads)
+        with metrics.startup_step(f"embedding:{model_name}", "load"):
+            self.model = SentenceTransformer(model_name, device=device)
+
+    def _encode_batch(self, texts):
+        return self.model.encode(texts, batch_size=len(texts), convert_to_numpy=True, show_progress_bar=False)
+
+    @property
+    def dimension(self):
+        return self.model.get_sentence_embedding_dimension()
+
+
+class OnnxBackend(EmbeddingBackend):
+    """
+    ONNX Runtime inference, optionally with an int8-quantized model
+
+    The transformer is exported from Hugging Face once and cached under
+    cache_dir; pooling and normalization are done in NumPy to match the
+    sentence-transformers pipeline (mean pooling + L2 normalization for
+    all-MiniLM-L6-v2). Requires onnxruntime and transformers; exporting also
+    needs torch.
+    """
+
+    name = "onnx"
+
+    def __init__(
+        self,
+        model_name,
+        batch_size=64,
+        num_threads=None,
+        quantize=True,
+        cache_dir="onnx_models",
+        max_length=256,
+        normalize=True
+    ):
+        """
+        Args:
+            model_name: SentenceTransformer model name
+            batch_size: Texts encoded per forward pass
+            num_threads: ONNX Runtime intra-op threads
+            quantize: Use dynamic int8 quantization of the weights
+            cache_dir: Directory for exported models
+            max_length: Token limit per text (256 matches all-MiniLM-L6-v2)
+            normalize: L2-normalize embeddings like the sentence-transformers model
+        """
+        super().__init__(model_name, batch_size, num_threads)
+        with metrics.startup_step("onnxruntime", "import"):
+            import onnxruntime as ort
+            from transformers import AutoTokenizer
+
+        self.max_length = max_length
+        self.normalize = normalize
+        with metrics.startup_step(f"embedding:{model_name} (onnx)", "load"):
+            self.tokenizer = AutoTokenizer.from_pretrained(huggingface_id(model_name))
+
+            model_path = self.export(model_name, cache_dir, quantize)
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            if num_threads:
+                options.intra_op_num_threads = num_threads
+            self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {inp.name for inp in self.session.get_inputs()}
+        self._dimension = self.session.get_outputs()[0].shape[-1]
+
+    @staticmethod
+    def export(model_name, cache_dir="onnx_models", quantize=True):
+        """
+        Export (and quantize) a model to ONNX unless it is already cached
+
+        Returns:
+            Path of the ONNX file to load
+        """
+        model_dir = os.path.join(cache_dir, model_name.replace("/", "__"))
+        fp32_path = os.path.join(model_dir, "model.onnx")
+        int8_path = os.path.join(model_dir, "model.int8.onnx")
+
+        if not os.path.exists(fp32_path):
+            import torch
+            from transformers import AutoModel, AutoTokenizer
+
+            os.makedirs(model_dir, exist_ok=True)
+            tokenizer = AutoTokenizer.from_pretrained(huggingface_id(model_name))
+            model = AutoModel.from_pretrained(huggingface_id(model_name))
+            model.eval()
+
+            dummy = tokenizer(["export"], return_tensors="pt")
+            input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in dummy]
+            dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+            dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+            print(f"Exporting {model_name} to {fp32_path}...")
+            torch.onnx.export(
+                model,
+                tuple(dummy[name] for name in input_names),
+                fp32_path,
+                input_names=input_names,
+                output_names=["last_hidden_state"],
+                dynamic_axes=dynamic_axes,
+                opset_version=14
+            )
+
+        if not quantize:
+            return fp32_path
+
+        if not os.path.exists(int8_path):
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            print(f"Quantizing {fp32_path} to int8...")
+            quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+        return int8_path
+
+    def _encode_batch(self, texts):
+        tokens = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="np"
+        )
+        feed = {name: np.asarray(value, dtype='int64') for name, value in tokens.items() if name in self.input_names}
+        hidden = self.session.run(None, feed)[0]
+
+        # Mean pooling over real (non-padding) tokens
+        mask = tokens["attention_mask"][..., None].astype('float32')
+        embeddings = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings.astype('float32')
+
+    @property
+    def dimension(self):
+        return self._dimension
+
+
+def _new_backend(backend, model_name, **options):
+    if backend == "sentence-transformers":
+        return SentenceTransformerBackend(model_name, **options)
+    return OnnxBackend(model_name, **options)
+
+
+def create_embedding_backend(backend="sentence-transformers", model_name="all-MiniLM-L6-v2", shared=True, **options):
+    """
+    Create an embedding backend by name
+
+    By default the backend comes from a process-wide registry keyed by
+    backend, model name, device and options, so the document processor, the
+    retriever and every collection use one loaded copy of each model.
+
+    Args:
+        backend: "sentence-transformers" or "onnx", or an EmbeddingBackend instance
+            which is returned unchanged
+        model_name: SentenceTransformer model name
+        shared: Reuse the registry's instance (False always loads a new one)
+        options: Backend options (batch_size, num_threads, quantize, device, ...)
+    """
+    if isinstance(backend, EmbeddingBackend):
+        return backend
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}', expected one of {BACKENDS}")
+    if not shared:
+        return _new_backend(backend, model_name, **options)
+
+    key = (backend, model_name, options.get("device"), tuple(sorted((name, repr(value)) for name, value in options.items())))
+    with _shared_backends_lock:
+        entry = _shared_backends.setdefault(key, {"lock": threading.Lock(), "backend": None})
+    # Loading takes seconds; only callers wanting this model wait
+    with entry["lock"]:
+        if entry["backend"] is None:
+            entry["backend"] = _new_backend(backend, model_name, **options)
+        return entry["backend"]
+
+
+def shared_embedding_backends():
+    """(backend, model name, device) of the models loaded in the registry"""
+    with _shared_backends_lock:
+        entries = list(_shared_backends.items())
+    return [key[:3] for key, entry in entries if entry["backend"] is not None]
@@ -0,0 +1,362 @@
+import os
+import time
+import random
+import json
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+import httpx
+
+DEFAULT_BASE_URL = "https://api.groq.com"
+CHAT_COMPLETIONS_PATH = "/openai/v1/chat/completions"
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class GroqAPIError(Exception):
+    """A Groq request failed after all retries"""
+
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class RateLimitError(GroqAPIError):
+    """Groq kept answering 429 Too Many Requests"""
+
+
+class DeadlineExceeded(GroqAPIError):
+    """The request's deadline passed before a response arrived"""
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Async token-bucket rate limiter
+
+    Allows `rate` acquisitions per second on average with bursts of up to
+    `capacity`; acquire() sleeps until a token is available.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens=1.0):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+class AsyncGroqClient:
+    """
+    Async client for Groq's OpenAI-compatible chat completions API
+
+    - one pooled httpx.AsyncClient (keep-alive connections are reused)
+    - a per-request deadline covering all retries
+    - retries with full-jitter exponential backoff that honor Retry-After
+    - a global semaphore bounding requests in flight
+    - an optional token-bucket limit on requests per second
+
+    The base URL can be pointed at benchmarks/fake_groq_server.py through the
+    GROQ_BASE_URL environment variable.
+    """
+
+    def __init__(
+        self,
+        api_key=None,
+        base_url=None,
+        timeout=30.0,
+        max_retries=4,
+        backoff_base=0.5,
+        backoff_max=20.0,
+        max_in_flight=8,
+        max_connections=20,
+        requests_per_second=None,
+        burst=None
+    ):
+        """
+        Args:
+            api_key: Groq API key (defaults to GROQ_API_KEY)
+            base_url: API host (defaults to GROQ_BASE_URL or https://api.groq.com)
+            timeout: Default deadline in seconds for a request including retries
+            max_retries: Retries after the first attempt
+            backoff_base: First backoff step in seconds
+            backoff_max: Largest backoff in seconds
+            max_in_flight: Requests allowed in flight at once
+            max_connections: HTTP connection pool size
+            requests_per_second: Token-bucket rate limit (None for no limit)
+            burst: Token-bucket capacity (defaults to the rate)
+        """
+        self.api_key = api_key or os.getenv("GROQ_API_KEY")
+        self.base_url = (base_url or os.getenv("GROQ_BASE_URL") or DEFAULT_BASE_URL).rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_in_flight = max_in_flight
+        self.max_connections = max_connections
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.stats = {"requests": 0, "attempts": 0, "retries": 0, "rate_limited": 0, "failures": 0}
+
+        # Created lazily so they bind to the event loop that uses them
+        self._pid = None
+        self._http = None
+        self._semaphore = None
+        self._bucket = None
+
+    def _ensure_started(self):
+        # A forked worker has its own event loop; the parent's client is unusable there
+        if self._http is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._http = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                )
+            )
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+            if self.requests_per_second:
+                self._bucket = TokenBucket(self.requests_per_second, self.burst)
+
+    def _backoff(self, attempt, retry_after=None):
+        """Seconds to wait before the next attempt"""
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        # Full jitter: uniform in [0, base * 2^attempt]
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def chat(self, messages, model, timeout=None, **params):
+        """
+        Create a chat completion
+
+        Args:
+            messages: OpenAI-style [{"role": ..., "content": ...}] messages
+            model: Groq model name
+            timeout: Deadline in seconds for this request including retries
+            params: Extra request fields (temperature, max_tokens, ...)
+
+        Returns:
+            The decoded JSON response
+        """
+        self._ensure_started()
+        self.stats["requests"] += 1
+        deadline = time.monotonic() + (timeout or self.timeout)
+        payload = dict(params, model=model, messages=messages)
+
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.stats["failures"] += 1
+                raise DeadlineExceeded("Groq request deadline exceeded")
+
+            status_code, retry_after, error = None, None, None
+            try:
+                async with self._semaphore:
+                    if self._bucket is not None:
+                        await asyncio.wait_for(self._bucket.acquire(), remaining)
+                    self.stats["attempts"] += 1
+                    response = await self._http.post(
+                        CHAT_COMPLETIONS_PATH,
+                        json=payload,
+                        timeout=max(0.001, deadline - time.monotonic())
+                    )
+                if response.status_code == 200:
+                    return response.json()
+                status_code = response.status_code
+                retry_after = parse_retry_after(response.headers.get("retry-after"))
+                error = f"Groq API returned {status_code}: {response.text[:200]}"
+                if status_code == 429:
+                    self.stats["rate_limited"] += 1
+                if status_code not in RETRYABLE_STATUS:
+                    self.stats["failures"] += 1
+                    raise GroqAPIError(error, status_code)
+            except (httpx.TransportError, asyncio.TimeoutError) as e:
+                error = f"Groq request failed: {e!r}"
+
+            await asyncio.sleep(self._retry_delay(attempt, deadline, error, status_code, retry_after))
+            attempt += 1
+
+    def _retry_delay(self, attempt, deadline, error, status_code=None, retry_after=None):
+        """Seconds to wait before retrying a failed attempt; raises if it can't be retried"""
+        if attempt >= self.max_retries:
+            self.stats["failures"] += 1
+            error_type = RateLimitError if status_code == 429 else GroqAPIError
+            raise error_type(error, status_code, retry_after)
+
+        delay = self._backoff(attempt, retry_after)
+        if time.monotonic() + delay >= deadline:
+            self.stats["failures"] += 1
+            error_type = RateLimitError if status_code == 429 else DeadlineExceeded
+            raise error_type(f"{error} (no time left to retry)", status_code, retry_after)
+        self.stats["retries"] += 1
+        return delay
+
+    async def stream(self, messages, model, timeout=None, **params):
+        """
+        Stream a chat completion
+
+        Takes the same in-flight slot and rate-limit token as chat() and keeps
+        the slot until the stream ends. Failures before the first chunk are
+        retried like chat(); once a chunk has been yielded a failure is
+        raised, since a retry would repeat text the caller already has. The
+        deadline covers the whole stream.
+
+        Args:
+            messages: OpenAI-style [{"role": ..., "content": ...}] messages
+            model: Groq model name
+            timeout: Deadline in seconds for the whole stream including retries
+            params: Extra request fields (temperature, max_tokens, ...)
+
+        Yields:
+            The decoded chat.completion.chunk events
+        """
+        self._ensure_started()
+        self.stats["requests"] += 1
+        deadline = time.monotonic() + (timeout or self.timeout)
+        payload = dict(params, model=model, messages=messages, stream=True)
+
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.stats["failures"] += 1
+                raise DeadlineExceeded("Groq request deadline exceeded")
+
+            status_code, retry_after, error = None, None, None
+            started = False
+            try:
+                async with self._semaphore:
+                    if self._bucket is not None:
+                        await asyncio.wait_for(self._bucket.acquire(), remaining)
+                    self.stats["attempts"] += 1
+                    async with self._http.stream(
+                        "POST",
+                        CHAT_COMPLETIONS_PATH,
+                        json=payload,
+                        timeout=max(0.001, deadline - time.monotonic())
+                    ) as response:
+                        if response.status_code == 200:
+                            lines = response.aiter_lines()
+                            try:
+                                async for line in lines:
+                                    if time.monotonic() > deadline:
+                                        self.stats["failures"] += 1
+                                        raise DeadlineExceeded("Groq stream deadline exceeded")
+                                    if not line.startswith("data:"):
+                                        continue
+                                    data = line[len("data:"):].strip()
+                                    if data == "[DONE]":
+                                        return
+                                    started = True
+                                    yield json.loads(data)
+                            finally:
+                                await lines.aclose()
+                            return
+                        await response.aread()
+                status_code = response.status_code
+                retry_after = parse_retry_after(response.headers.get("retry-after"))
+                error = f"Groq API returned {status_code}: {response.text[:200]}"
+                if status_code == 429:
+                    self.stats["rate_limited"] += 1
+                if status_code not in RETRYABLE_STATUS:
+                    self.stats["failures"] += 1
+                    raise GroqAPIError(error, status_code)
+            except (httpx.TransportError, asyncio.TimeoutError) as e:
+                error = f"Groq request failed: {e!r}"
+                if started:
+                    self.stats["failures"] += 1
+                    raise GroqAPIError(f"Groq stream interrupted: {e!r}")
+
+            await asyncio.sleep(self._retry_delay(attempt, deadline, error, status_code, retry_after))
+            attempt += 1
+
+    async def complete(self, prompt, model, timeout=None, **params):
+        """
+        Send a single user message
+
+        Returns:
+            (completion text, usage dict with prompt/completion token counts)
+        """
+        data = await self.chat([{"role": "user", "content": prompt}], model, timeout=timeout, **params)
+        return data["choices"][0]["message"]["content"], data.get("usage", {})
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+
+async def _anext(async_iterator):
+    return await async_iterator.__anext__()
+
+
+class EventLoopThread:
+    """
+    A private asyncio event loop running on a daemon thread
+
+    Lets synchronous code (Flask request threads) share one async client, and
+    with it one connection pool, semaphore and rate limiter.
+    """
+
+    def __init__(self, name="groq-client-loop"):
+        self.pid = os.getpid()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, coroutine):
+        """Schedule a coroutine on the loop and return its concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, coroutine, timeout=None):
+        """Run a coroutine on the loop and wait for its result"""
+        return self.submit(coroutine).result(timeout)
+
+    def iterate(self, async_iterator):
+        """
+        Iterate an async generator running on the loop from synchronous code
+
+        If the caller stops early, the generator is closed on the loop, so it
+        gives back its in-flight slot and connection.
+        """
+        try:
+            while True:
+                try:
+                    yield self.run(_anext(async_iterator))
+                except StopAsyncIteration:
+                    return
+        finally:
+            self.run(async_iterator.aclose())
+
+    def stop(self):
+        # Finish closing async generators left by streams before the loop stops
+        self.run(self.loop.shutdown_asyncgens())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
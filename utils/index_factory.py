@@ -0,0 +1,220 @@
+import math
+import numpy as np
+import faiss
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+DEFAULT_INDEX_PARAMS = {
+    "nlist": 256,            # IVF: number of coarse clusters
+    "nprobe": 16,            # IVF: clusters visited per query
+    "pq_m": 16,              # IVF-PQ: sub-quantizers (must divide the dimension)
+    "pq_bits": 8,            # IVF-PQ: bits per sub-quantizer code
+    "hnsw_m": 32,            # HNSW: graph neighbours per node
+    "ef_construction": 200,  # HNSW: candidate list size while building
+    "ef_search": 64          # HNSW: candidate list size per query
+}
+
+
+def index_params(**overrides):
+    """Default index parameters updated with the non-None overrides"""
+    params = dict(DEFAULT_INDEX_PARAMS)
+    params.update({key: value for key, value in overrides.items() if value is not None})
+    return params
+
+
+def training_size(index_type, params):
+    """
+    Number of vectors needed to train an index type well
+
+    FAISS wants ~39 points per k-means centroid; 0 means no training needed.
+    """
+    if index_type == "ivf_flat":
+        return 39 * params["nlist"]
+    if index_type == "ivf_pq":
+        return 39 * max(params["nlist"], 2 ** params["pq_bits"])
+    return 0
+
+
+def create_index(index_type, dimension, params=None):
+    """
+    Create an empty FAISS index of the given type that accepts chunk IDs
+
+    Args:
+        index_type: One of INDEX_TYPES
+        dimension: Embedding dimensionality
+        params: Index parameters (see DEFAULT_INDEX_PARAMS)
+
+    Returns:
+        An index supporting add_with_ids; IVF indexes still need training
+    """
+    params = params or index_params()
+
+    if index_type == "flat":
+        return faiss.IndexIDMap2(faiss.IndexFlatL2(dimension))
+
+    if index_type == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(dimension, params["hnsw_m"])
+        hnsw.hnsw.efConstruction = params["ef_construction"]
+        hnsw.hnsw.efSearch = params["ef_search"]
+        return faiss.IndexIDMap2(hnsw)
+
+    if index_type in ("ivf_flat", "ivf_pq"):
+        quantizer = faiss.IndexFlatL2(dimension)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dimension, params["nlist"])
+        else:
+            if dimension % params["pq_m"] != 0:
+                raise ValueError(f"pq_m={params['pq_m']} must divide the embedding dimension {dimension}")
+            index = faiss.IndexIVFPQ(quantizer, dimension, params["nlist"], params["pq_m"], params["pq_bits"])
+        # IVF indexes store chunk IDs natively; the hashtable direct map
+        # keeps reconstruct() and remove_ids() working with arbitrary IDs
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        index.nprobe = min(params["nprobe"], params["nlist"])
+        return index
+
+    raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+
+
+def _unwrap(index):
+    """The index inside an ID map, or the index itself"""
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def index_kind(index):
+    """Which of INDEX_TYPES an index is"""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return "ivf_pq" if isinstance(faiss.downcast_index(ivf), faiss.IndexIVFPQ) else "ivf_flat"
+    return "hnsw" if isinstance(_unwrap(index), faiss.IndexHNSW) else "flat"
+
+
+def describe_index(index):
+    """Short human-readable description of an index's type and size"""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return f"{index_kind(index)} (nlist={ivf.nlist}, {index.ntotal} vectors)"
+    return f"{index_kind(index)} ({index.ntotal} vectors)"
+
+
+def supports_removal(index):
+    """Whether remove_ids works on the index (HNSW graphs cannot delete nodes)"""
+    return index_kind(index) != "hnsw"
+
+
+def search_parameters(index, nprobe=None, ef_search=None, selector=None):
+    """
+    Build per-query FAISS search parameters for an index
+
+    Args:
+        index: The index that will be searched
+        nprobe: IVF clusters to visit (higher = better recall, slower)
+        ef_search: HNSW candidate list size (higher = better recall, slower)
+        selector: Optional faiss.IDSelector restricting the searchable IDs
+
+    Returns:
+        A faiss.SearchParameters object, or None when nothing needs setting
+    """
+    if faiss.try_extract_index_ivf(index) is not None:
+        params = faiss.SearchParametersIVF()
+        if nprobe is not None:
+            params.nprobe = int(nprobe)
+        else:
+            params.nprobe = faiss.try_extract_index_ivf(index).nprobe
+    else:
+        inner = _unwrap(index)
+        if isinstance(inner, faiss.IndexHNSW):
+            params = faiss.SearchParametersHNSW()
+            params.efSearch = int(ef_search) if ef_search is not None else inner.hnsw.efSearch
+        elif selector is not None:
+            params = faiss.SearchParameters()
+        else:
+            return None
+
+    if selector is not None:
+        params.sel = selector
+    return params
+
+
+class IndexBuilder:
+    """
+    Incrementally builds an index of the configured type
+
+    Vectors are buffered until there are enough to train an IVF index, after
+    which the index is trained and further vectors are added directly. If the
+    corpus ends up too small to train on, the builder falls back to an exact
+    flat index, which is also the fastest choice at that size.
+    """
+
+    def __init__(self, dimension, index_type="flat", params=None):
+        """
+        Args:
+            dimension: Embedding dimensionality
+            index_type: One of INDEX_TYPES
+            params: Index parameters (see DEFAULT_INDEX_PARAMS)
+        """
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+        self.dimension = dimension
+        self.index_type = index_type
+        self.params = params or index_params()
+        self.train_size = training_size(index_type, self.params)
+        self.index = None
+        self._pending_vectors = []
+        self._pending_ids = []
+        self._pending_count = 0
+
+        if self.train_size == 0:
+            self.index = create_index(index_type, dimension, self.params)
+
+    def add(self, embeddings, ids):
+        """Add a batch of vectors with their chunk IDs"""
+        embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+        ids = np.asarray(ids, dtype='int64')
+        if self.index is not None:
+            self.index.add_with_ids(embeddings, ids)
+            return
+
+        self._pending_vectors.append(embeddings)
+        self._pending_ids.append(ids)
+        self._pending_count += len(ids)
+        if self._pending_count >= self.train_size:
+            self._train_and_flush(self.index_type)
+
+    def _train_and_flush(self, index_type):
+        vectors = np.concatenate(self._pending_vectors) if self._pending_vectors else \
+            np.empty((0, self.dimension), dtype='float32')
+        ids = np.concatenate(self._pending_ids) if self._pending_ids else np.empty(0, dtype='int64')
+        self._pending_vectors, self._pending_ids, self._pending_count = [], [], 0
+
+        self.index = create_index(index_type, self.dimension, self.params)
+        if not self.index.is_trained:
+            print(f"Training {index_type} index on {len(vectors)} vectors...")
+            self.index.train(vectors)
+        if len(ids):
+            self.index.add_with_ids(vectors, ids)
+
+    def finalize(self):
+        """Return the built index"""
+        if self.index is None:
+            if self._pending_count:
+                print(
+                    f"Only {self._pending_count} vectors (< {self.train_size} needed to train "
+                    f"{self.index_type}); using an exact flat index"
+                )
+            self._train_and_flush("flat")
+        return self.index
+
+
+def build_index(embeddings, ids, index_type="flat", params=None):
+    """Build a complete index from an embedding matrix in one call"""
+    embeddings = np.asarray(embeddings, dtype='float32')
+    builder = IndexBuilder(embeddings.shape[1], index_type, params)
+    builder.add(embeddings, ids)
+    return builder.finalize()
+
+
+def default_nlist(num_vectors):
+    """Rule-of-thumb IVF cluster count (~4 * sqrt(N), trainable from N vectors)"""
+    return max(1, min(int(4 * math.sqrt(max(num_vectors, 1))), num_vectors // 39))
@@ -0,0 +1,129 @@
+import time
+import uuid
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job:
+    """State and progress of one background job"""
+
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.status = "queued"
+        self.stage = None
+        self.current = None
+        self.total = None
+        self.message = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.lock = threading.Lock()
+
+    def update(self, stage, current=None, total=None, message=None):
+        """Report progress; used as the progress callback of long-running work"""
+        with self.lock:
+            self.stage = stage
+            self.current = current
+            self.total = total
+            if message is not None:
+                self.message = message
+
+    def to_dict(self):
+        with self.lock:
+            progress = None
+            if self.total:
+                progress = min(1.0, (self.current or 0) / float(self.total))
+            return {
+                "id": self.id,
+                "kind": self.kind,
+                "status": self.status,
+                "stage": self.stage,
+                "current": self.current,
+                "total": self.total,
+                "progress": progress,
+                "message": self.message,
+                "result": self.result,
+                "error": self.error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at
+            }
+
+
+class JobManager:
+    """
+    Runs jobs on a background thread pool and keeps their status
+
+    With the default single worker, jobs run one at a time in submission order,
+    which is what index updates need: two concurrent writers would race on the
+    same index files.
+    """
+
+    def __init__(self, max_workers=1, keep=100):
+        """
+        Args:
+            max_workers: Number of jobs that may run at once
+            keep: Number of finished jobs whose status is remembered
+        """
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.jobs = {}
+        self.keep = keep
+        self.lock = threading.Lock()
+
+    def submit(self, kind, fn):
+        """
+        Queue a job
+
+        Args:
+            kind: Short job type label, e.g. "index"
+            fn: Callable taking the Job (to report progress) and returning a
+                JSON-serializable result
+
+        Returns:
+            The queued Job
+        """
+        job = Job(kind)
+        with self.lock:
+            self.jobs[job.id] = job
+            self._forget_old_jobs()
+        self.executor.submit(self._run, job, fn)
+        return job
+
+    def _run(self, job, fn):
+        with job.lock:
+            job.status = "running"
+            job.started_at = time.time()
+        try:
+            result = fn(job)
+            with job.lock:
+                job.result = result
+                job.status = "succeeded"
+        except Exception as e:
+            traceback.print_exc()
+            with job.lock:
+                job.error = str(e)
+                job.status = "failed"
+        finally:
+            with job.lock:
+                job.finished_at = time.time()
+
+    def _forget_old_jobs(self):
+        finished = [job for job in self.jobs.values() if job.finished_at is not None]
+        finished.sort(key=lambda job: job.finished_at)
+        for job in finished[:max(0, len(finished) - self.keep)]:
+            del self.jobs[job.id]
+
+    def get(self, job_id):
+        """The Job with this ID, or None"""
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        """All remembered jobs, newest first"""
+        with self.lock:
+            jobs = list(self.jobs.values())
+        return sorted(jobs, key=lambda job: job.created_at, reverse=True)
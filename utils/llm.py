@@ -1,61 +1,154 @@
+import asyncio
 import os
-from langchain_groq import ChatGroq
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
-from langchain_core.output_parsers import StrOutputParser
+import threading
 from dotenv import load_dotenv
+from utils.groq_client import AsyncGroqClient, EventLoopThread, RateLimitError, DeadlineExceeded
+from utils.context_packer import ContextPacker, TokenCounter
+from utils import metrics
 
 # Load environment variables
 load_dotenv()
 
+RATE_LIMITED_MESSAGE = "The language model is receiving too many requests right now. Please try again in a few seconds."
+TIMEOUT_MESSAGE = "The language model took too long to respond. Please try again."
+
+PROMPT_TEMPLATE = """
+        You are a helpful AI assistant. Use the following context to answer the user's question.
+        If you don't know the answer or can't find it in the context, say so. Don't make up information.
+        
+        Please structure your response as clear, separate points. Each point should be a complete thought.
+        Use bullet points or numbered lists when appropriate to make the information easier to digest.
+        
+        Context:
+        {context}
+        
+        Question: {query}
+        
+        Answer:
+        """
+
+# One background event loop shared by every GroqLLM in the process
+_event_loop = None
+_event_loop_lock = threading.Lock()
+
+
+def get_event_loop_thread():
+    """The shared background event loop, started on first use (and again in a forked worker)"""
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is None or _event_loop.pid != os.getpid():
+            _event_loop = EventLoopThread()
+        return _event_loop
+
+
 class GroqLLM:
-    def __init__(self, model_name="llama3-70b-8192"):
+    def __init__(
+        self,
+        model_name="llama3-70b-8192",
+        timeout=30.0,
+        max_retries=4,
+        max_in_flight=8,
+        requests_per_second=None,
+        context_token_budget=3000,
+        tokenizer_name=None,
+        allow_tokenizer_download=False
+    ):
         """
         Initialize the Groq LLM interface
         
         Args:
             model_name: The Groq model to use
+            timeout: Deadline in seconds for one answer, including retries
+            max_retries: Retries on 429, 5xx and network errors
+            max_in_flight: Groq requests allowed in flight at once
+            requests_per_second: Client-side rate limit (None for no limit)
+            context_token_budget: Maximum tokens of retrieved context per prompt (None for no limit)
+            tokenizer_name: Hugging Face tokenizer, or local tokenizer.json file or
+                directory, used to count tokens (defaults to the model's)
+            allow_tokenizer_download: Download the tokenizer from the Hugging Face
+                Hub if it is not available locally
         """
         self.groq_api_key = os.getenv("GROQ_API_KEY")
         
         if not self.groq_api_key:
             raise ValueError("GROQ_API_KEY environment variable not set")
         
-        self.llm = ChatGroq(
-            api_key=self.groq_api_key, 
-            model=model_name
-        )
+        self.model_name = model_name
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.base_url = base_url = os.getenv("GROQ_BASE_URL")
         
-        # Define the RAG prompt template
-        self.prompt_template = ChatPromptTemplate.from_template("""
-        You are a helpful AI assistant. Use the following context to answer the user's question.
-        If you don't know the answer or can't find it in the context, say so. Don't make up information.
-        
-        Please structure your response as clear, separate points. Each point should be a complete thought.
-        Use bullet points or numbered lists when appropriate to make the information easier to digest.
+        # Answers and streams go through the pooled async client
+        self.client = AsyncGroqClient(
+            api_key=self.groq_api_key,
+            base_url=base_url,
+            timeout=timeout,
+            max_retries=max_retries,
+            max_in_flight=max_in_flight,
+            requests_per_second=requests_per_second
+        )
         
-        Context:
-        {context}
+        # LangChain model for create_chain, imported on first use
+        self._llm = None
+        self._llm_lock = threading.Lock()
         
-        Question: {query}
-        
-        Answer:
-        """)
+        # Packs retrieved chunks into the context within the token budget
+        self.context_packer = ContextPacker(
+            TokenCounter(model_name, tokenizer_name, allow_download=allow_tokenizer_download),
+            token_budget=context_token_budget
+        )
+    
+    @property
+    def llm(self):
+        """The LangChain ChatGroq model used by create_chain"""
+        with self._llm_lock:
+            if self._llm is None:
+                with metrics.startup_step("langchain_groq", "import"):
+                    from langchain_groq import ChatGroq
+                self._llm = ChatGroq(
+                    api_key=self.groq_api_key,
+                    model=self.model_name,
+                    base_url=self.base_url,
+                    timeout=self.timeout,
+                    max_retries=self.max_retries
+                )
+            return self._llm
+    
+    @property
+    def prompt_template(self):
+        """The RAG prompt as a LangChain template"""
+        from langchain_core.prompts import ChatPromptTemplate
+        return ChatPromptTemplate.from_template(PROMPT_TEMPLATE)
         
     def format_context(self, retrieved_documents):
         """Format retrieved documents into a string context"""
-        # Join the retrieved document texts with separators
-        formatted_docs = []
+        return self.pack_context(retrieved_documents)[0]
+    
+    def pack_context(self, retrieved_documents):
+        """
+        Format retrieved documents into a context within the token budget
         
-        for i, doc in enumerate(retrieved_documents["texts"]):
-            # Add the document text with its source info
-            source = retrieved_documents["metadata"][i].get("source", "Unknown source")
-            formatted_docs.append(f"Document {i+1} (from {source}):\n{doc}\n")
+        Overlapping chunks of the same page are merged and the lowest-ranked
+        material is trimmed first (see utils.context_packer).
         
-        return "\n".join(formatted_docs)
+        Returns:
+            (context string, packing stats including "tokens_saved")
+        """
+        with metrics.stage("chat", "pack_context"):
+            context, stats = self.context_packer.pack(retrieved_documents)
+        metrics.CONTEXT_TOKENS_SAVED.inc(stats['tokens_saved'])
+        print(
+            f"Context: {stats['tokens']} tokens from {stats['chunks']} chunks "
+            f"({stats['chunks_merged']} merged, {stats['spans_dropped']} dropped, "
+            f"{stats['tokens_saved']} tokens saved)"
+        )
+        return context, stats
         
     def create_chain(self):
         """Create a langchain processing chain"""
+        from langchain_core.runnables import RunnablePassthrough
+        from langchain_core.output_parsers import StrOutputParser
+        
         chain = (
             {"context": RunnablePassthrough(), 
              "query": RunnablePassthrough()}
@@ -93,16 +186,21 @@ class GroqLLM:
             
         return points
 
-    def generate_response(self, query, retrieved_documents):
-        """Generate a response based on the query and retrieved documents"""
-        try:
-            # Format context from retrieved documents
-            context = self.format_context(retrieved_documents)
-            
-            # Invoke LLM directly with formatted input
-            from langchain_core.messages import HumanMessage
-            
-            prompt = f"""
+    def build_prompt(self, query, retrieved_documents):
+        """Build the RAG prompt sent to the model"""
+        return self.prepare_prompt(query, retrieved_documents)[0]
+    
+    def prepare_prompt(self, query, retrieved_documents):
+        """
+        Build the RAG prompt sent to the model
+        
+        Returns:
+            (prompt, context packing stats)
+        """
+        # Format context from retrieved documents
+        context, context_stats = self.pack_context(retrieved_documents)
+        
+        prompt = f"""
             You are a helpful AI assistant. Use the following context to answer the user's question.
             If you don't know the answer or can't find it in the context, say so. Don't make up information.
             
@@ -116,23 +214,171 @@ class GroqLLM:
             
             Answer:
             """
+        return prompt, context_stats
+
+    async def agenerate_response(self, query, retrieved_documents):
+        """
+        Async version of generate_response, for callers running their own event loop
+
+        The shared client's connection pool and semaphore belong to the
+        background loop, so the request runs there and is awaited from the
+        caller's loop.
+        """
+        try:
+            prompt, context_stats = self.prepare_prompt(query, retrieved_documents)
+            with metrics.stage("chat", "llm_call"):
+                raw_response, usage = await asyncio.wrap_future(
+                    get_event_loop_thread().submit(self.client.complete(prompt, self.model_name))
+                )
+            return self.completed_response(raw_response, usage, context_stats)
+        except Exception as e:
+            return self.failed_response(e)
+
+    def generate_response(self, query, retrieved_documents):
+        """
+        Generate a response based on the query and retrieved documents
+        
+        The Groq request runs on the shared background event loop, so all
+        request threads share one connection pool, in-flight limit and rate
+        limiter. Prompt building and parsing stay on the calling thread.
+        """
+        try:
+            prompt, context_stats = self.prepare_prompt(query, retrieved_documents)
+            with metrics.stage("chat", "llm_call"):
+                raw_response, usage = get_event_loop_thread().run(
+                    self.client.complete(prompt, self.model_name)
+                )
+            return self.completed_response(raw_response, usage, context_stats)
+        except Exception as e:
+            return self.failed_response(e)
+
+    def record_success(self, usage):
+        """Count a completed Groq request and its tokens"""
+        metrics.LLM_REQUESTS.labels("ok").inc()
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if usage and usage.get(kind):
+                metrics.LLM_TOKENS.labels(kind.split("_")[0]).inc(usage[kind])
+
+    def completed_response(self, raw_response, usage, context_stats):
+        """Response dict for a completed Groq request"""
+        self.record_success(usage)
+
+        # Parse response into points for smooth display
+        points = self.parse_response_to_points(raw_response)
+        
+        return {
+            'text': raw_response,
+            'points': points,
+            'usage': usage,
+            'context': context_stats
+        }
+
+    def failed_response(self, error):
+        """Log a failed Groq request and return the message shown to the user"""
+        if isinstance(error, RateLimitError):
+            metrics.LLM_REQUESTS.labels("rate_limited").inc()
+            print(f"Groq rate limit: {str(error)}")
+            return self.error_response(RATE_LIMITED_MESSAGE)
+        if isinstance(error, DeadlineExceeded):
+            metrics.LLM_REQUESTS.labels("timeout").inc()
+            print(f"Groq deadline exceeded: {str(error)}")
+            return self.error_response(TIMEOUT_MESSAGE)
+        import traceback
+        metrics.LLM_REQUESTS.labels("error").inc()
+        print(f"Error generating response: {str(error)}")
+        traceback.print_exception(type(error), error, error.__traceback__)
+        return self.error_response(f"Sorry, I encountered an error: {str(error)}")
+
+    def error_response(self, message):
+        """Response dict shown to the user when no answer could be generated"""
+        return {
+            'text': message,
+            'points': [message],
+            'error': True
+        }
+
+    def stream_response(self, query, retrieved_documents):
+        """
+        Stream a response token by token
+        
+        The stream runs on the shared background event loop like
+        generate_response, so it counts against the same in-flight limit,
+        rate limiter and deadline.
+        
+        Yields:
+            Event dicts: {"type": "token", "text"} for each token,
+            {"type": "point", "text"} as soon as a point is complete, and a final
+            {"type": "done", "text", "points", "context"} with the same points
+            generate_response would return and the context packing stats
+            (or {"type": "error", "text"})
+        """
+        try:
+            prompt, context_stats = self.prepare_prompt(query, retrieved_documents)
+            point_stream = ResponsePointStream(self.parse_response_to_points)
+            usage = {}
             
-            response = self.llm.invoke([HumanMessage(content=prompt)])
-            raw_response = response.content
+            chunks = get_event_loop_thread().iterate(
+                self.client.stream([{"role": "user", "content": prompt}], self.model_name)
+            )
+            try:
+                for chunk in chunks:
+                    # Groq reports usage on the last chunk under x_groq
+                    usage = chunk.get("usage") or chunk.get("x_groq", {}).get("usage") or usage
+                    choices = chunk.get("choices") or [{}]
+                    token = choices[0].get("delta", {}).get("content")
+                    if not token:
+                        continue
+                    yield {"type": "token", "text": token}
+                    for point in point_stream.feed(token):
+                        yield {"type": "point", "text": point}
+            finally:
+                chunks.close()
             
-            # Parse response into points for smooth display
-            points = self.parse_response_to_points(raw_response)
+            for point in point_stream.finish():
+                yield {"type": "point", "text": point}
             
-            return {
-                'text': raw_response,
-                'points': points
-            }
+            self.record_success(usage)
+            yield {"type": "done", "text": point_stream.text, "points": point_stream.points, "context": context_stats}
         except Exception as e:
-            import traceback
-            print(f"Error generating response: {str(e)}")
-            traceback.print_exc()
-            error_msg = f"Sorry, I encountered an error: {str(e)}"
-            return {
-                'text': error_msg,
-                'points': [error_msg]
-            }
\ No newline at end of file
+            yield {"type": "error", "text": self.failed_response(e)["text"]}
+
+
+class ResponsePointStream:
+    """
+    Incremental version of GroqLLM.parse_response_to_points
+    
+    Text is fed as it streams in. Every point except the last one parsed from
+    the text so far is complete (a later bullet or sentence has started), so
+    it can be emitted immediately; the last point is emitted by finish().
+    """
+    
+    # Characters that can end a point; re-parsing is skipped for other tokens
+    BOUNDARY_CHARS = set("\n.!?")
+    
+    def __init__(self, parse):
+        """
+        Args:
+            parse: Function splitting a full response text into points
+        """
+        self.parse = parse
+        self.text = ""
+        self.emitted = 0
+        self.points = []
+    
+    def feed(self, token):
+        """Add streamed text and return the points completed by it"""
+        self.text += token
+        if not self.BOUNDARY_CHARS.intersection(token):
+            return []
+        
+        complete = self.parse(self.text)[:-1]
+        new_points = complete[self.emitted:]
+        self.emitted = max(self.emitted, len(complete))
+        return new_points
+    
+    def finish(self):
+        """Return the points not emitted yet, once the stream has ended"""
+        self.points = self.parse(self.text) if self.text.strip() else []
+        remaining = self.points[self.emitted:]
+        self.emitted = len(self.points)
+        return remaining
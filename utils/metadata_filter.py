@@ -0,0 +1,208 @@
+import os
+import json
+import threading
+import datetime
+from collections import OrderedDict
+import numpy as np
+import faiss
+
+FILTER_FIELDS = ("source", "page", "file_type", "uploaded_after", "uploaded_before")
+
+
+class FilterError(ValueError):
+    """A malformed metadata filter"""
+
+
+def _as_list(value):
+    return list(value) if isinstance(value, (list, tuple, set)) else [value]
+
+
+def _timestamp(value, field):
+    """Epoch seconds from a number or an ISO date/datetime string"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        parsed = datetime.datetime.fromisoformat(str(value))
+    except ValueError:
+        raise FilterError(f"'{field}' must be epoch seconds or an ISO date, got {value!r}")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
+
+
+def normalize_filters(filters):
+    """
+    Validate filters and bring them into a canonical form
+
+    Args:
+        filters: Dict with any of:
+            source: file name or path, or a list of them
+            page: page number, [first, last] or {"min": ..., "max": ...}
+                (numbers as stored in the metadata; PDF pages count from 0)
+            file_type: extension such as "pdf", or a list of them
+            uploaded_after / uploaded_before: epoch seconds or ISO date
+
+    Returns:
+        The normalized filters, or None when there is nothing to filter on
+    """
+    if not filters:
+        return None
+    if not isinstance(filters, dict):
+        raise FilterError("filters must be an object")
+    unknown = set(filters) - set(FILTER_FIELDS)
+    if unknown:
+        raise FilterError(f"Unknown filter field(s) {sorted(unknown)}, expected {list(FILTER_FIELDS)}")
+
+    normalized = {}
+    if filters.get("source") is not None:
+        normalized["source"] = sorted(str(source) for source in _as_list(filters["source"]))
+    if filters.get("page") is not None:
+        page = filters["page"]
+        if isinstance(page, dict):
+            first, last = page.get("min"), page.get("max")
+        elif isinstance(page, (list, tuple)) and len(page) == 2:
+            first, last = page
+        else:
+            first = last = page
+        try:
+            normalized["page"] = [
+                int(first) if first is not None else None,
+                int(last) if last is not None else None
+            ]
+        except (TypeError, ValueError):
+            raise FilterError(f"'page' must be a number, [first, last] or {{'min', 'max'}}, got {page!r}")
+    if filters.get("file_type") is not None:
+        normalized["file_type"] = sorted(str(ext).lower().lstrip(".") for ext in _as_list(filters["file_type"]))
+    for field in ("uploaded_after", "uploaded_before"):
+        if filters.get(field) is not None:
+            normalized[field] = _timestamp(filters[field], field)
+    return normalized or None
+
+
+class FilterSelection:
+    """The chunks matching one filter, in the forms the searchers need"""
+
+    def __init__(self, row_mask, ids):
+        self.row_mask = row_mask
+        self.rows = np.flatnonzero(row_mask)
+        self.ids = np.asarray(ids[self.rows], dtype='int64')
+        self.count = len(self.rows)
+
+        # FAISS reads the bitmap through a raw pointer, so keep it referenced here
+        size = int(self.ids.max()) + 1 if self.count else 1
+        bitmap = np.zeros(size, dtype=bool)
+        bitmap[self.ids] = True
+        self.bitmap = np.packbits(bitmap, bitorder='little')
+        # The selector's length is in bytes; IDs past the bitmap are not members
+        self.selector = faiss.IDSelectorBitmap(len(self.bitmap), faiss.swig_ptr(self.bitmap))
+
+
+class MetadataFilter:
+    """
+    Turns metadata filters into FAISS ID selectors for one chunk store
+
+    Uses the store's per-row filter columns (source code, page, upload
+    time), so matching is a few vectorized comparisons over the rows instead
+    of decoding metadata. The resulting bitmap is handed to FAISS as an
+    IDSelector, so the index only considers matching chunks and still returns
+    a full k. Recent selections are cached, since users tend to filter
+    repeatedly on the same document.
+
+    Source and file type filters also match chunks deduplicated at ingestion
+    whose duplicates came from a matching source; page and upload time
+    filters look at the stored chunk only.
+    """
+
+    def __init__(self, store, cache_size=64):
+        """
+        Args:
+            store: The ChunkStore to filter
+            cache_size: Number of recent selections kept
+        """
+        self.store = store
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self._columns = None
+
+    @property
+    def columns(self):
+        if self._columns is None:
+            columns = dict(self.store.filter_columns())
+            sources = columns["sources"]
+            columns["source_names"] = [os.path.basename(source) for source in sources]
+            columns["source_types"] = [os.path.splitext(source)[1].lower().lstrip(".") for source in sources]
+            self._columns = columns
+        return self._columns
+
+    def _source_codes(self, predicate):
+        """Boolean table over source codes, with a trailing False for rows without a source"""
+        columns = self.columns
+        table = np.zeros(len(columns["sources"]) + 1, dtype=bool)
+        for code in range(len(columns["sources"])):
+            table[code] = predicate(code)
+        return table
+
+    def _source_mask(self, table):
+        """Rows whose source, or the source of one of their duplicates, passes a code table"""
+        columns = self.columns
+        mask = table[np.asarray(columns["source_codes"])]  # code -1 reads the trailing False
+        duplicate_rows = columns["duplicate_rows"]
+        if len(duplicate_rows):
+            mask[duplicate_rows[table[columns["duplicate_codes"]]]] = True
+        return mask
+
+    def row_mask(self, filters):
+        """Boolean mask over the store rows matching normalized filters"""
+        columns = self.columns
+        mask = np.ones(len(self.store), dtype=bool)
+
+        if "source" in filters:
+            wanted = set(filters["source"])
+            table = self._source_codes(
+                lambda code: columns["sources"][code] in wanted or columns["source_names"][code] in wanted
+            )
+            mask &= self._source_mask(table)
+        if "file_type" in filters:
+            wanted = set(filters["file_type"])
+            table = self._source_codes(lambda code: columns["source_types"][code] in wanted)
+            mask &= self._source_mask(table)
+        if "page" in filters:
+            pages = np.asarray(columns["pages"])
+            first, last = filters["page"]
+            mask &= pages >= 0
+            if first is not None:
+                mask &= pages >= first
+            if last is not None:
+                mask &= pages <= last
+        if "uploaded_after" in filters or "uploaded_before" in filters:
+            uploaded_at = np.asarray(columns["uploaded_at"])
+            with np.errstate(invalid='ignore'):
+                if "uploaded_after" in filters:
+                    mask &= uploaded_at >= filters["uploaded_after"]
+                if "uploaded_before" in filters:
+                    mask &= uploaded_at <= filters["uploaded_before"]
+        return mask
+
+    def select(self, filters):
+        """
+        The FilterSelection for raw filters, or None when they filter nothing
+
+        Raises:
+            FilterError: If the filters are malformed
+        """
+        filters = normalize_filters(filters)
+        if filters is None:
+            return None
+        key = json.dumps(filters, sort_keys=True)
+        with self.lock:
+            selection = self.cache.get(key)
+            if selection is not None:
+                self.cache.move_to_end(key)
+                return selection
+        selection = FilterSelection(self.row_mask(filters), self.store.ids)
+        with self.lock:
+            self.cache[key] = selection
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return selection
@@ -0,0 +1,323 @@
+import time
+import bisect
+import threading
+import contextlib
+import contextvars
+
+# Latency buckets in seconds, from sub-millisecond lookups to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    Base class of the metric types
+
+    A small subset of the prometheus_client API: metrics have a name, help
+    text and optional label names; labels(...) returns the child for one set
+    of label values. All updates are guarded by a lock and cost about a
+    microsecond, so instrumentation can stay on in production.
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.children = {}
+        (REGISTRY if registry is None else registry).register(self)
+
+    def labels(self, *values, **labels):
+        """The child metric for one set of label values"""
+        if labels:
+            values = tuple(labels[name] for name in self.labelnames)
+        values = tuple(str(value) for value in values)
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self._new_child())
+        return child
+
+    def _default(self):
+        """The unlabelled child, for metrics without labels"""
+        return self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, labels, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1.0):
+        with self.lock:
+            self.value += amount
+
+    def set(self, value):
+        with self.lock:
+            self.value = float(value)
+
+
+class Counter(Metric):
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1.0):
+        self._default().inc(amount)
+
+    def samples(self):
+        return [("_total", labels, (), child.value) for labels, child in sorted(self.children.items())]
+
+
+class Gauge(Metric):
+    """Value that can go up and down"""
+
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value):
+        self._default().set(value)
+
+    def inc(self, amount=1.0):
+        self._default().inc(amount)
+
+    def samples(self):
+        return [("", labels, (), child.value) for labels, child in sorted(self.children.items())]
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        position = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[position] += 1
+            self.sum += value
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def samples(self):
+        samples = []
+        for labels, child in sorted(self.children.items()):
+            with child.lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                samples.append(("_bucket", labels, (("le", _format_value(float(bound))),), cumulative))
+            samples.append(("_sum", labels, (), total))
+            samples.append(("_count", labels, (), cumulative))
+        return samples
+
+
+class Registry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)"""
+        with self.lock:
+            metrics = list(self.metrics)
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_seconds", "Time spent in each pipeline stage", ["pipeline", "stage"]
+)
+CHAT_REQUESTS = Counter(
+    "rag_chat_requests", "Chat requests by outcome", ["outcome"]
+)
+CACHE_LOOKUPS = Counter(
+    "rag_cache_lookups", "Answer cache lookups by result", ["result"]
+)
+LLM_REQUESTS = Counter(
+    "rag_llm_requests", "LLM requests by status", ["status"]
+)
+LLM_TOKENS = Counter(
+    "rag_llm_tokens", "LLM tokens used", ["kind"]
+)
+CONTEXT_TOKENS_SAVED = Counter(
+    "rag_context_tokens_saved", "Prompt tokens saved by context packing"
+)
+INDEX_CHUNKS = Gauge(
+    "rag_index_chunks", "Chunks in the loaded index", ["collection"]
+)
+INGESTED_FILES = Counter(
+    "rag_ingest_files", "Files parsed by the document processor"
+)
+INGESTED_CHUNKS = Counter(
+    "rag_ingest_chunks", "Chunks embedded by the document processor"
+)
+DUPLICATE_CHUNKS = Counter(
+    "rag_ingest_duplicate_chunks", "Chunks skipped at ingestion as duplicates", ["kind"]
+)
+DEDUP_RATIO = Gauge(
+    "rag_ingest_dedup_ratio", "Share of parsed chunks that were duplicates in the last ingestion run"
+)
+INGEST_CACHE_LOOKUPS = Counter(
+    "rag_ingest_cache_lookups", "Ingestion cache lookups by stage and result", ["stage", "result"]
+)
+
+STARTUP_SECONDS = Gauge(
+    "rag_startup_seconds", "Seconds spent importing and loading each component", ["component", "phase"]
+)
+
+# Startup steps in the order they finished: (component, phase, seconds)
+_startup_steps = []
+_startup_lock = threading.Lock()
+
+# Per-request stage timings, collected by collect_timings()
+_timings = contextvars.ContextVar("rag_timings", default=None)
+
+
+@contextlib.contextmanager
+def stage(pipeline, name):
+    """
+    Time a block as a pipeline stage
+
+    The duration is observed in rag_stage_seconds and, inside
+    collect_timings(), added to the current request's timings.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(pipeline, name).observe(elapsed)
+        timings = _timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def timed_iter(iterable, pipeline, name):
+    """Yield from iterable, timing each wait for the next item as a stage"""
+    iterator = iter(iterable)
+    while True:
+        with stage(pipeline, name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+@contextlib.contextmanager
+def collect_timings():
+    """
+    Collect the stage timings of the work done in this block
+
+    Yields:
+        A dict filled with stage name -> seconds. Stages run on other threads
+        (e.g. inside the retrieval micro-batcher) are not included.
+    """
+    timings = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+@contextlib.contextmanager
+def startup_step(component, phase):
+    """
+    Time the import or load of a component for the startup report
+
+    Args:
+        component: What is being prepared, e.g. "embedding:all-MiniLM-L6-v2"
+        phase: "import" or "load"
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STARTUP_SECONDS.labels(component, phase).inc(elapsed)
+        with _startup_lock:
+            _startup_steps.append((component, phase, elapsed))
+
+
+def startup_report():
+    """Startup steps so far as dicts with component, phase and milliseconds"""
+    with _startup_lock:
+        steps = list(_startup_steps)
+    return [
+        {"component": component, "phase": phase, "ms": round(seconds * 1000, 1)}
+        for component, phase, seconds in steps
+    ]
+
+
+def format_startup_report():
+    """The startup report as a printable table"""
+    lines = [f"{'component':<40} {'phase':<8} {'ms':>9}"]
+    for step in startup_report():
+        lines.append(f"{step['component']:<40} {step['phase']:<8} {step['ms']:>9.1f}")
+    return "\n".join(lines)
+
+
+def render():
+    """The default registry in Prometheus text format"""
+    return REGISTRY.render()
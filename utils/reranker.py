@@ -0,0 +1,131 @@
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+from utils import metrics
+
+
+class CrossEncoderReranker:
+    """
+    Reorders retrieved chunks with a cross-encoder
+
+    The retriever over-fetches candidates; the cross-encoder reads each
+    (query, chunk) pair together and scores relevance much more accurately
+    than embedding distance, so only the best few chunks reach the prompt.
+
+    Scoring runs in batches on the CPU and is checked against a per-query time
+    budget: if the budget runs out before every candidate is scored, the
+    retriever's own order is kept. Scores are cached per (index version,
+    query, chunk ID): a rebuilt index may reuse chunk IDs for other texts.
+    """
+
+    def __init__(
+        self,
+        model_name="cross-encoder/ms-marco-MiniLM-L-6-v2",
+        batch_size=64,
+        time_budget_ms=250,
+        cache_size=20000,
+        max_length=512,
+        device=None
+    ):
+        """
+        Args:
+            model_name: sentence-transformers CrossEncoder model
+            batch_size: (query, chunk) pairs scored per forward pass
+            time_budget_ms: Scoring time allowed per query (None for no limit)
+            cache_size: Number of (query, chunk) scores remembered
+            max_length: Token limit of a (query, chunk) pair
+            device: Torch device (None lets sentence-transformers choose)
+        """
+        with metrics.startup_step("sentence_transformers", "import"):
+            from sentence_transformers import CrossEncoder
+
+        with metrics.startup_step(f"reranker:{model_name}", "load"):
+            self.model = CrossEncoder(model_name, max_length=max_length, device=device)
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.time_budget = time_budget_ms / 1000.0 if time_budget_ms else None
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"queries": 0, "pairs_scored": 0, "cache_hits": 0, "fallbacks": 0}
+
+    def _cached_scores(self, version, query, ids):
+        """Cached scores for the IDs (NaN where missing)"""
+        scores = np.full(len(ids), np.nan, dtype='float32')
+        with self.lock:
+            for i, chunk_id in enumerate(ids):
+                score = self.cache.get((version, query, chunk_id))
+                if score is not None:
+                    self.cache.move_to_end((version, query, chunk_id))
+                    scores[i] = score
+        return scores
+
+    def _remember(self, version, query, ids, scores):
+        with self.lock:
+            for chunk_id, score in zip(ids, scores):
+                self.cache[(version, query, chunk_id)] = float(score)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def score(self, query, ids, texts, version=None):
+        """
+        Relevance scores of chunks for a query
+
+        Args:
+            version: Build of the index the chunk IDs belong to (see
+                RAGRetriever.index_version); scores are only reused within it
+
+        Returns:
+            A float32 array of scores, or None if the time budget ran out
+        """
+        deadline = time.perf_counter() + self.time_budget if self.time_budget else None
+        scores = self._cached_scores(version, query, ids)
+        missing = np.flatnonzero(np.isnan(scores))
+        self.stats["queries"] += 1
+        self.stats["cache_hits"] += len(ids) - len(missing)
+
+        for start in range(0, len(missing), self.batch_size):
+            if deadline is not None and start > 0 and time.perf_counter() > deadline:
+                self.stats["fallbacks"] += 1
+                return None
+            rows = missing[start:start + self.batch_size]
+            batch_scores = self.model.predict(
+                [(query, texts[row]) for row in rows],
+                batch_size=len(rows),
+                show_progress_bar=False,
+                convert_to_numpy=True
+            )
+            scores[rows] = np.asarray(batch_scores, dtype='float32').reshape(-1)
+            self._remember(version, query, [ids[row] for row in rows], scores[rows])
+            self.stats["pairs_scored"] += len(rows)
+
+        if deadline is not None and len(missing) and time.perf_counter() > deadline:
+            # Finished late: the scores are cached for next time, but this
+            # query keeps the retriever order to stay within its budget
+            self.stats["fallbacks"] += 1
+            return None
+        return scores
+
+    def rerank(self, query, ids, texts, top_k, version=None):
+        """
+        Pick the best top_k candidates
+
+        Args:
+            query: The query text
+            ids: Candidate chunk IDs in retriever order
+            texts: Candidate texts
+            top_k: Number of candidates to keep
+            version: Build of the index the chunk IDs belong to
+
+        Returns:
+            (positions into the candidate lists, best first; their scores, or
+            None when the retriever order was kept)
+        """
+        if not ids:
+            return [], None
+        scores = self.score(query, ids, texts, version)
+        if scores is None:
+            return list(range(min(top_k, len(ids)))), None
+        order = np.argsort(-scores, kind='stable')[:top_k]
+        return order.tolist(), scores[order].tolist()
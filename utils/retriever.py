@@ -1,76 +1,457 @@
-import pickle
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from utils.embeddings import create_embedding_backend
+from utils.chunk_store import ChunkStore, read_index, open_published
+from utils.index_factory import search_parameters
+from utils.batching import MicroBatcher, BatcherClosed
+from utils.bm25 import BM25Index, bm25_exists
+from utils.metadata_filter import MetadataFilter
+from utils import metrics
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Merge ranked ID lists with reciprocal-rank fusion
+
+    Each ID scores sum(1 / (k + rank)) over the lists it appears in (rank
+    starting at 1), so IDs ranked well by several retrievers rise to the top
+    without having to calibrate their raw scores against each other.
+
+    Returns:
+        IDs sorted by fused score, best first
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda doc_id: -scores[doc_id])
+
+
+def maximal_marginal_relevance(query_embedding, embeddings, k, lambda_mult=0.7, by_rank=False):
+    """
+    Pick k relevant but mutually different candidates
+
+    Starts from the top-ranked candidate, then repeatedly adds the one
+    maximizing lambda_mult * relevance(c) - (1 - lambda_mult) * max sim(c, picked),
+    with cosine similarities. All pairwise similarities come from one matrix
+    product (whose diagonal also gives the norms) and each step is a
+    vectorized update, so 100 candidates take well under a millisecond.
+
+    Args:
+        query_embedding: The query vector
+        embeddings: (n, dimension) candidate vectors in retrieval order
+        k: Number of candidates to pick
+        lambda_mult: 1 keeps the retrieval order, 0 picks for diversity only
+        by_rank: Let relevance fall linearly with retrieval rank (across the
+            candidates' range of query similarity) instead of using the query
+            similarity itself; for fused rankings, where keyword hits can
+            rank high with a low cosine similarity
+
+    Returns:
+        Indices into embeddings, in pick order
+    """
+    n = len(embeddings)
+    if n <= k:
+        return list(range(n))
+    vectors = np.asarray(embeddings, dtype='float32')
+    query = np.asarray(query_embedding, dtype='float32').reshape(-1)
+
+    gram = vectors @ vectors.T
+    norms = np.sqrt(np.maximum(np.diagonal(gram), 1e-24))
+    similarity = gram / np.outer(norms, norms)
+    relevance = (vectors @ query) / (norms * max(float(np.linalg.norm(query)), 1e-12))
+    if by_rank:
+        relevance = np.linspace(relevance.max(), relevance.min(), n, dtype='float32')
+
+    relevance *= lambda_mult
+    similarity *= 1 - lambda_mult
+    picked = [0]
+    redundancy = similarity[0].copy()
+    available = np.ones(n, dtype=bool)
+    available[0] = False
+    while len(picked) < k:
+        scores = np.where(available, relevance - redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        picked.append(best)
+        available[best] = False
+        np.maximum(redundancy, similarity[best], out=redundancy)
+    return picked
+
 
 class RAGRetriever:
     def __init__(
-        self, 
-        index_file="faiss_index.pkl", 
-        data_file="documents_data.pkl", 
-        model_name="all-MiniLM-L6-v2", 
-        top_k=5
+        self,
+        index_file="faiss_index.faiss",
+        data_file="documents_data",
+        model_name="all-MiniLM-L6-v2",
+        top_k=5,
+        mmap_index=True,
+        nprobe=None,
+        ef_search=None,
+        embedding_backend="sentence-transformers",
+        embedding_options=None,
+        batch_window_ms=None,
+        max_batch_size=64,
+        bm25_file="bm25_index",
+        hybrid=True,
+        fusion_candidates=None,
+        rrf_k=60,
+        reranker=None,
+        rerank_candidates=50,
+        name="default",
+        mmr=True,
+        mmr_lambda=0.7,
+        mmr_candidates=None
     ):
         """
         Initialize the RAG retriever with FAISS index and data
-        
+
         Args:
-            index_file: Path to the FAISS index file
-            data_file: Path to the document data file
+            index_file: Path to the FAISS index file of a chunk store in the old
+                layout; new builds keep their index in data_file
+            data_file: Path to the chunk store directory
             model_name: Name of the SentenceTransformer model for embeddings
             top_k: Number of most similar documents to retrieve
+            mmap_index: Memory-map the index instead of reading it into RAM
+            nprobe: IVF clusters to visit per query (None keeps the index default)
+            ef_search: HNSW candidate list size per query (None keeps the index default)
+            embedding_backend: "sentence-transformers" or "onnx" (see utils.embeddings)
+            embedding_options: Backend options such as num_threads or quantize
+            batch_window_ms: Coalesce queries arriving within this many milliseconds
+                into one embedding call and one search (None disables micro-batching)
+            max_batch_size: Largest micro-batch
+            bm25_file: Path to the BM25 keyword index directory of a chunk store in
+                the old layout (None for dense-only search)
+            hybrid: Fuse BM25 and dense results when a BM25 index is available
+            fusion_candidates: Results taken from each retriever before fusion
+                (defaults to max(4 * top_k, 20))
+            rrf_k: Reciprocal-rank fusion constant
+            reranker: Optional CrossEncoderReranker (see utils.reranker) that
+                picks the final top_k from rerank_candidates over-fetched chunks
+            rerank_candidates: Candidates fetched per query when reranking
+            name: Collection name used to label metrics
+            mmr: Pick a diverse top_k with maximal marginal relevance, so
+                near-identical overlapping chunks do not fill the prompt
+                (not applied with a reranker, which picks the top_k itself)
+            mmr_lambda: Relevance/diversity trade-off (1 keeps the retrieval order)
+            mmr_candidates: Candidates MMR chooses from (defaults to max(4 * top_k, 20))
         """
-        self.model = SentenceTransformer(model_name)
+        self._init_search(
+            model_name, top_k, nprobe, ef_search, embedding_backend, embedding_options, hybrid,
+            fusion_candidates, rrf_k, reranker, rerank_candidates, name, mmr, mmr_lambda, mmr_candidates
+        )
+
+        self.index_file = index_file
+        self.data_file = data_file
+        self.bm25_file = bm25_file
+        self.mmap_index = mmap_index
+        self._metadata_filter = None
+
+        # Load the FAISS index, open the chunk store and the BM25 index
+        with metrics.startup_step(f"index:{name}", "load"):
+            self.snapshot = open_published(data_file, self.open_snapshot)
+        metrics.INDEX_CHUNKS.labels(name).set(len(self.store))
+
+        self._init_batcher(batch_window_ms, max_batch_size)
+
+    def _init_search(
+        self, model_name, top_k, nprobe, ef_search, embedding_backend, embedding_options, hybrid,
+        fusion_candidates, rrf_k, reranker, rerank_candidates, name, mmr, mmr_lambda, mmr_candidates
+    ):
+        """Set the embedding model and search options (shared with ShardedRetriever)"""
+        self.model = create_embedding_backend(embedding_backend, model_name, **(embedding_options or {}))
         self.top_k = top_k
-        
-        # Load the FAISS index and document data
-        self.index = self.load_index(index_file)
-        self.data = self.load_data(data_file)
-    
-    def load_index(self, index_file):
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.hybrid = hybrid
+        self.fusion_candidates = fusion_candidates or max(4 * top_k, 20)
+        self.rrf_k = rrf_k
+        self.reranker = reranker
+        self.rerank_candidates = rerank_candidates
+        self.name = name
+        self.mmr = mmr
+        self.mmr_lambda = mmr_lambda
+        self.mmr_candidates = mmr_candidates or max(4 * top_k, 20)
+
+    def _init_batcher(self, batch_window_ms, max_batch_size):
+        """Start the micro-batching thread, once the index is loaded"""
+        self.batcher = None
+        if batch_window_ms:
+            self.batcher = MicroBatcher(
+                self._retrieve_batch,
+                window_ms=batch_window_ms,
+                max_batch_size=max_batch_size,
+                name="retrieval-batcher"
+            )
+
+    @property
+    def index(self):
+        return self.snapshot[0]
+
+    @property
+    def store(self):
+        return self.snapshot[1]
+
+    @property
+    def bm25(self):
+        return self.snapshot[2]
+
+    def reload(self):
+        """
+        Load the current index files and swap them in atomically
+
+        The store resolves the published build once, and the index and BM25
+        index are opened from that same build, so they always match even if
+        a new build is published meanwhile. All three are fully opened before
+        a single reference assignment replaces the old ones, so concurrent
+        retrieve() calls see either the old or the new index, never a mix, and
+        in-flight queries finish on the snapshot they started with.
+        """
+        snapshot = open_published(self.data_file, self.open_snapshot)
+        self.snapshot = snapshot
+        metrics.INDEX_CHUNKS.labels(self.name).set(len(snapshot[1]))
+
+    def open_snapshot(self):
+        """Open the published chunk store and the FAISS and BM25 indexes of the same build"""
+        store = self.load_data(self.data_file)
+        return self.load_index(store.index_file or self.index_file, self.mmap_index), store, self.load_bm25(store)
+
+    def close(self):
+        """
+        Stop the micro-batching thread
+
+        Calls still in flight finish; later calls retrieve directly. The index
+        and chunk store are unmapped once the retriever is no longer referenced.
+        """
+        batcher, self.batcher = self.batcher, None
+        if batcher is not None:
+            batcher.close()
+
+    def load_index(self, index_file, mmap_index=True):
         """Load the FAISS index from file"""
-        with open(index_file, 'rb') as f:
-            index = pickle.load(f)
-        return index
-    
+        return read_index(index_file, mmap_index=mmap_index)
+
     def load_data(self, data_file):
-        """Load the document data from file"""
-        with open(data_file, 'rb') as f:
-            data = pickle.load(f)
-        return data
-    
-    def retrieve(self, query, return_embeddings=False):
+        """Open the memory-mapped chunk store"""
+        return ChunkStore(data_file)
+
+    def load_bm25(self, store):
+        """
+        Open the BM25 index if hybrid search is enabled
+
+        Returns:
+            The BM25Index, or None (dense-only search) when it is missing or was
+            built for a different version of the chunk store
+        """
+        if not self.hybrid or not self.bm25_file:
+            return None
+        bm25_file = store.bm25_file or self.bm25_file
+        if not bm25_exists(bm25_file):
+            return None
+        bm25 = BM25Index(bm25_file)
+        if bm25.build_id != store.build_id:
+            print(f"BM25 index {bm25_file} does not match the chunk store; using dense search only")
+            return None
+        return bm25
+
+    @property
+    def index_version(self):
+        """Identifier of the loaded index build, used to invalidate caches"""
+        return self.store.build_id
+
+    def metadata_filter(self, store):
+        """The MetadataFilter of a store snapshot, replaced when the index is reloaded"""
+        metadata_filter = self._metadata_filter
+        if metadata_filter is None or metadata_filter.store is not store:
+            metadata_filter = MetadataFilter(store)
+            self._metadata_filter = metadata_filter
+        return metadata_filter
+
+    def embed_query(self, query):
+        """Embed a query as a (1, dimension) float32 matrix"""
+        # Backends return float32, as FAISS expects
+        with metrics.stage("chat", "embed_query"):
+            return self.model.encode([query])
+
+    def retrieve(self, query, return_embeddings=False, query_embedding=None, filters=None):
         """
         Retrieve the most relevant documents for a query
-        
+
+        With micro-batching enabled, concurrent calls are coalesced into one
+        embedding call and one FAISS search.
+
         Args:
             query: The query text
             return_embeddings: Whether to return document embeddings
-            
+            query_embedding: Precomputed embedding from embed_query, if any
+            filters: Metadata filters (see utils.metadata_filter.normalize_filters)
+
         Returns:
             A dictionary with retrieved documents and their metadata
         """
-        # Create query embedding
-        query_embedding = self.model.encode([query])
-        
-        # Convert to float32 for FAISS
-        query_embedding = query_embedding.astype('float32')
-        
+        # Read once: close() (e.g. on collection eviction) may clear it meanwhile
+        batcher = self.batcher
+        if query_embedding is None and batcher is not None and not filters:
+            try:
+                return batcher.submit((query, return_embeddings))[1]
+            except BatcherClosed:
+                pass
+        return self.retrieve_many([query], return_embeddings, query_embedding, filters)[0]
+
+    def embed_and_retrieve(self, query, filters=None):
+        """
+        Retrieve documents for a query and also return its embedding
+
+        Returns:
+            (query embedding as a (1, dimension) matrix, retrieve() result)
+        """
+        batcher = self.batcher
+        if batcher is not None and not filters:
+            try:
+                return batcher.submit((query, False))
+            except BatcherClosed:
+                pass
+        query_embedding = self.embed_query(query)
+        return query_embedding, self.retrieve_many([query], query_embeddings=query_embedding, filters=filters)[0]
+
+    def _retrieve_batch(self, items):
+        """Process a micro-batch of (query, return_embeddings) items"""
+        queries = [query for query, _ in items]
+        with metrics.stage("chat", "embed_query"):
+            query_embeddings = self.model.encode(queries)
+        results = self.retrieve_many(queries, any(want for _, want in items), query_embeddings)
+        for (_, return_embeddings), result in zip(items, results):
+            if not return_embeddings:
+                result.pop("embeddings", None)
+        return [(query_embeddings[i:i + 1], result) for i, result in enumerate(results)]
+
+    def retrieve_many(self, queries, return_embeddings=False, query_embeddings=None, filters=None):
+        """
+        Retrieve documents for several queries with one embedding call and one search
+
+        With a BM25 index loaded, the dense and keyword rankings are merged with
+        reciprocal-rank fusion, and distances are recomputed exactly from the
+        stored embeddings (keyword-only hits have no FAISS distance). With a
+        reranker, rerank_candidates chunks are fetched and the reranker keeps
+        the best top_k. Filters are applied inside the search through a FAISS
+        ID selector, so a filtered query still returns up to top_k chunks.
+
+        Args:
+            queries: The query texts
+            return_embeddings: Whether to return document embeddings
+            query_embeddings: Precomputed (len(queries), dimension) embeddings, if any
+            filters: Metadata filters applied to all queries
+
+        Returns:
+            A list with one retrieve() result per query
+        """
+        # Create query embeddings
+        if query_embeddings is None:
+            with metrics.stage("chat", "embed_query"):
+                query_embeddings = self.model.encode(queries)
+        query_embeddings = np.ascontiguousarray(query_embeddings, dtype='float32')
+
+        # Use one snapshot for the whole batch in case the index is swapped meanwhile
+        index, store, bm25 = self.snapshot
+
+        selection = self.metadata_filter(store).select(filters) if filters else None
+        if selection is not None and selection.count == 0:
+            return [self.empty_result(query, return_embeddings) for query in queries]
+
+        n_candidates = self.candidate_count()
+
         # Search the index
-        distances, indices = self.index.search(query_embedding, self.top_k)
-        
-        # Get the corresponding texts and metadata
-        retrieved_texts = [self.data["texts"][i] for i in indices[0]]
-        retrieved_metadata = [self.data["metadata"][i] for i in indices[0]]
-        
-        result = {
-            "query": query,
-            "texts": retrieved_texts,
-            "metadata": retrieved_metadata,
-            "distances": distances[0].tolist()
-        }
-        
+        k = n_candidates if bm25 is None else max(n_candidates, self.fusion_candidates)
+        selector = selection.selector if selection is not None else None
+        params = search_parameters(index, nprobe=self.nprobe, ef_search=self.ef_search, selector=selector)
+        with metrics.stage("chat", "search"):
+            distances, indices = index.search(query_embeddings, k, params=params)
+
+        results = []
+        for query, query_embedding, row_ids, row_distances in zip(queries, query_embeddings, indices, distances):
+            # Drop the -1 padding FAISS returns when the index holds fewer than k vectors
+            hits = [(int(i), float(d)) for i, d in zip(row_ids, row_distances) if i != -1]
+            if selection is not None and len(hits) < min(k, selection.count):
+                # IVF and HNSW can miss matches of a narrow filter; search them exactly
+                hits = self.exact_search(store, selection.rows, query_embedding, k)
+            ids = [i for i, _ in hits]
+
+            if bm25 is not None:
+                with metrics.stage("chat", "keyword_search"):
+                    keyword_ids, _ = bm25.search(query, k, row_mask=selection.row_mask if selection is not None else None)
+                ids = reciprocal_rank_fusion([ids, keyword_ids.tolist()], self.rrf_k)[:n_candidates]
+                hits = None
+
+            if self.use_mmr and len(ids) > self.top_k:
+                with metrics.stage("chat", "mmr"):
+                    vectors = store.embeddings[store.rows_for_ids(ids)]
+                    keep = maximal_marginal_relevance(
+                        query_embedding, vectors, self.top_k, self.mmr_lambda, by_rank=bm25 is not None
+                    )
+                ids = [ids[i] for i in keep]
+                if hits is not None:
+                    hits = [hits[i] for i in keep]
+
+            # Read only the retrieved rows from the chunk store
+            with metrics.stage("chat", "fetch_chunks"):
+                chunks = store.get(ids)
+
+            rerank_scores = None
+            if self.reranker is not None:
+                with metrics.stage("chat", "rerank"):
+                    keep, rerank_scores = self.reranker.rerank(query, ids, chunks["texts"], self.top_k, store.build_id)
+                ids = [ids[i] for i in keep]
+                chunks = {key: [values[i] for i in keep] for key, values in chunks.items()}
+                if hits is not None:
+                    hits = [hits[i] for i in keep]
+
+            if hits is None:
+                vectors = np.asarray(store.embeddings[chunks["rows"]], dtype='float32')
+                hit_distances = np.sum((vectors - query_embedding) ** 2, axis=1).tolist()
+            else:
+                hit_distances = [d for _, d in hits]
+
+            result = {
+                "query": query,
+                "ids": ids,
+                "texts": chunks["texts"],
+                "metadata": chunks["metadata"],
+                "distances": hit_distances
+            }
+
+            if rerank_scores is not None:
+                result["rerank_scores"] = rerank_scores
+
+            if return_embeddings:
+                result["embeddings"] = [np.asarray(store.embeddings[row]) for row in chunks["rows"]]
+
+            results.append(result)
+
+        return results
+
+    @property
+    def use_mmr(self):
+        return self.mmr and self.reranker is None
+
+    def candidate_count(self):
+        """Chunks kept per query before the final top_k is picked"""
+        # Over-fetch when a reranker or MMR picks the final top_k
+        if self.reranker is not None:
+            return max(self.top_k, self.rerank_candidates)
+        if self.use_mmr:
+            return max(self.top_k, self.mmr_candidates)
+        return self.top_k
+
+    @staticmethod
+    def exact_search(store, rows, query_embedding, k):
+        """Brute-force top-k over some store rows, as (id, distance) pairs"""
+        vectors = np.asarray(store.embeddings[rows], dtype='float32')
+        distances = np.sum((vectors - query_embedding) ** 2, axis=1)
+        best = np.argsort(distances, kind='stable')[:k]
+        return [(int(store.ids[rows[i]]), float(distances[i])) for i in best]
+
+    @staticmethod
+    def empty_result(query, return_embeddings=False):
+        result = {"query": query, "ids": [], "texts": [], "metadata": [], "distances": []}
         if return_embeddings:
-            retrieved_embeddings = [self.data["embeddings"][i] for i in indices[0]]
-            result["embeddings"] = retrieved_embeddings
-        
-        return result
\ No newline at end of file
+            result["embeddings"] = []
+        return result
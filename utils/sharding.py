@@ -0,0 +1,696 @@
+"""
+Sharded indexes searched with scatter-gather
+
+A sharded index is a directory of N independent shards, each a FAISS index,
+chunk store, BM25 index and manifest of its own:
+
+    index_shards/
+        shards.json        shard count and format version
+        shard_000/         documents_data/ (chunk store, FAISS and BM25 index), index_manifest.json
+        shard_001/
+        ...
+
+Source files are routed to shards by a stable hash of their path, so a file's
+chunks stay together and incremental updates touch only the shards whose files
+changed. A query is embedded once, every shard is searched in parallel (by
+threads, worker processes or shard servers), and the per-shard candidates are
+merged: dense hits by distance, keyword hits by their rank within their shard
+(BM25 scores depend on each shard's own term statistics), then fused with
+reciprocal-rank fusion as in RAGRetriever.
+
+Run a shard server:
+    SHARD_AUTHKEY=<secret> python -m utils.sharding serve index_shards/shard_000 --port 7001
+Build a sharded index:
+    python -m utils.sharding build --data-dir data --shards-dir index_shards --shards 4
+"""
+import os
+import json
+import threading
+import argparse
+import itertools
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+from utils.chunk_store import ChunkStore, read_index, index_exists, open_published
+from utils.index_factory import search_parameters
+from utils.bm25 import BM25Index, bm25_exists
+from utils.embeddings import create_embedding_backend
+from utils.document_processor import DocumentProcessor, shard_for_file
+from utils.retriever import RAGRetriever, reciprocal_rank_fusion, maximal_marginal_relevance
+from utils.metadata_filter import MetadataFilter, normalize_filters
+from utils import metrics
+
+SHARDS_FILE = "shards.json"
+SHARDS_VERSION = 1
+SHARD_MODES = ("threads", "processes")
+
+
+def sharded_index_exists(shards_dir):
+    return os.path.exists(os.path.join(shards_dir, SHARDS_FILE))
+
+
+def shard_authkey():
+    """
+    Shared secret of shard servers and clients, from SHARD_AUTHKEY
+
+    Messages are pickled, so whoever knows the key can run code on a shard
+    server; there is deliberately no default.
+
+    Raises:
+        ValueError: SHARD_AUTHKEY is unset or empty
+    """
+    authkey = os.environ.get("SHARD_AUTHKEY")
+    if not authkey:
+        raise ValueError("Set SHARD_AUTHKEY to the same secret on shard servers and their clients")
+    return authkey.encode('utf-8')
+
+
+def global_id(local_id, shard, n_shards):
+    """Chunk ID unique across shards"""
+    return local_id * n_shards + shard
+
+
+class ShardLayout:
+    """File locations of a sharded index"""
+
+    def __init__(self, shards_dir, n_shards):
+        self.shards_dir = shards_dir
+        self.n_shards = n_shards
+
+    @classmethod
+    def load(cls, shards_dir):
+        with open(os.path.join(shards_dir, SHARDS_FILE), 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        if info.get("version") != SHARDS_VERSION:
+            raise ValueError(f"Unsupported sharded index version in {shards_dir}: {info.get('version')}")
+        return cls(shards_dir, info["n_shards"])
+
+    def save(self):
+        os.makedirs(self.shards_dir, exist_ok=True)
+        with open(os.path.join(self.shards_dir, SHARDS_FILE), 'w', encoding='utf-8') as f:
+            json.dump({"version": SHARDS_VERSION, "n_shards": self.n_shards}, f)
+
+    def shard_dir(self, shard):
+        return os.path.join(self.shards_dir, f"shard_{shard:03d}")
+
+    def paths(self, shard):
+        return shard_paths(self.shard_dir(shard))
+
+
+def shard_paths(shard_dir):
+    """index_file, data_file, manifest_file and bm25_file of a shard directory"""
+    return {
+        "index_file": os.path.join(shard_dir, "faiss_index.faiss"),
+        "data_file": os.path.join(shard_dir, "documents_data"),
+        "manifest_file": os.path.join(shard_dir, "index_manifest.json"),
+        "bm25_file": os.path.join(shard_dir, "bm25_index")
+    }
+
+
+class ShardedDocumentProcessor:
+    """
+    Builds and updates a sharded index
+
+    Each shard is maintained by a DocumentProcessor restricted to the files
+    routed to it, so it keeps its own manifest and is updated incrementally.
+    The embedding model is loaded once and shared by all shards.
+    """
+
+    def __init__(
+        self,
+        data_dir,
+        shards_dir="index_shards",
+        n_shards=4,
+        model_name="all-MiniLM-L6-v2",
+        embedding_backend="sentence-transformers",
+        embedding_options=None,
+        **processor_options
+    ):
+        """
+        Args:
+            data_dir: Directory containing documents to process
+            shards_dir: Directory of the sharded index
+            n_shards: Number of shards; must match an existing sharded index
+            model_name: Name of the SentenceTransformer model
+            embedding_backend: Backend name or EmbeddingBackend instance
+            embedding_options: Backend options such as batch_size or num_threads
+            processor_options: Other DocumentProcessor options (index_type, workers, ...)
+        """
+        if sharded_index_exists(shards_dir):
+            existing = ShardLayout.load(shards_dir).n_shards
+            if existing != n_shards:
+                raise ValueError(
+                    f"{shards_dir} has {existing} shards, not {n_shards}; "
+                    "build the new layout into another directory"
+                )
+        self.data_dir = data_dir
+        self.layout = ShardLayout(shards_dir, n_shards)
+        self.model_name = model_name
+        self.embedding_backend = embedding_backend
+        self.embedding_options = embedding_options
+        self.processor_options = processor_options
+
+    def shard_processor(self, shard, embedding_backend=None):
+        return DocumentProcessor(
+            data_dir=self.data_dir,
+            model_name=self.model_name,
+            embedding_backend=embedding_backend or self.embedding_backend,
+            embedding_options=self.embedding_options,
+            shard=(shard, self.layout.n_shards),
+            **self.layout.paths(shard),
+            **self.processor_options
+        )
+
+    def process_documents(self, incremental=True, progress=None):
+        """
+        Update every shard
+
+        Args:
+            incremental: Reuse existing shard indexes and manifests when possible
+            progress: Optional callback progress(stage, current=None, total=None);
+                stages are prefixed with the shard ("shard 2/4: embedding")
+
+        Returns:
+            The total number of chunks
+        """
+        progress = progress or (lambda stage, current=None, total=None: None)
+        n_shards = self.layout.n_shards
+        self.layout.save()
+        backend = create_embedding_backend(self.embedding_backend, self.model_name, **(self.embedding_options or {}))
+
+        total_chunks = 0
+        for shard in range(n_shards):
+            processor = self.shard_processor(shard, backend)
+            if not processor.list_source_files() and not processor.index_exists():
+                print(f"Shard {shard + 1}/{n_shards}: no files")
+                continue
+            print(f"Shard {shard + 1}/{n_shards}:")
+
+            def shard_progress(stage, current=None, total=None, shard=shard):
+                progress(f"shard {shard + 1}/{n_shards}: {stage}", current, total)
+
+            _, store = processor.process_documents(incremental=incremental, progress=shard_progress)
+            total_chunks += len(store)
+            store.close()
+
+        if not total_chunks:
+            raise ValueError(f"No documents found to index in {self.data_dir}")
+        progress("done", total_chunks, total_chunks)
+        return total_chunks
+
+    def remove_file(self, file_path):
+        """Remove a file's vectors from the shard that holds it"""
+        shard = shard_for_file(file_path, self.data_dir, self.layout.n_shards)
+        return self.shard_processor(shard).remove_file(file_path)
+
+
+class ShardSearcher:
+    """Searches one shard and returns candidates with global chunk IDs"""
+
+    def __init__(self, shard_dir, shard, n_shards, hybrid=True, mmap_index=True):
+        paths = shard_paths(shard_dir)
+        self.shard = shard
+        self.n_shards = n_shards
+        self.index, self.store, self.bm25, self.metadata_filter = None, None, None, None
+        if not index_exists(paths["index_file"], paths["data_file"]):
+            return  # Empty shard: no files were routed to it
+
+        def open_files():
+            store = ChunkStore(paths["data_file"])
+            index = read_index(store.index_file or paths["index_file"], mmap_index=mmap_index)
+            bm25_file = store.bm25_file or paths["bm25_file"]
+            bm25 = BM25Index(bm25_file) if hybrid and bm25_exists(bm25_file) else None
+            return index, store, bm25
+
+        self.index, self.store, bm25 = open_published(paths["data_file"], open_files)
+        self.metadata_filter = MetadataFilter(self.store)
+        if bm25 is not None and bm25.build_id == self.store.build_id:
+            self.bm25 = bm25
+
+    @property
+    def build_id(self):
+        return self.store.build_id if self.store is not None else None
+
+    def search(self, query_embeddings, queries, k, nprobe=None, ef_search=None, return_embeddings=False, filters=None):
+        """
+        Dense and keyword top-k of each query, among the chunks matching filters
+
+        Returns:
+            One dict per query: "dense" [(id, distance)], "keyword" [(id, score)]
+            and "chunks" {id: {"text", "metadata", "distance"(, "embedding")}}
+            for every candidate, with distances computed from the stored embeddings
+        """
+        selection = self.metadata_filter.select(filters) if self.index is not None and filters else None
+        if self.index is None or (selection is not None and selection.count == 0):
+            return [{"dense": [], "keyword": [], "chunks": {}} for _ in queries]
+
+        query_embeddings = np.ascontiguousarray(query_embeddings, dtype='float32')
+        selector = selection.selector if selection is not None else None
+        params = search_parameters(self.index, nprobe=nprobe, ef_search=ef_search, selector=selector)
+        distances, indices = self.index.search(query_embeddings, k, params=params)
+
+        results = []
+        for query, query_embedding, row_ids, row_distances in zip(queries, query_embeddings, indices, distances):
+            dense = [(int(i), float(d)) for i, d in zip(row_ids, row_distances) if i != -1]
+            if selection is not None and len(dense) < min(k, selection.count):
+                dense = RAGRetriever.exact_search(self.store, selection.rows, query_embedding, k)
+            keyword = []
+            if self.bm25 is not None:
+                row_mask = selection.row_mask if selection is not None else None
+                keyword_ids, keyword_scores = self.bm25.search(query, k, row_mask=row_mask)
+                keyword = list(zip(keyword_ids.tolist(), keyword_scores.tolist()))
+
+            candidate_ids = list(dict.fromkeys([i for i, _ in dense] + [i for i, _ in keyword]))
+            chunks = self.store.get(candidate_ids)
+            vectors = np.asarray(self.store.embeddings[chunks["rows"]], dtype='float32')
+            exact = np.sum((vectors - query_embedding) ** 2, axis=1).tolist()
+
+            to_global = lambda local_id: global_id(local_id, self.shard, self.n_shards)
+            candidates = {}
+            for position, local_id in enumerate(candidate_ids):
+                candidate = {
+                    "text": chunks["texts"][position],
+                    "metadata": chunks["metadata"][position],
+                    "distance": exact[position]
+                }
+                if return_embeddings:
+                    candidate["embedding"] = vectors[position]
+                candidates[to_global(local_id)] = candidate
+            results.append({
+                "dense": [(to_global(i), d) for i, d in dense],
+                "keyword": [(to_global(i), s) for i, s in keyword],
+                "chunks": candidates
+            })
+        return results
+
+
+def merge_keyword_rankings(rankings):
+    """
+    Interleave per-shard BM25 rankings by rank
+
+    Returns:
+        The (id, score) hits of all rankings: every shard's first hit, then
+        every shard's second hit and so on, by score within the same rank
+    """
+    merged = []
+    for hits in itertools.zip_longest(*rankings):
+        merged.extend(sorted((hit for hit in hits if hit is not None), key=lambda hit: -hit[1]))
+    return merged
+
+
+# Shard searchers opened in this process, by (shard directory, hybrid): (generation, searcher)
+_searchers = {}
+_searchers_lock = threading.Lock()
+
+
+def open_shard(shard_dir, shard, n_shards, generation, hybrid=True):
+    """Cached ShardSearcher, reopened when the generation changes (after a reload)"""
+    with _searchers_lock:
+        key = (shard_dir, hybrid)
+        entry = _searchers.get(key)
+        if entry is None or entry[0] != generation:
+            entry = (generation, ShardSearcher(shard_dir, shard, n_shards, hybrid=hybrid))
+            _searchers[key] = entry
+        return entry[1]
+
+
+def search_shard(shard_dir, shard, n_shards, generation, hybrid, query_embeddings, queries, k, options):
+    """Search one shard; top-level so worker processes can run it"""
+    searcher = open_shard(shard_dir, shard, n_shards, generation, hybrid)
+    return searcher.search(query_embeddings, queries, k, **options)
+
+
+def shard_build_id(shard_dir, shard, n_shards, generation, hybrid):
+    return open_shard(shard_dir, shard, n_shards, generation, hybrid).build_id
+
+
+class LocalShardBackend:
+    """
+    Searches shards on disk with a thread or process pool
+
+    FAISS and NumPy release the GIL during search, so threads already use
+    several cores; processes also parallelize the Python parts (BM25 scoring,
+    chunk decoding) at the cost of pickling the candidates.
+    """
+
+    def __init__(self, layout, hybrid=True, mode="threads", workers=None):
+        if mode not in SHARD_MODES:
+            raise ValueError(f"Unknown shard mode '{mode}', expected one of {SHARD_MODES}")
+        self.layout = layout
+        self.hybrid = hybrid
+        self.generation = 0
+        self.mode = mode
+        self.workers = workers or min(layout.n_shards, os.cpu_count() or 1)
+        self._executor, self._pid = None, None
+        self.lock = threading.Lock()
+
+    @property
+    def executor(self):
+        """The worker pool, created on first use in each process (pools do not survive a fork)"""
+        with self.lock:
+            if self._executor is None or self._pid != os.getpid():
+                executor_class = ThreadPoolExecutor if self.mode == "threads" else ProcessPoolExecutor
+                self._executor, self._pid = executor_class(max_workers=self.workers), os.getpid()
+            return self._executor
+
+    def _shard_args(self, shard):
+        return self.layout.shard_dir(shard), shard, self.layout.n_shards, self.generation, self.hybrid
+
+    def search(self, query_embeddings, queries, k, options):
+        futures = [
+            self.executor.submit(search_shard, *self._shard_args(shard), query_embeddings, queries, k, options)
+            for shard in range(self.layout.n_shards)
+        ]
+        return [future.result() for future in futures]
+
+    def build_ids(self):
+        return [shard_build_id(*self._shard_args(shard)) for shard in range(self.layout.n_shards)]
+
+    def reload(self):
+        """Reopen the shards on their next search"""
+        self.generation += 1
+
+    def close(self):
+        with self.lock:
+            executor, self._executor = self._executor, None
+        if executor is not None and self._pid == os.getpid():
+            executor.shutdown(wait=True)
+
+
+class RemoteShardBackend:
+    """
+    Searches shards served by `python -m utils.sharding serve`
+
+    Requests are pickled over multiprocessing connections authenticated with
+    SHARD_AUTHKEY; keep shard servers on a trusted network.
+    """
+
+    def __init__(self, addresses):
+        """
+        Args:
+            addresses: (host, port) of each shard's server, in shard order
+        """
+        self.authkey = shard_authkey()
+        self.addresses = [tuple(address) for address in addresses]
+        self.connections = [[] for _ in self.addresses]  # idle connections per shard
+        self.lock = threading.Lock()
+        self._executor, self._pid = None, None
+
+    @property
+    def executor(self):
+        """The client pool; a forked worker drops the parent's pool and connections"""
+        with self.lock:
+            if self._executor is None or self._pid != os.getpid():
+                if self._pid is not None and self._pid != os.getpid():
+                    self.connections = [[] for _ in self.addresses]
+                self._executor = ThreadPoolExecutor(max_workers=len(self.addresses), thread_name_prefix="shard-client")
+                self._pid = os.getpid()
+            return self._executor
+
+    def call(self, shard, method, *args):
+        with self.lock:
+            connection = self.connections[shard].pop() if self.connections[shard] else None
+        if connection is None:
+            connection = Client(self.addresses[shard], authkey=self.authkey)
+        try:
+            connection.send((method, args))
+            ok, result = connection.recv()
+        except Exception:
+            connection.close()
+            raise
+        with self.lock:
+            self.connections[shard].append(connection)
+        if not ok:
+            raise RuntimeError(f"Shard server {self.addresses[shard]} failed: {result}")
+        return result
+
+    def _call_all(self, method, *args):
+        futures = [self.executor.submit(self.call, shard, method, *args) for shard in range(len(self.addresses))]
+        return [future.result() for future in futures]
+
+    def search(self, query_embeddings, queries, k, options):
+        return self._call_all("search", query_embeddings, queries, k, options)
+
+    def build_ids(self):
+        return self._call_all("build_id")
+
+    def reload(self):
+        self._call_all("reload")
+
+    def close(self):
+        with self.lock:
+            executor, self._executor = self._executor, None
+        if executor is not None and self._pid == os.getpid():
+            executor.shutdown(wait=True)
+        with self.lock:
+            for connections in self.connections:
+                for connection in connections:
+                    connection.close()
+                connections.clear()
+
+
+class ShardServer:
+    """Serves searches of one shard to RemoteShardBackend clients"""
+
+    def __init__(self, shard_dir, shard, n_shards, hybrid=True):
+        self.shard_dir = shard_dir
+        self.shard = shard
+        self.n_shards = n_shards
+        self.hybrid = hybrid
+        self.searcher = ShardSearcher(shard_dir, shard, n_shards, hybrid=hybrid)
+
+    def handle(self, method, args):
+        if method == "search":
+            query_embeddings, queries, k, options = args
+            return self.searcher.search(query_embeddings, queries, k, **options)
+        if method == "build_id":
+            return self.searcher.build_id
+        if method == "reload":
+            self.searcher = ShardSearcher(self.shard_dir, self.shard, self.n_shards, hybrid=self.hybrid)
+            return self.searcher.build_id
+        raise ValueError(f"Unknown method '{method}'")
+
+    def serve_connection(self, connection):
+        with connection:
+            while True:
+                try:
+                    method, args = connection.recv()
+                except EOFError:
+                    return
+                try:
+                    connection.send((True, self.handle(method, args)))
+                except Exception as e:
+                    connection.send((False, str(e)))
+
+    def serve_forever(self, host="127.0.0.1", port=7000, ready=None):
+        """
+        Accept clients until the process is stopped
+
+        Args:
+            host, port: Address to listen on
+            ready: Optional callback ready(address) once listening
+        """
+        with Listener((host, port), authkey=shard_authkey()) as listener:
+            print(f"Serving shard {self.shard + 1}/{self.n_shards} ({self.shard_dir}) on {host}:{port}")
+            if ready is not None:
+                ready(listener.address)
+            while True:
+                try:
+                    connection = listener.accept()
+                except (AuthenticationError, OSError) as e:
+                    # A client with the wrong key must not stop the server
+                    print(f"Rejected shard client: {str(e)}")
+                    continue
+                threading.Thread(target=self.serve_connection, args=(connection,), daemon=True).start()
+
+
+class ShardedRetriever(RAGRetriever):
+    """
+    RAGRetriever over a sharded index
+
+    Queries are embedded once (micro-batched like RAGRetriever), all shards
+    are searched in parallel, and the candidates are merged into the same
+    result format, so it is a drop-in replacement in RAGChatbot. The backend
+    opens the shards' files, so index, store and bm25 are None here.
+    """
+
+    def __init__(
+        self,
+        shards_dir="index_shards",
+        model_name="all-MiniLM-L6-v2",
+        top_k=5,
+        nprobe=None,
+        ef_search=None,
+        embedding_backend="sentence-transformers",
+        embedding_options=None,
+        batch_window_ms=None,
+        max_batch_size=64,
+        hybrid=True,
+        fusion_candidates=None,
+        rrf_k=60,
+        reranker=None,
+        rerank_candidates=50,
+        name="default",
+        mmr=True,
+        mmr_lambda=0.7,
+        mmr_candidates=None,
+        mode="threads",
+        workers=None,
+        addresses=None
+    ):
+        """
+        Initialize the sharded retriever
+
+        Args:
+            shards_dir: Directory of the sharded index (not needed with addresses)
+            mode: "threads" or "processes" to search the shards in this machine
+            workers: Size of the thread or process pool (defaults to one per shard, up to the CPU count)
+            addresses: (host, port) of shard servers to search instead of local files
+            Other arguments as for RAGRetriever
+        """
+        self._init_search(
+            model_name, top_k, nprobe, ef_search, embedding_backend, embedding_options, hybrid,
+            fusion_candidates, rrf_k, reranker, rerank_candidates, name, mmr, mmr_lambda, mmr_candidates
+        )
+        self.shards_dir = shards_dir
+
+        # There is no single index: the backend opens each shard's files
+        self.index_file, self.data_file, self.bm25_file = None, None, None
+        self.mmap_index = True
+        self._metadata_filter = None
+        self.snapshot = (None, None, None)
+
+        if addresses:
+            self.backend = RemoteShardBackend(addresses)
+        else:
+            self.backend = LocalShardBackend(ShardLayout.load(shards_dir), hybrid=hybrid, mode=mode, workers=workers)
+        self.build_ids = self.backend.build_ids()
+
+        self._init_batcher(batch_window_ms, max_batch_size)
+
+    def reload(self):
+        """Reopen the shards; searches already running finish on the old files"""
+        self.backend.reload()
+        self.build_ids = self.backend.build_ids()
+
+    @property
+    def index_version(self):
+        return "+".join(str(build_id) for build_id in self.build_ids)
+
+    def close(self):
+        super().close()
+        self.backend.close()
+
+    def retrieve_many(self, queries, return_embeddings=False, query_embeddings=None, filters=None):
+        """
+        Retrieve documents for several queries from all shards
+
+        Each shard returns its dense and keyword top-k. Dense hits are merged
+        by distance, which gives the dense top-k a single index of the same
+        chunks would (exactly for flat indexes). BM25 scores are not
+        comparable across shards, since IDF and average length come from each
+        shard's own chunks, so keyword hits are interleaved by their rank
+        within their shard instead, best score first among equal ranks.
+        """
+        if query_embeddings is None:
+            with metrics.stage("chat", "embed_query"):
+                query_embeddings = self.model.encode(queries)
+        query_embeddings = np.ascontiguousarray(query_embeddings, dtype='float32')
+
+        n_candidates = self.candidate_count()
+        k = n_candidates if not self.hybrid else max(n_candidates, self.fusion_candidates)
+
+        options = {
+            "nprobe": self.nprobe,
+            "ef_search": self.ef_search,
+            "return_embeddings": return_embeddings or self.use_mmr,
+            "filters": normalize_filters(filters)
+        }
+        with metrics.stage("chat", "search"):
+            shard_results = self.backend.search(query_embeddings, list(queries), k, options)
+
+        results = []
+        for position, query in enumerate(queries):
+            candidates = [shard[position] for shard in shard_results]
+            dense = sorted((hit for c in candidates for hit in c["dense"]), key=lambda hit: hit[1])[:k]
+            keyword = merge_keyword_rankings([c["keyword"] for c in candidates])[:k]
+            chunks = {}
+            for c in candidates:
+                chunks.update(c["chunks"])
+
+            ids = [i for i, _ in dense]
+            if keyword:
+                ids = reciprocal_rank_fusion([ids, [i for i, _ in keyword]], self.rrf_k)
+            ids = ids[:n_candidates]
+
+            if self.use_mmr and len(ids) > self.top_k:
+                with metrics.stage("chat", "mmr"):
+                    vectors = np.stack([chunks[i]["embedding"] for i in ids])
+                    keep = maximal_marginal_relevance(
+                        query_embeddings[position], vectors, self.top_k, self.mmr_lambda, by_rank=bool(keyword)
+                    )
+                ids = [ids[i] for i in keep]
+
+            rerank_scores = None
+            if self.reranker is not None:
+                with metrics.stage("chat", "rerank"):
+                    keep, rerank_scores = self.reranker.rerank(
+                        query, ids, [chunks[i]["text"] for i in ids], self.top_k, self.index_version
+                    )
+                ids = [ids[i] for i in keep]
+
+            result = {
+                "query": query,
+                "ids": ids,
+                "texts": [chunks[i]["text"] for i in ids],
+                "metadata": [chunks[i]["metadata"] for i in ids],
+                "distances": [chunks[i]["distance"] for i in ids]
+            }
+
+            if rerank_scores is not None:
+                result["rerank_scores"] = rerank_scores
+
+            if return_embeddings:
+                result["embeddings"] = [np.asarray(chunks[i]["embedding"]) for i in ids]
+
+            results.append(result)
+
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or serve a sharded index")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="Build or update a sharded index")
+    build.add_argument("--data-dir", default="data")
+    build.add_argument("--shards-dir", default="index_shards")
+    build.add_argument("--shards", type=int, default=4)
+    build.add_argument("--index-type", default="flat")
+    build.add_argument("--full", action="store_true", help="Rebuild instead of updating incrementally")
+
+    serve = commands.add_parser("serve", help="Serve one shard to ShardedRetriever(addresses=...)")
+    serve.add_argument("shard_dir", help="Shard directory, e.g. index_shards/shard_000")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=7000)
+    serve.add_argument("--no-hybrid", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        processor = ShardedDocumentProcessor(args.data_dir, args.shards_dir, args.shards, index_type=args.index_type)
+        total = processor.process_documents(incremental=not args.full)
+        print(f"Sharded index has {total} chunks in {args.shards} shards")
+    else:
+        shard_dir = os.path.normpath(args.shard_dir)
+        layout = ShardLayout.load(os.path.dirname(shard_dir))
+        shard = int(os.path.basename(shard_dir).rsplit("_", 1)[1])
+        try:
+            shard_authkey()
+        except ValueError as e:
+            parser.error(str(e))
+        ShardServer(shard_dir, shard, layout.n_shards, hybrid=not args.no_hybrid).serve_forever(args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import os
+import json
+import zlib
+import uuid
+from importlib import metadata as importlib_metadata
+
+# Bump when an extractor's output changes for the same input
+PDF_EXTRACTORS = {
+    "pypdf": {"version": 1, "package": "pypdf"},
+    "pymupdf": {"version": 1, "package": "pymupdf"}
+}
+
+_package_versions = {}
+
+
+def extractor_version(extractor):
+    """Version tag of an extractor: our own version plus the installed library's"""
+    spec = PDF_EXTRACTORS[extractor]
+    package = spec["package"]
+    if package not in _package_versions:
+        try:
+            _package_versions[package] = importlib_metadata.version(package)
+        except importlib_metadata.PackageNotFoundError:
+            _package_versions[package] = "none"
+    return f"v{spec['version']}-{_package_versions[package]}"
+
+
+class TextCache:
+    """
+    Content-addressed cache of text extracted from PDFs
+
+    Entries are keyed by the SHA-256 of the file's contents and the
+    extractor's version, so a file is only parsed again when its bytes, the
+    extractor or the extracting library change. Chunking settings and the
+    embedding model are not part of the key, so trying new ones reuses the
+    extracted text. Each entry is one zlib-compressed JSON file of
+    [text, metadata] pages, written atomically; the directory can be deleted
+    at any time.
+    """
+
+    def __init__(self, cache_dir, level=6):
+        """
+        Args:
+            cache_dir: Directory of the cache entries
+            level: zlib compression level
+        """
+        self.cache_dir = cache_dir
+        self.level = level
+
+    def path(self, file_hash, extractor):
+        key = f"{file_hash}-{extractor}-{extractor_version(extractor)}"
+        return os.path.join(self.cache_dir, file_hash[:2], f"{key}.json.z")
+
+    def get(self, file_hash, extractor):
+        """
+        Cached pages of a file
+
+        Returns:
+            A list of (text, metadata) tuples, or None on a miss
+        """
+        try:
+            with open(self.path(file_hash, extractor), 'rb') as f:
+                pages = json.loads(zlib.decompress(f.read()).decode('utf-8'))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, zlib.error) as e:
+            print(f"Ignoring unreadable text cache entry for {file_hash}: {str(e)}")
+            return None
+        return [(text, meta) for text, meta in pages]
+
+    def put(self, file_hash, extractor, pages):
+        """Store the (text, metadata) pages of a file"""
+        path = self.path(file_hash, extractor)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps([[text, meta] for text, meta in pages], ensure_ascii=False, default=str)
+        tmp_path = f"{path}.tmp-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        with open(tmp_path, 'wb') as f:
+            f.write(zlib.compress(data.encode('utf-8'), self.level))
+        os.replace(tmp_path, path)
@@ -0,0 +1,16 @@
+"""
+Production entry point
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+With preload_app (set in gunicorn.conf.py) this module is imported once in the
+gunicorn master. The warm-up below loads the embedding model and the
+memory-mapped index there, before the workers are forked, so every worker
+shares them copy-on-write instead of loading its own copy.
+"""
+from utils import metrics
+
+with metrics.startup_step("app", "import"):
+    from app import app, warm_up
+
+warm_up()